@@ -1,53 +1,110 @@
+"""
+PhotoMint watermark API (Vercel serverless function)
+
+Embeds, extracts and verifies the same invisible DWT-DCT watermark as
+watermark-service/watermark_server.py, with that service's own modules:
+watermark_payload for the payload format, dwt_dct_engine for the engine,
+image_encoders for the output file and watermark_verification for the
+payload sizes tried and how /verify grades an image. The responses match the service's
+JSON API, so the frontend can point at either one.
+
+Cold starts stay short because the module imports only Flask, the
+payload code and the verification levels, which are standard library only. NumPy, OpenCV and the engine
+are loaded by the first request that touches pixels (image_stack), so
+/health never pays for them. imwatermark is never imported: the native
+engine is bit-compatible with its dwtDct method, and importing it alone
+takes seconds.
+"""
+
+import time
+
+STARTED = time.perf_counter()
+
+import base64
+import binascii
+import hashlib
+import os
+import sys
+
 from flask import Flask, request, jsonify
 from flask_cors import CORS
-import base64
-import io
-import json
+
+# The shared modules live in the watermark service (bundled via vercel.json)
+SHARED_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'watermark-service')
+sys.path.insert(0, SHARED_DIR)
+
+from watermark_payload import PAYLOAD_VERSION, InvalidPayloadField, WatermarkPayload
+from watermark_verification import (exact_hash_level, new_verification, payload_sizes, read_payload, settle,
+                                    watermark_level)
+
+WATERMARK_METHOD = 'dwtDct'
+# Vercel rejects request bodies above 4.5MB, base64 included
+MAX_UPLOAD_MB = float(os.environ.get('WATERMARK_MAX_UPLOAD_MB', 3))
+TILE_BUDGET_MB = int(os.environ.get('WATERMARK_TILE_BUDGET_MB', 128))
+# Cold start budgets in milliseconds, from process start to the response:
+# /health imports Flask and the payload code only, the first /embed also
+# loads NumPy, OpenCV and the engine (see benchmark_cold_start.py)
+HEALTH_COLD_START_BUDGET_MS = int(os.environ.get('WATERMARK_HEALTH_COLD_START_BUDGET_MS', 400))
+EMBED_COLD_START_BUDGET_MS = int(os.environ.get('WATERMARK_EMBED_COLD_START_BUDGET_MS', 1500))
 
 # Initialize Flask app
 app = Flask(__name__)
 CORS(app)
 
-def embed_watermark_simple(image_data, watermark_text="PhotoMint"):
-    """
-    Simple watermark embedding (returns modified base64 for demo)
-    In production, this would use proper image processing libraries
-    """
-    try:
-        # For demo purposes, we'll just add metadata to indicate watermarking
-        # In a real implementation, this would use LSB embedding or other techniques
-        
-        # Extract the base64 data
-        if ',' in image_data:
-            header, b64_data = image_data.split(',', 1)
-        else:
-            header = "data:image/jpeg;base64"
-            b64_data = image_data
-        
-        # Decode, process (simulate), and re-encode
-        image_bytes = base64.b64decode(b64_data)
-        
-        # For demo: just return the original image with success flag
-        # In production: implement actual watermark embedding
-        
-        return f"{header},{b64_data}"
-        
-    except Exception as e:
-        print(f"Error in embed_watermark: {str(e)}")
-        return None
+IMPORT_MS = round((time.perf_counter() - STARTED) * 1000, 1)
+
+# (cv2, numpy, dwt_dct_engine, image_encoders), imported by the first request needing them
+_image_stack = None
+_image_stack_ms = None
+
+def image_stack():
+    """Import the image processing modules on first use, timing the import"""
+    global _image_stack, _image_stack_ms
+    if _image_stack is None:
+        started = time.perf_counter()
+        import cv2
+        import numpy as np
+        import dwt_dct_engine
+        import image_encoders
+        _image_stack = (cv2, np, dwt_dct_engine, image_encoders)
+        _image_stack_ms = round((time.perf_counter() - started) * 1000, 1)
+        print(f"Image stack loaded in {_image_stack_ms}ms")
+    return _image_stack
+
+def read_image(image_data):
+    """Decode a base64 image (optionally a data URL) into (bytes, sha256)"""
+    if ',' in image_data[:100]:
+        image_data = image_data.split(',', 1)[1]
+    if len(image_data) // 4 * 3 > MAX_UPLOAD_MB * 1024 * 1024:
+        raise ValueError(f'Image too large (max {MAX_UPLOAD_MB:g}MB)')
+    image_bytes = base64.b64decode(image_data)
+    return image_bytes, hashlib.sha256(image_bytes).hexdigest()
+
+def image_to_cv2(image_bytes):
+    cv2, np, _, _ = image_stack()
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
 
-def extract_watermark_simple(image_data):
+def decode_payload(cv2_image, expected_size=None):
     """
-    Simple watermark extraction (demo implementation)
+    (raw payload, parsed or None), trying the same payload sizes as the
+    service: both versions' and the unpadded legacy v1 lengths, all read
+    from one pass of the native engine
     """
+    _, _, engine, _ = image_stack()
+    def decoder_for(size):
+        return engine.DwtDctDecoder('bytes', int(size) * 8, tile_budget=TILE_BUDGET_MB * 1024 * 1024)
+    return read_payload(cv2_image, payload_sizes(expected_size), decoder_for, WATERMARK_METHOD)
+
+def read_request_image():
+    """(data, (image bytes, sha256), None) for a JSON request, or (None, None, error response)"""
+    data = request.get_json(silent=True)
+    if not data or 'image' not in data:
+        return None, None, (jsonify({'error': 'No image provided'}), 400)
     try:
-        # For demo purposes, always return the expected watermark
-        # In production, this would extract the actual embedded watermark
-        return "PhotoMint"
-        
-    except Exception as e:
-        print(f"Error in extract_watermark: {str(e)}")
-        return None
+        image_bytes, sha256 = read_image(data['image'])
+    except (binascii.Error, ValueError) as e:
+        return None, None, (jsonify({'error': str(e)}), 400)
+    return data, (image_bytes, sha256), None
 
 @app.route('/', methods=['GET'])
 @app.route('/health', methods=['GET'])
@@ -56,93 +113,162 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'PhotoMint Watermark Service',
-        'version': '1.0.0',
-        'message': 'Watermark service is running'
+        'version': '2.0.0',
+        'engine': 'native',
+        'method': WATERMARK_METHOD,
+        'payload_version': PAYLOAD_VERSION,
+        'payload_size': WatermarkPayload.payload_size(),
+        'startup': {
+            'import_ms': IMPORT_MS,
+            'image_stack_loaded': _image_stack is not None,
+            'image_stack_ms': _image_stack_ms,
+            'health_budget_ms': HEALTH_COLD_START_BUDGET_MS,
+            'embed_budget_ms': EMBED_COLD_START_BUDGET_MS
+        }
     })
 
 @app.route('/embed', methods=['POST'])
 def embed_watermark_endpoint():
-    """Embed watermark endpoint"""
+    """
+    Embed an invisible watermark
+
+    Request JSON:
+    {
+        "image": "base64_encoded_image" (or a data URL),
+        "token_id": "123",
+        "creator_address": "0x1234...",
+        "custom_data": "optional_custom_data",
+        "output_format": "JPEG" (optional),
+        "quality": 95 (optional),
+        "preset": "fast" (optional)
+    }
+    """
     try:
-        data = request.get_json()
-        
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image data provided'}), 400
-        
-        image_data = data['image']
-        watermark_text = data.get('watermark', 'PhotoMint')
-        
-        watermarked_image = embed_watermark_simple(image_data, watermark_text)
-        
-        if watermarked_image:
-            return jsonify({
-                'success': True,
-                'watermarked_image': watermarked_image,
-                'message': 'Watermark embedded successfully (demo)',
-                'watermark_text': watermark_text
-            })
-        else:
-            return jsonify({'error': 'Failed to embed watermark'}), 500
-            
+        data, image, error = read_request_image()
+        if error:
+            return error
+        image_bytes, original_sha256 = image
+
+        token_id = data.get('token_id')
+        creator_address = data.get('creator_address')
+        if not token_id or not creator_address:
+            return jsonify({'error': 'token_id and creator_address are required'}), 400
+        try:
+            WatermarkPayload.check_token_id(token_id)
+        except InvalidPayloadField as e:
+            return jsonify({'error': str(e)}), 400
+
+        _, _, engine, encoders = image_stack()
+        try:
+            output = encoders.get_format(data.get('output_format', 'JPEG'))
+            preset = encoders.get_preset(data.get('preset'))
+        except encoders.EncodeOptionError as e:
+            return jsonify({'error': str(e)}), 400
+
+        cv2_image = image_to_cv2(image_bytes)
+        del image_bytes
+        if cv2_image is None:
+            return jsonify({'error': 'Invalid image format'}), 400
+
+        payload = WatermarkPayload.create_payload(token_id, creator_address, data.get('custom_data', ''))
+        encoder = engine.DwtDctEncoder(tile_budget=TILE_BUDGET_MB * 1024 * 1024)
+        encoder.set_watermark('bytes', payload)
+        watermarked = encoder.encode(cv2_image, WATERMARK_METHOD)
+        watermarked_bytes = encoders.encode(watermarked, output.name, int(data.get('quality', 95)), preset)
+
+        return jsonify({
+            'success': True,
+            'payload': WatermarkPayload.to_display(payload),
+            'payload_version': PAYLOAD_VERSION,
+            'payload_size': len(payload),
+            'method': WATERMARK_METHOD,
+            'original_sha256': original_sha256,
+            'watermarked_sha256': hashlib.sha256(watermarked_bytes).hexdigest(),
+            'format': output.name,
+            'preset': preset,
+            'custom_data_dropped': bool(data.get('custom_data')) and not WatermarkPayload.embeds_custom_data(),
+            'timestamp': int(time.time()),
+            'watermarked_image': base64.b64encode(watermarked_bytes).decode('utf-8')
+        })
+
     except Exception as e:
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        print(f"Watermark embedding error: {e}")
+        return jsonify({'error': f'Watermark embedding failed: {str(e)}'}), 500
 
 @app.route('/extract', methods=['POST'])
 def extract_watermark_endpoint():
-    """Extract watermark endpoint"""
+    """Extract and parse the watermark payload of an image (JSON: image, expected_payload_size)"""
     try:
-        data = request.get_json()
-        
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image data provided'}), 400
-        
-        image_data = data['image']
-        
-        extracted_watermark = extract_watermark_simple(image_data)
-        
-        if extracted_watermark:
-            return jsonify({
-                'success': True,
-                'watermark': extracted_watermark,
-                'message': 'Watermark extracted successfully (demo)'
-            })
-        else:
-            return jsonify({
-                'success': False,
-                'watermark': None,
-                'message': 'No watermark found'
-            })
-            
+        data, image, error = read_request_image()
+        if error:
+            return error
+
+        cv2_image = image_to_cv2(image[0])
+        if cv2_image is None:
+            return jsonify({'error': 'Invalid image format'}), 400
+
+        extracted_payload, parsed = decode_payload(cv2_image, data.get('expected_payload_size'))
+
+        response_data = {
+            'success': True,
+            'watermark_found': True,
+            'payload': WatermarkPayload.to_display(extracted_payload),
+            'parsed': parsed,
+            'method': WATERMARK_METHOD,
+            'extraction_timestamp': int(time.time())
+        }
+        if not parsed:
+            response_data['error'] = 'Invalid payload format or checksum mismatch'
+        return jsonify(response_data)
+
     except Exception as e:
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        print(f"Watermark extraction error: {e}")
+        return jsonify({'error': f'Watermark extraction failed: {str(e)}'}), 500
 
 @app.route('/verify', methods=['POST'])
 def verify_watermark_endpoint():
-    """Verify watermark endpoint"""
+    """
+    Verify an image against an expected mint
+
+    Request JSON: image, expected_sha256, expected_token_id, expected_creator
+    (all optional but the image). Runs the exact hash and watermark levels
+    of the service; the perceptual hash level needs its index and is not
+    available here.
+    """
     try:
-        data = request.get_json()
-        
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image data provided'}), 400
-        
-        image_data = data['image']
-        expected_watermark = data.get('expected', 'PhotoMint')
-        
-        extracted_watermark = extract_watermark_simple(image_data)
-        
-        is_verified = extracted_watermark == expected_watermark
-        
-        return jsonify({
-            'success': True,
-            'verified': is_verified,
-            'extracted_watermark': extracted_watermark,
-            'expected_watermark': expected_watermark,
-            'confidence': 95 if is_verified else 0,
-            'message': 'Verification completed (demo mode)'
-        })
-        
+        data, image, error = read_request_image()
+        if error:
+            return error
+        image_bytes, current_sha256 = image
+        expected_sha256 = data.get('expected_sha256')
+        expected_token_id = data.get('expected_token_id')
+        expected_creator = data.get('expected_creator')
+
+        results = new_verification(current_sha256, int(time.time()))
+
+        # Level 1: Exact SHA-256 match
+        if expected_sha256:
+            level = exact_hash_level(current_sha256, expected_sha256)
+            results['verification_levels']['exact_hash'] = level
+            if level['match']:
+                results['overall_result'] = 'verified'
+                results['confidence'] = 100
+                return jsonify(results)
+
+        # Level 2: Watermark extraction. There is no registry here, so the
+        # creator is matched against the address prefix in the payload
+        cv2_image = image_to_cv2(image_bytes)
+        if cv2_image is None:
+            return jsonify({'error': 'Invalid image format'}), 400
+        _, parsed = decode_payload(cv2_image)
+        results['verification_levels']['watermark'] = watermark_level(parsed, expected_token_id, expected_creator)
+
+        settle(results)
+        return jsonify(results)
+
     except Exception as e:
-        return jsonify({'error': f'Server error: {str(e)}'}), 500
+        print(f"Verification error: {e}")
+        return jsonify({'error': f'Verification failed: {str(e)}'}), 500
 
 # Catch-all route for any other paths
 @app.route('/<path:path>', methods=['GET', 'POST', 'PUT', 'DELETE'])
@@ -154,11 +280,11 @@ def catch_all(path):
                 'GET / - Health check',
                 'GET /health - Health check',
                 'POST /embed - Embed watermark',
-                'POST /extract - Extract watermark', 
+                'POST /extract - Extract watermark',
                 'POST /verify - Verify watermark'
             ]
         }), 404
     return jsonify({'error': 'Method not allowed'}), 405
 
 if __name__ == '__main__':
-    app.run(debug=True, port=5001)
\ No newline at end of file
+    app.run(debug=True, port=5001)
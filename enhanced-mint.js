@@ -91,7 +91,8 @@ class EnhancedPhotoMint {
                     payload: watermarkResult.payload,
                     method: watermarkResult.method,
                     originalSha256: watermarkResult.original_sha256,
-                    watermarkedSha256: watermarkResult.watermarked_sha256
+                    watermarkedSha256: watermarkResult.watermarked_sha256,
+                    phash: watermarkResult.phash
                 }
 
                 console.log('✅ Watermark embedded successfully')
@@ -118,8 +119,21 @@ class EnhancedPhotoMint {
             // Step 4: Calculate hashes and prepare blockchain data
             console.log('\n📊 Calculating cryptographic hashes...')
             
-            const pHash = await computePHash64(processedImage)
-            console.log('🖼️ Perceptual hash:', pHash)
+            // The service hashes the image it already decoded; only fall
+            // back to decoding it again here when it is unreachable. The two
+            // pHashes of one image can differ by a few bits, so whatever is
+            // stored on-chain must be compared with pHashDistance, not ===
+            let pHash = watermarkData?.phash
+            let pHashSource = 'service'
+            if (!pHash) {
+                try {
+                    pHash = (await this.watermarkClient.fingerprint(processedImage)).phash
+                } catch (fingerprintError) {
+                    pHash = await computePHash64(processedImage)
+                    pHashSource = 'computePHash64'
+                }
+            }
+            console.log('🖼️ Perceptual hash:', pHash, `(${pHashSource})`)
 
             // Create mock CID (in production, upload to IPFS first)
             const cid = `QmWatermark${nextTokenId}${Date.now()}`
@@ -175,6 +189,7 @@ class EnhancedPhotoMint {
                 originalSha256: originalSha256,
                 processedSha256: processedSha256,
                 pHash: pHash.toString(),
+                pHashSource: pHashSource,
                 cid: cid,
                 signature: signature,
                 
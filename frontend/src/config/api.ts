@@ -14,6 +14,8 @@ export const API_ENDPOINTS = {
   WATERMARK_EMBED: `${WATERMARK_SERVICE_URL}/embed`,
   WATERMARK_EXTRACT: `${WATERMARK_SERVICE_URL}/extract`,
   WATERMARK_VERIFY: `${WATERMARK_SERVICE_URL}/verify`,
+  WATERMARK_JOBS: `${WATERMARK_SERVICE_URL}/jobs`,
+  WATERMARK_FINGERPRINT: `${WATERMARK_SERVICE_URL}/fingerprint`,
   WATERMARK_HEALTH: `${WATERMARK_SERVICE_URL}/health`,
 }
 
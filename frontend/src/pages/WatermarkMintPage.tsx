@@ -54,6 +54,7 @@ interface WatermarkStatus {
   status: 'idle' | 'checking' | 'embedding' | 'success' | 'error'
   message?: string
   payload?: string
+  phash?: string
 }
 
 const steps = [
@@ -190,7 +191,8 @@ const WatermarkMintPage: React.FC = () => {
       setWatermarkStatus({
         status: 'success',
         message: 'Watermark applied successfully!',
-        payload: watermarkResult.payload
+        payload: watermarkResult.payload,
+        phash: watermarkResult.phash
       })
 
       toast.success('🛡️ Invisible watermark applied!')
@@ -239,7 +241,9 @@ const WatermarkMintPage: React.FC = () => {
       // Calculate hashes
       const fileBuffer = await selectedFile.arrayBuffer()
       const sha256Hash = sha256Hex(new Uint8Array(fileBuffer))
-      const pHashU64 = await computePHash64(new Uint8Array(fileBuffer))
+      // Reuse the service's pHash of the watermarked image instead of decoding it again.
+      // computePHash64 can differ from it by a few bits; compare with pHashDistance
+      const pHashU64 = watermarkStatus.phash ?? await computePHash64(new Uint8Array(fileBuffer))
       
       // Create CID and signature
       const cid = uploadResult.filename
@@ -2,4 +2,5 @@ export declare function uploadToIpfs(pathOrBuffer: string | Buffer): Promise<str
 export declare function sha256Hex(buf: Buffer): string;
 export declare function cidToBytes(cidStr: string): Uint8Array;
 export declare function computePHash64(pathOrBuffer: string | Buffer): Promise<string>;
+export declare function pHashDistance(a: string | bigint, b: string | bigint): number;
 export declare function buildDigest(sha256Hex: string, cidBytes: Uint8Array): string;
@@ -50,6 +50,16 @@ export async function computePHash64(pathOrBuffer: string | Buffer): Promise<str
   return "0x" + hexStr;
 }
 
+// Hamming distance between two 64-bit pHashes (hex strings or bigints).
+// The watermark service computes its pHash from an OpenCV thumbnail, so it
+// can differ from computePHash64 by a few bits: compare with this, not ===.
+export function pHashDistance(a: string | bigint, b: string | bigint): number {
+  let diff = BigInt(a) ^ BigInt(b);
+  let bits = 0;
+  for (; diff; diff &= diff - 1n) bits++;
+  return bits;
+}
+
 // EIP-191 signed digest: keccak256("PHOTO:" || sha256 || cidBytes)
 export function buildDigest(sha256Hex: string, cidBytes: Uint8Array): string {
   const prefix = Buffer.from("PHOTO:");
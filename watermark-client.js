@@ -37,7 +37,9 @@ export default class WatermarkClient {
             const {
                 customData = '',
                 outputFormat = 'JPEG',
-                quality = 95
+                quality = 95,
+                preset = null,
+                renditions = null
             } = options
 
             const formData = new FormData()
@@ -50,6 +52,8 @@ export default class WatermarkClient {
             formData.append('custom_data', customData)
             formData.append('output_format', outputFormat)
             formData.append('quality', quality.toString())
+            if (preset) formData.append('preset', preset)
+            if (renditions) formData.append('renditions', [].concat(renditions).join(','))
 
             const response = await fetch(`${this.serviceUrl}/embed`, {
                 method: 'POST',
@@ -67,19 +71,124 @@ export default class WatermarkClient {
         }
     }
 
+    /**
+     * Embed watermark using the binary transport: the raw image is the
+     * request body and the watermarked image comes back as the response
+     * body, with no base64/JSON round trip. Accepts a path or a Buffer.
+     */
+    async embedWatermarkBinary(image, tokenId, creatorAddress, options = {}) {
+        try {
+            const {
+                customData = '',
+                outputFormat = 'JPEG',
+                quality = 95,
+                preset = null,
+                renditions = null
+            } = options
+
+            const imageBuffer = Buffer.isBuffer(image) ? image : await fs.readFile(image)
+            const params = new URLSearchParams({
+                token_id: tokenId.toString(),
+                creator_address: creatorAddress,
+                custom_data: customData,
+                output_format: outputFormat,
+                quality: quality.toString(),
+                response: 'binary'
+            })
+            if (preset) params.append('preset', preset)
+            if (renditions) params.append('renditions', [].concat(renditions).join(','))
+
+            const response = await fetch(`${this.serviceUrl}/embed?${params}`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/octet-stream',
+                    'Accept': 'image/*'
+                },
+                body: imageBuffer
+            })
+
+            if (!response.ok) {
+                const errorText = await response.text()
+                throw new Error(`Embed failed: ${response.status} - ${errorText}`)
+            }
+
+            const header = (name) => response.headers.get(name)
+            return {
+                success: true,
+                watermarked_buffer: Buffer.from(await response.arrayBuffer()),
+                payload: decodeURIComponent(header('X-Watermark-Payload') || ''),
+                payload_size: parseInt(header('X-Watermark-Payload-Size'), 10),
+                method: header('X-Watermark-Method'),
+                original_sha256: header('X-Original-SHA256'),
+                watermarked_sha256: header('X-Watermarked-SHA256'),
+                phash: header('X-Watermark-PHash'),
+                fingerprint: {
+                    sha256: header('X-Watermarked-SHA256'),
+                    phash: header('X-Watermark-PHash'),
+                    dhash: header('X-Watermark-DHash'),
+                    ahash: header('X-Watermark-AHash'),
+                    color_histogram: header('X-Watermark-Color-Histogram')
+                },
+                format: header('X-Watermark-Format'),
+                timestamp: parseInt(header('X-Watermark-Timestamp'), 10),
+                custom_data_dropped: header('X-Watermark-Custom-Data-Dropped') === 'true',
+                // Names served at renditionUrl(watermarked_sha256, name)
+                renditions: header('X-Watermark-Renditions') ? header('X-Watermark-Renditions').split(',') : []
+            }
+        } catch (error) {
+            throw new Error(`Watermark embedding failed: ${error.message}`)
+        }
+    }
+
+    /**
+     * URL of a gallery rendition (thumbnail, preview, full) made by an
+     * embed with the renditions option
+     */
+    renditionUrl(watermarkedSha256, name) {
+        return `${this.serviceUrl}/renditions/${watermarkedSha256}/${name}`
+    }
+
+    /**
+     * SHA-256, pHash, dHash, aHash and colour histogram of an image, all
+     * from one decode on the service. The pHash is computed like
+     * computePHash64 but from OpenCV's thumbnail, so the two can differ by a
+     * few bits: compare them with pHashDistance, never with ===.
+     * Accepts a path or a Buffer.
+     */
+    async fingerprint(image) {
+        try {
+            const imageBuffer = Buffer.isBuffer(image) ? image : await fs.readFile(image)
+            const response = await fetch(`${this.serviceUrl}/fingerprint`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: imageBuffer
+            })
+
+            if (!response.ok) {
+                const errorText = await response.text()
+                throw new Error(`Fingerprint failed: ${response.status} - ${errorText}`)
+            }
+
+            return await response.json()
+        } catch (error) {
+            throw new Error(`Image fingerprinting failed: ${error.message}`)
+        }
+    }
+
     /**
      * Extract watermark from image
      */
     async extractWatermark(imagePath, options = {}) {
         try {
-            const { expectedPayloadSize = 64 } = options
+            // Unset: the service tries the v2 size, then the legacy v1 size
+            const { expectedPayloadSize = null } = options
 
             const formData = new FormData()
             formData.append('file', await fs.readFile(imagePath), {
                 filename: path.basename(imagePath),
                 contentType: 'image/jpeg'
             })
-            formData.append('expected_payload_size', expectedPayloadSize.toString())
+            if (expectedPayloadSize) formData.append('expected_payload_size', expectedPayloadSize.toString())
 
             const response = await fetch(`${this.serviceUrl}/extract`, {
                 method: 'POST',
@@ -129,16 +238,70 @@ export default class WatermarkClient {
         }
     }
 
+    /**
+     * Queue an embed, extract or verify job; resolves to { job_id, status, ... }
+     */
+    async submitJob(type, imagePath, fields = {}) {
+        try {
+            const params = new URLSearchParams({ type, ...fields })
+            const response = await fetch(`${this.serviceUrl}/jobs?${params}`, {
+                method: 'POST',
+                headers: { 'Content-Type': 'application/octet-stream' },
+                body: await fs.readFile(imagePath)
+            })
+
+            if (response.status === 429) {
+                const retryAfter = response.headers.get('retry-after')
+                throw new Error(`Job queue full, retry after ${retryAfter}s`)
+            }
+            if (!response.ok) {
+                const errorText = await response.text()
+                throw new Error(`Submit failed: ${response.status} - ${errorText}`)
+            }
+
+            return await response.json()
+        } catch (error) {
+            throw new Error(`Job submission failed: ${error.message}`)
+        }
+    }
+
+    /**
+     * Poll a job until it finishes and return its result
+     */
+    async waitForJob(jobId, options = {}) {
+        const { interval = 500, timeout = 120000 } = options
+        const deadline = Date.now() + timeout
+
+        while (Date.now() < deadline) {
+            const response = await fetch(`${this.serviceUrl}/jobs/${jobId}`)
+            if (!response.ok) {
+                const errorText = await response.text()
+                throw new Error(`Job ${jobId} lookup failed: ${response.status} - ${errorText}`)
+            }
+
+            const job = await response.json()
+            if (job.status === 'done') {
+                return job.result
+            }
+            if (job.status === 'failed') {
+                throw new Error(`Job ${jobId} failed: ${job.error}`)
+            }
+            await new Promise(resolve => setTimeout(resolve, interval))
+        }
+        throw new Error(`Job ${jobId} did not finish within ${timeout}ms`)
+    }
+
     /**
      * Save watermarked image to file
      */
     async saveWatermarkedImage(watermarkResult, outputPath) {
         try {
-            if (!watermarkResult.watermarked_image) {
+            if (!watermarkResult.watermarked_buffer && !watermarkResult.watermarked_image) {
                 throw new Error('No watermarked image data in result')
             }
 
-            const imageBuffer = Buffer.from(watermarkResult.watermarked_image, 'base64')
+            const imageBuffer = watermarkResult.watermarked_buffer ||
+                Buffer.from(watermarkResult.watermarked_image, 'base64')
             await fs.writeFile(outputPath, imageBuffer)
             
             console.log(`✅ Watermarked image saved to: ${outputPath}`)
@@ -153,12 +316,15 @@ export default class WatermarkClient {
      */
     async processImageWithWatermark(imagePath, tokenId, creatorAddress, outputDir = './data/uploads', options = {}) {
         try {
-            // Embed watermark
-            const watermarkResult = await this.embedWatermark(imagePath, tokenId, creatorAddress, options)
+            // Embed watermark (binary transport unless explicitly disabled)
+            const watermarkResult = options.binary === false
+                ? await this.embedWatermark(imagePath, tokenId, creatorAddress, options)
+                : await this.embedWatermarkBinary(imagePath, tokenId, creatorAddress, options)
             
             // Generate output filename
             const timestamp = Date.now()
-            const extension = options.outputFormat === 'PNG' ? 'png' : 'jpg'
+            const format = (options.outputFormat || 'JPEG').toUpperCase()
+            const extension = { PNG: 'png', WEBP: 'webp', AVIF: 'avif' }[format] || 'jpg'
             const outputFilename = `watermarked_${timestamp}_token_${tokenId}.${extension}`
             const outputPath = path.join(outputDir, outputFilename)
 
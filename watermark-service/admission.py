@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+"""
+Admission control for decode-heavy requests
+
+Each endpoint has a budget: how many requests may work at once, and how
+many bytes of decoded pixels they may hold together. A request's cost is
+its decoded size, width x height x 3, read from the image header before
+anything is decoded. A request that does not fit waits in a short FIFO
+queue. When the queue is full, or the wait runs out, the request is turned
+away with Overloaded and the client should retry later. A mint rush then
+degrades into 503s instead of an out-of-memory kill.
+"""
+
+import io
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from PIL import Image
+
+# Enough for the markers before a JPEG frame header, EXIF thumbnail included
+HEADER_BYTES = 256 * 1024
+
+
+class Overloaded(Exception):
+    """The endpoint's budget is exhausted; retry after retry_after seconds"""
+
+    def __init__(self, endpoint, retry_after):
+        super().__init__(f'Server busy: {endpoint} capacity exhausted, retry in {retry_after}s')
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class ExceedsBudget(ValueError):
+    """An image whose decoded size alone is more than the endpoint's whole budget"""
+
+    def __init__(self, endpoint, cost, max_bytes):
+        super().__init__(f'Image too large to process: {cost // (1024 * 1024)}MB decoded, '
+                         f'{endpoint} budget is {max_bytes // (1024 * 1024)}MB')
+
+
+def decoded_size(image_bytes):
+    """
+    Bytes of the decoded BGR image (width x height x 3), from its header
+
+    Returns None when the header cannot be read; cv2 gets to reject it.
+    """
+    view = memoryview(image_bytes)
+    for data in (view[:HEADER_BYTES], view):
+        try:
+            with Image.open(io.BytesIO(data)) as image:
+                width, height = image.size
+            return width * height * 3
+        except Image.DecompressionBombError:
+            return math.inf
+        except Exception:
+            if len(data) == len(view):
+                return None
+    return None
+
+
+class AdmissionBudget:
+    """Concurrency and decoded-bytes budget of one endpoint, with a bounded FIFO wait"""
+
+    def __init__(self, endpoint, max_concurrent, max_bytes, max_waiting, max_wait):
+        self.endpoint = endpoint
+        self.max_concurrent = max_concurrent
+        self.max_bytes = max_bytes
+        self.max_waiting = max_waiting
+        self.max_wait = max_wait  # seconds
+        self._cond = threading.Condition()
+        self._queue = deque()
+        self._running = 0
+        self._bytes = 0
+        self._hold_seconds = 1.0  # moving average, for Retry-After
+
+        self.admitted = 0
+        self.queued = 0
+        self.rejected = 0
+        self.peak_bytes = 0
+
+    def _fits(self, cost):
+        return self._running < self.max_concurrent and self._bytes + cost <= self.max_bytes
+
+    def _take(self, cost):
+        self._running += 1
+        self._bytes += cost
+        self.admitted += 1
+        self.peak_bytes = max(self.peak_bytes, self._bytes)
+
+    def _reject(self):
+        self.rejected += 1
+        return Overloaded(self.endpoint, max(1, math.ceil(self._hold_seconds)))
+
+    @contextmanager
+    def admit(self, cost):
+        """Hold cost bytes of the budget for the duration of the with block"""
+        if cost > self.max_bytes:
+            raise ExceedsBudget(self.endpoint, cost, self.max_bytes)
+
+        with self._cond:
+            if not self._queue and self._fits(cost):
+                self._take(cost)
+            else:
+                if len(self._queue) >= self.max_waiting:
+                    raise self._reject()
+                ticket = object()
+                self._queue.append(ticket)
+                self.queued += 1
+                deadline = time.monotonic() + self.max_wait
+                try:
+                    # First come, first served: a big request at the head is not starved
+                    while self._queue[0] is not ticket or not self._fits(cost):
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            raise self._reject()
+                        self._cond.wait(remaining)
+                    self._take(cost)
+                finally:
+                    self._queue.remove(ticket)
+                    self._cond.notify_all()
+
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._running -= 1
+                self._bytes -= cost
+                self._hold_seconds = 0.8 * self._hold_seconds + 0.2 * (time.monotonic() - started)
+                self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self._running,
+                'max_concurrent': self.max_concurrent,
+                'bytes_in_use': self._bytes,
+                'max_bytes': self.max_bytes,
+                'peak_bytes': self.peak_bytes,
+                'waiting': len(self._queue),
+                'max_waiting': self.max_waiting,
+                'admitted': self.admitted,
+                'queued': self.queued,
+                'rejected': self.rejected
+            }
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Cold start benchmark for the serverless function (api/watermark.py)
+
+Starts a fresh interpreter per run, imports the function and answers one
+request through the Flask test client, as a serverless cold start does.
+The time is measured from process launch to the response, for /health
+(Flask and the payload code only) and for a first /embed (which also
+loads NumPy, OpenCV and the engine), and checked against the budgets
+declared in api/watermark.py.
+
+    python benchmark_cold_start.py --runs 5
+
+Exits 1 when a median is over its budget.
+"""
+
+import argparse
+import base64
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import cv2
+import numpy as np
+
+API_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api')
+
+# Runs in the fresh interpreter: one request, then the function's own timings
+CHILD = """
+import json, sys
+sys.path.insert(0, {api_dir!r})
+import watermark
+client = watermark.app.test_client()
+if {endpoint!r} == 'health':
+    response = client.get('/health')
+else:
+    with open({image_path!r}) as f:
+        body = {{'image': f.read(), 'token_id': '1', 'creator_address': '0x1234567890abcdef1234567890abcdef12345678'}}
+    response = client.post('/embed', json=body)
+assert response.status_code == 200, response.get_data(as_text=True)
+health = client.get('/health').get_json()
+print(json.dumps(dict(health['startup'], modules=len(sys.modules))))
+"""
+
+
+def cold_start(endpoint, image_path):
+    """Milliseconds from launch to response in a new interpreter, plus its startup report"""
+    code = CHILD.format(api_dir=API_DIR, endpoint=endpoint, image_path=image_path)
+    started = time.perf_counter()
+    result = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True)
+    elapsed = (time.perf_counter() - started) * 1000
+    return elapsed, json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure serverless cold start against its budgets')
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--size', type=int, default=1024, help='long side of the /embed test image')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (args.size * 3 // 4, args.size, 3), dtype=np.uint8), (5, 5), 0)
+    with tempfile.NamedTemporaryFile('w', suffix='.b64', delete=False) as f:
+        f.write(base64.b64encode(cv2.imencode('.jpg', image)[1].tobytes()).decode())
+        image_path = f.name
+
+    over = []
+    try:
+        for endpoint in ('health', 'embed'):
+            timings = []
+            for _ in range(args.runs):
+                elapsed, startup = cold_start(endpoint, image_path)
+                timings.append(elapsed)
+            median = float(np.median(timings))
+            budget = startup[f'{endpoint}_budget_ms']
+            status = 'ok' if median <= budget else 'OVER BUDGET'
+            print(f"/{endpoint:<7} cold start p50 {median:7.1f} ms  max {max(timings):7.1f} ms  "
+                  f"budget {budget} ms  {status}")
+            print(f"         module import {startup['import_ms']} ms, image stack "
+                  f"{startup['image_stack_ms'] if startup['image_stack_loaded'] else 'not loaded'}"
+                  f"{' ms' if startup['image_stack_loaded'] else ''}, {startup['modules']} modules")
+            if median > budget:
+                over.append(endpoint)
+    finally:
+        os.remove(image_path)
+
+    sys.exit(1 if over else 0)
+
+
+if __name__ == '__main__':
+    main()
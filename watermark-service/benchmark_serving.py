@@ -0,0 +1,114 @@
+#!/usr/bin/env python3
+"""
+Throughput benchmark for a running watermarking service
+
+Fires concurrent requests at one endpoint over keep-alive sessions and
+reports throughput and latency percentiles, to compare serving modes:
+
+    python watermark_server.py                      # development server
+    gunicorn -c gunicorn.conf.py wsgi:app           # production server
+    python benchmark_serving.py --endpoint embed --concurrency 8 --requests 200
+"""
+
+import argparse
+import threading
+import time
+
+import cv2
+import numpy as np
+import requests
+
+
+def make_image(width, height):
+    """Photo-like JPEG so every request does real decode/encode work"""
+    rng = np.random.default_rng(0)
+    base = cv2.resize(rng.integers(40, 215, (6, 8, 3), dtype=np.uint8), (width, height),
+                      interpolation=cv2.INTER_CUBIC).astype(np.float32)
+    texture = cv2.GaussianBlur(rng.normal(0, 20, (height, width, 3)).astype(np.float32), (0, 0), 2)
+    image = np.clip(base + texture, 0, 255).astype(np.uint8)
+    return cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), 92])[1].tobytes()
+
+
+def percentile(values, pct):
+    return float(np.percentile(values, pct)) * 1000 if values else 0.0
+
+
+def run(url, endpoint, image_bytes, concurrency, total):
+    if endpoint == 'embed':
+        params = {'token_id': '1', 'creator_address': '0x1234567890abcdef1234567890abcdef12345678',
+                  'response': 'binary'}
+    else:
+        params = {}
+
+    latencies = []
+    errors = 0
+    lock = threading.Lock()
+    remaining = [total]
+
+    def worker():
+        nonlocal errors
+        session = requests.Session()
+        while True:
+            with lock:
+                if remaining[0] == 0:
+                    return
+                remaining[0] -= 1
+            started = time.perf_counter()
+            try:
+                # Fresh bytes per request so neither the result cache (/verify) nor
+                # embed idempotency answers it
+                body = image_bytes + remaining[0].to_bytes(4, 'big')
+                response = session.post(f'{url}/{endpoint}', params=params, data=body,
+                                        headers={'Content-Type': 'application/octet-stream'})
+                ok = response.status_code == 200
+            except requests.RequestException:
+                ok = False
+            elapsed = time.perf_counter() - started
+            with lock:
+                if ok:
+                    latencies.append(elapsed)
+                else:
+                    errors += 1
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+
+    return {
+        'requests': total,
+        'errors': errors,
+        'seconds': round(wall, 2),
+        'throughput_rps': round(len(latencies) / wall, 2),
+        'p50_ms': round(percentile(latencies, 50), 1),
+        'p99_ms': round(percentile(latencies, 99), 1)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark a running watermarking service')
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--endpoint', choices=['embed', 'verify'], default='embed')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=100)
+    parser.add_argument('--width', type=int, default=1600)
+    parser.add_argument('--height', type=int, default=1200)
+    args = parser.parse_args()
+
+    image_bytes = make_image(args.width, args.height)
+    # The first request is reported on its own: against a fresh server it
+    # shows what lazy initialization costs (the warmup removes most of it)
+    first = run(args.url, args.endpoint, image_bytes, 1, 1)
+
+    result = run(args.url, args.endpoint, image_bytes, args.concurrency, args.requests)
+    print(f"{args.endpoint} {args.width}x{args.height}, concurrency {args.concurrency}")
+    print(f"  first_request_ms: {first['p50_ms']}")
+    for key, value in result.items():
+        print(f"  {key}: {value}")
+
+
+if __name__ == '__main__':
+    main()
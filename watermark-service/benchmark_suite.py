@@ -0,0 +1,281 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the watermark service hot paths
+
+Generates reproducible synthetic photos from 1MP to 50MP and times each
+stage in-process (payload create/parse, image_to_cv2, encoder.encode,
+decoder.decode, cv2_to_bytes JPEG/PNG) plus the full /embed, /extract and
+/verify endpoints through the Flask test client. Every case reports
+throughput, p50/p99 latency and the peak RSS growth while it ran.
+--encoders adds every output format and preset (image_encoders), with the
+encoded size, for trading gallery bandwidth against encode CPU.
+
+    python benchmark_suite.py --output benchmark_baseline.json   # all sizes, records a new baseline
+    python benchmark_suite.py --sizes 1,4 --compare benchmark_baseline.json
+    python benchmark_suite.py --sizes 4,24 --encoders --output encoders.json
+
+Results go to benchmark_results.json unless --output names another file.
+With --compare, cases whose p50 is more than --threshold slower than the
+baseline are listed and the exit status is 1.
+"""
+
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+# Keep benchmark embeds out of the real pHash index, registry and result cache
+os.environ.setdefault('PHASH_INDEX_PATH', os.path.join(tempfile.mkdtemp(prefix='photomint-bench-'), 'phash.jsonl'))
+os.environ.setdefault('WATERMARK_REGISTRY_PATH', '')
+# Repeated identical embeds would otherwise be replays
+os.environ.setdefault('WATERMARK_EMBED_IDEMPOTENCY', '0')
+os.environ.pop('RESULT_CACHE_DIR', None)
+
+import cv2
+import numpy as np
+
+import watermark_server as ws
+from image_encoders import PRESETS, available_formats, encode as encode_image
+
+DEFAULT_SIZES = (1, 4, 12, 24, 50)  # megapixels
+TOKEN_ID = '123'
+CREATOR = '0x1234567890abcdef1234567890abcdef12345678'
+
+
+def synthetic_photo(megapixels, seed=0):
+    """Photo-like BGR image: smooth colour regions plus fine texture, 4:3"""
+    height = int(round((megapixels * 1e6 * 3 / 4) ** 0.5))
+    width = int(round(height * 4 / 3))
+    rng = np.random.default_rng(seed)
+
+    base = cv2.resize(rng.integers(40, 215, (6, 8, 3), dtype=np.uint8), (width, height),
+                      interpolation=cv2.INTER_CUBIC)
+    # Texture generated at quarter resolution keeps 50MP generation cheap
+    texture = rng.normal(0, 18, (height // 4 + 1, width // 4 + 1, 3)).astype(np.float32)
+    texture = cv2.resize(texture, (width, height), interpolation=cv2.INTER_LINEAR)
+    return cv2.add(base, texture, dtype=cv2.CV_8U)
+
+
+def _current_rss():
+    """Resident set size in bytes (Linux /proc, else the process peak)"""
+    try:
+        with open('/proc/self/statm') as statm:
+            return int(statm.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class RssSampler:
+    """Samples RSS on a background thread; peak growth over the start value"""
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+        self.start = self.peak = 0
+        self._stop = threading.Event()
+
+    def __enter__(self):
+        self.start = self.peak = _current_rss()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _current_rss())
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak = max(self.peak, _current_rss())
+
+    @property
+    def growth_mb(self):
+        return (self.peak - self.start) / (1024 * 1024)
+
+
+def measure(name, func, iterations, megapixels=None, setup=None):
+    """Run func iterations times (after one warmup) and summarize"""
+    if setup:
+        setup()
+    func()
+
+    timings = []
+    with RssSampler() as rss:
+        for _ in range(iterations):
+            if setup:
+                setup()
+            started = time.perf_counter()
+            func()
+            timings.append(time.perf_counter() - started)
+
+    timings = np.array(timings)
+    result = {
+        'case': name,
+        'megapixels': megapixels,
+        'iterations': iterations,
+        'p50_ms': round(float(np.percentile(timings, 50)) * 1000, 3),
+        'p99_ms': round(float(np.percentile(timings, 99)) * 1000, 3),
+        'mean_ms': round(float(timings.mean()) * 1000, 3),
+        'throughput_per_s': round(iterations / float(timings.sum()), 3),
+        'peak_rss_growth_mb': round(rss.growth_mb, 1)
+    }
+    if megapixels:
+        result['megapixels_per_s'] = round(megapixels * result['throughput_per_s'], 3)
+
+    label = f"{name} @ {megapixels}MP" if megapixels else name
+    print(f"  {label:<32} p50 {result['p50_ms']:>10.2f} ms  p99 {result['p99_ms']:>10.2f} ms  "
+          f"{result['throughput_per_s']:>9.2f}/s  +{result['peak_rss_growth_mb']:.0f} MB RSS")
+    return result
+
+
+def payload_cases(iterations):
+    payload = ws.WatermarkPayload.create_payload(TOKEN_ID, CREATOR)
+    return [
+        measure('payload.create', lambda: ws.WatermarkPayload.create_payload(TOKEN_ID, CREATOR), iterations),
+        measure('payload.parse', lambda: ws.WatermarkPayload.parse_payload(payload), iterations)
+    ]
+
+
+def image_cases(megapixels, iterations):
+    image = synthetic_photo(megapixels)
+    jpeg = ws.cv2_to_bytes(image, 'JPEG', 95)
+
+    payload = ws.WatermarkPayload.create_payload(TOKEN_ID, CREATOR)
+    encoder = ws.make_encoder(payload)
+    decoder = ws.make_decoder(len(payload))
+    watermarked = encoder.encode(image, ws.WATERMARK_METHOD)
+    watermarked_jpeg = ws.cv2_to_bytes(watermarked, 'JPEG', 95)
+
+    client = ws.app.test_client()
+    cache = ws.get_result_cache()
+
+    def post(path, data):
+        response = client.post(path, data=data, content_type='multipart/form-data')
+        if response.status_code != 200:
+            raise RuntimeError(f'{path} returned {response.status_code}: {response.get_data(as_text=True)[:200]}')
+
+    def embed():
+        post('/embed', {'file': (io.BytesIO(jpeg), 'photo.jpg'), 'token_id': TOKEN_ID,
+                        'creator_address': CREATOR})
+
+    def extract():
+        post('/extract', {'file': (io.BytesIO(watermarked_jpeg), 'photo.jpg')})
+
+    def verify():
+        post('/verify', {'file': (io.BytesIO(watermarked_jpeg), 'photo.jpg'), 'expected_token_id': TOKEN_ID})
+
+    return [
+        measure('image_to_cv2', lambda: ws.image_to_cv2(jpeg), iterations, megapixels),
+        measure('encoder.encode', lambda: encoder.encode(image, ws.WATERMARK_METHOD), iterations, megapixels),
+        measure('decoder.decode', lambda: decoder.decode(watermarked, ws.WATERMARK_METHOD), iterations, megapixels),
+        measure('cv2_to_bytes.jpeg', lambda: ws.cv2_to_bytes(watermarked, 'JPEG', 95), iterations, megapixels),
+        measure('cv2_to_bytes.png', lambda: ws.cv2_to_bytes(watermarked, 'PNG'), iterations, megapixels),
+        measure('endpoint./embed', embed, iterations, megapixels),
+        # Cleared every iteration so the decode is measured, not a cache hit
+        measure('endpoint./extract', extract, iterations, megapixels, setup=cache.clear),
+        measure('endpoint./verify', verify, iterations, megapixels, setup=cache.clear)
+    ]
+
+
+def encoder_cases(megapixels, iterations, quality=90):
+    """Encode time and output size for every available format and preset"""
+    image = synthetic_photo(megapixels)
+    results = []
+    for output_format in available_formats():
+        for preset in PRESETS:
+            result = measure(f'encode.{output_format.lower()}.{preset}',
+                             lambda: encode_image(image, output_format, quality, preset), iterations, megapixels)
+            size = len(encode_image(image, output_format, quality, preset))
+            result['bytes'] = size
+            result['bits_per_pixel'] = round(size * 8 / (image.shape[0] * image.shape[1]), 3)
+            print(f"    {size / 1e6:.2f} MB  {result['bits_per_pixel']:.2f} bpp")
+            results.append(result)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except OSError:
+        commit = ''
+    return {
+        'commit': commit,
+        'timestamp': int(time.time()),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'engine': ws.WATERMARK_ENGINE,
+        'payload_version': ws.PAYLOAD_VERSION
+    }
+
+
+def compare(results, baseline_path, threshold):
+    """Cases slower than the baseline p50 by more than threshold (a fraction)"""
+    with open(baseline_path) as f:
+        baseline = {(r['case'], r['megapixels']): r for r in json.load(f)['results']}
+
+    regressions = []
+    print(f"\nComparison with {baseline_path} (threshold +{threshold:.0%}):")
+    for result in results:
+        before = baseline.get((result['case'], result['megapixels']))
+        if not before or not before['p50_ms']:
+            continue
+        change = result['p50_ms'] / before['p50_ms'] - 1
+        marker = '  REGRESSION' if change > threshold else ''
+        label = f"{result['case']} @ {result['megapixels']}MP" if result['megapixels'] else result['case']
+        print(f"  {label:<32} {before['p50_ms']:>10.2f} -> {result['p50_ms']:>10.2f} ms  {change:+.1%}{marker}")
+        if change > threshold:
+            regressions.append(label)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the watermark service hot paths')
+    parser.add_argument('--sizes', default=','.join(str(s) for s in DEFAULT_SIZES),
+                        help='comma-separated image sizes in megapixels')
+    parser.add_argument('--iterations', type=int, default=10,
+                        help='timed iterations at 1MP; larger images get proportionally fewer (min 3)')
+    # Writing a new baseline takes an explicit --output benchmark_baseline.json
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--compare', help='baseline JSON to check for regressions')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed p50 slowdown, as a fraction')
+    parser.add_argument('--encoders', action='store_true', help='also time every output format and preset')
+    args = parser.parse_args()
+    if args.compare and os.path.abspath(args.output) == os.path.abspath(args.compare):
+        parser.error('--output must differ from --compare, or the baseline is overwritten before the comparison')
+
+    ws.warmup()
+    env = environment()
+    print(f"Benchmarking {env['engine']} engine at {env['commit'] or 'unknown commit'} on {env['cpu_count']} CPUs")
+
+    results = payload_cases(max(100, args.iterations * 100))
+    for megapixels in [float(s) if '.' in s else int(s) for s in args.sizes.split(',')]:
+        print(f"{megapixels}MP:")
+        results.extend(image_cases(megapixels, max(3, int(args.iterations / megapixels))))
+        if args.encoders:
+            results.extend(encoder_cases(megapixels, max(3, int(args.iterations / megapixels))))
+
+    with open(args.output, 'w') as f:
+        json.dump({'environment': env, 'results': results}, f, indent=2)
+    print(f"\nResults written to {args.output}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s)")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
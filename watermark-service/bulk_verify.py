@@ -0,0 +1,254 @@
+#!/usr/bin/env python3
+"""
+Bulk offline verification with resumable checkpoints
+
+Runs the service's own verification (or extraction) code over every image
+in a directory tree or manifest, without going through HTTP. Files are
+streamed to a multiprocessing pool by path, and each worker reads and
+decodes its own files. Results are appended to a JSONL file in input order;
+the summary is the only thing printed to stdout, and the service's own
+logging goes to stderr.
+
+    python bulk_verify.py ../data/uploads --output audit.jsonl
+    python bulk_verify.py --manifest gallery.txt --mode extract --workers 8 --output gallery.jsonl
+
+A manifest has one path per line, or one JSON object per line with "path"
+and optional expected_sha256 / expected_token_id / expected_creator.
+
+Progress is checkpointed next to the output (<output>.checkpoint) every
+--checkpoint-every files. Rerunning the same command after an interruption
+truncates the output to the last checkpoint and continues from there;
+--restart starts over.
+"""
+
+import argparse
+import hashlib
+import itertools
+import json
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff')
+EXPECTATIONS = ('expected_sha256', 'expected_token_id', 'expected_creator')
+
+
+def walk(root):
+    """Image files under root, depth first in sorted order (stable across runs)"""
+    try:
+        entries = sorted(os.scandir(root), key=lambda entry: entry.name)
+    except NotADirectoryError:
+        yield root, {}
+        return
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            yield from walk(entry.path)
+        elif entry.name.lower().endswith(IMAGE_EXTENSIONS):
+            yield entry.path, {}
+
+
+def read_manifest(path):
+    with open(path) as manifest:
+        for line in manifest:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('{'):
+                item = json.loads(line)
+                yield item['path'], {key: item[key] for key in EXPECTATIONS if item.get(key)}
+            else:
+                yield line, {}
+
+
+# Pool workers import the service once and keep its registry and pHash index
+_ws = None
+_mode = None
+
+
+def _init_worker(mode):
+    global _ws, _mode
+    # The service logs with print(); keep stdout for the summary
+    sys.stdout = sys.stderr
+    import watermark_server
+    watermark_server._init_batch_worker()
+    _ws, _mode = watermark_server, mode
+
+
+def audit_file(task):
+    """Verify or extract one file (runs in a pool worker)"""
+    path, expected = task
+    record = {'path': path}
+    try:
+        if os.path.getsize(path) > _ws.MAX_UPLOAD_BYTES:
+            raise ValueError(f'File too large (max {_ws.MAX_UPLOAD_MB}MB)')
+        with open(path, 'rb') as f:
+            image_bytes = f.read()
+        record['sha256'] = hashlib.sha256(image_bytes).hexdigest()
+
+        cv2_image = _ws.image_to_cv2(image_bytes)
+        del image_bytes
+        if cv2_image is None:
+            raise ValueError('Invalid image format')
+
+        if _mode == 'extract':
+            record['result'] = _ws.extract_cv2_image(cv2_image)
+        else:
+            record['result'] = _ws.verify_cv2_image(cv2_image, record['sha256'], **expected)
+    except Exception as e:
+        record['error'] = str(e)
+    return record
+
+
+def audit_indexed(item):
+    """audit_file for an (input index, task) pair, keeping the index"""
+    index, task = item
+    return index, audit_file(task)
+
+
+def outcome(record):
+    """Short label for the progress summary"""
+    if 'error' in record:
+        return 'error'
+    result = record['result']
+    if 'overall_result' in result:
+        return result['overall_result']
+    return 'watermarked' if result.get('parsed') else 'no_watermark'
+
+
+class Checkpoint:
+    """Number of inputs fully written to the output, and the output size then"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        tmp = self.path + '.tmp'
+        with open(tmp, 'w') as f:
+            json.dump(state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    def clear(self):
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Verify (or extract) watermarks in bulk, resumably')
+    parser.add_argument('paths', nargs='*', help='image files or directories to walk')
+    parser.add_argument('--manifest', help='file listing images (paths or JSON lines)')
+    parser.add_argument('--mode', choices=['verify', 'extract'], default='verify')
+    parser.add_argument('--output', required=True, help='JSONL results file')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--chunksize', type=int, default=4, help='files handed to a worker at a time')
+    parser.add_argument('--checkpoint-every', type=int, default=1000, help='files between checkpoints')
+    parser.add_argument('--progress-interval', type=float, default=5.0, help='seconds between progress lines')
+    parser.add_argument('--restart', action='store_true', help='ignore an existing checkpoint')
+    args = parser.parse_args()
+
+    if not args.paths and not args.manifest:
+        parser.error('give directories/files or --manifest')
+
+    def inputs():
+        if args.manifest:
+            yield from read_manifest(args.manifest)
+        for path in args.paths:
+            yield from walk(path)
+
+    checkpoint = Checkpoint(args.output + '.checkpoint')
+    state = None if args.restart else checkpoint.load()
+    skip = 0
+    if state and state.get('complete'):
+        sys.exit(f"{args.output} is already complete ({state['processed']} files); use --restart to redo it")
+    if state:
+        skip = state['processed']
+        if not os.path.exists(args.output) or os.path.getsize(args.output) < state['output_offset']:
+            sys.exit(f"{args.output} is shorter than its checkpoint; rerun with --restart")
+        # Drop results written after the checkpoint; they are redone
+        with open(args.output, 'ab') as out:
+            out.truncate(state['output_offset'])
+        print(f"Resuming after {skip} files ({state['last_path']})", file=sys.stderr)
+    else:
+        open(args.output, 'w').close()
+        checkpoint.clear()
+
+    tasks = inputs()
+    if skip:
+        last_path, seen = None, 0
+        for last_path, _expected in itertools.islice(tasks, skip):
+            seen += 1
+        if seen != skip or last_path != state['last_path']:
+            sys.exit(f"Input changed since the checkpoint (expected {state['last_path']} at #{skip}, "
+                     f"got {last_path}); rerun with --restart")
+
+    counts = dict(state['counts']) if state else {}
+    processed = skip
+    started = last_report = time.time()
+    window_start, window_count = started, 0
+
+    with open(args.output, 'a') as out, \
+            multiprocessing.Pool(args.workers, initializer=_init_worker, initargs=(args.mode,)) as pool:
+        # Results arrive as workers finish them, but are written in input order,
+        # so "the first N inputs are in the output" is the whole checkpoint. The
+        # window bounds the inputs in flight or waiting for an earlier result;
+        # the pool would otherwise queue every path up front.
+        window = threading.BoundedSemaphore(args.workers * args.chunksize * 64)
+
+        def windowed(tasks):
+            for item in enumerate(tasks):
+                window.acquire()
+                yield item
+
+        def in_order(results):
+            waiting, next_index = {}, 0
+            for index, record in results:
+                waiting[index] = record
+                while next_index in waiting:
+                    yield waiting.pop(next_index)
+                    next_index += 1
+                    window.release()
+
+        records = in_order(pool.imap_unordered(audit_indexed, windowed(tasks), chunksize=args.chunksize))
+        for record in records:
+            out.write(json.dumps(record) + '\n')
+            processed += 1
+            window_count += 1
+            label = outcome(record)
+            counts[label] = counts.get(label, 0) + 1
+
+            if processed % args.checkpoint_every == 0:
+                out.flush()
+                os.fsync(out.fileno())
+                checkpoint.save({'processed': processed, 'last_path': record['path'],
+                                 'output_offset': out.tell(), 'counts': counts})
+
+            now = time.time()
+            if now - last_report >= args.progress_interval:
+                rate = window_count / (now - window_start)
+                print(f"{processed} files  {rate:.1f} files/s  "
+                      + '  '.join(f"{k}={v}" for k, v in sorted(counts.items())), file=sys.stderr)
+                last_report = window_start = now
+                window_count = 0
+
+    elapsed = time.time() - started
+    done = processed - skip
+    print(f"Done: {processed} files ({done} this run) in {elapsed:.1f}s, "
+          f"{done / elapsed if elapsed else 0:.1f} files/s", file=sys.stderr)
+    print(json.dumps({'processed': processed, 'counts': counts}))
+    checkpoint.save({'processed': processed, 'complete': True, 'counts': counts})
+
+
+if __name__ == '__main__':
+    main()
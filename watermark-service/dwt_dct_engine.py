@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+Vectorized DWT-DCT watermark engine
+
+Bit-compatible drop-in for imwatermark's 'dwtDct' method. imwatermark walks
+every 4x4 block of the Haar approximation band in a Python loop; here the
+Haar DWT, the per-block coefficient selection and the bit quantization are
+done as whole-array NumPy operations over all blocks at once.
+
+To stay bit-exact with imwatermark this reproduces its arithmetic, not the
+textbook algorithm:
+- the Haar transform uses the same float64 operation order as pywt
+- the "DCT" step quantizes the largest-magnitude non-DC coefficient of each
+  block of the approximation band (imwatermark never calls cv2.dct here)
+- the inverse transform swaps the horizontal and vertical detail bands,
+  exactly as EmbedMaxDct.encode does
+- the reconstructed band is written back into the uint8 YUV frame with the
+  same truncating cast
+
+Large images can be processed as horizontal strips aligned to the DWT block
+grid (8 pixel rows for 4x4 blocks). Every step is local to its 2x2 or 8x8
+pixel neighbourhood, so with the block index offset carried across strips
+the result is identical to processing the whole frame, while only a strip's
+worth of float temporaries is alive per worker thread. NumPy and OpenCV
+release the GIL for the heavy work, so strips run in parallel on threads.
+A decode given a cancelled() callable checks it before each strip and
+channel, and raises Cancelled once it returns true.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+# pywt.Wavelet('haar').dec_lo[0]
+HAAR = np.float64(0.7071067811865476)
+
+DEFAULT_SCALES = (0, 36, 36)
+DEFAULT_BLOCK = 4
+
+# Rough peak of temporaries per pixel of a strip: YUV copy, float64 channel,
+# DWT bands, block copy and reconstruction buffers
+TILE_BYTES_PER_PIXEL = 48
+
+
+class Cancelled(Exception):
+    """A decode stopped early because its cancelled() check returned true"""
+
+
+def haar_dwt2(frame):
+    """Single-level 2D Haar DWT, returns (cA, (cH, cV, cD)) like pywt.dwt2"""
+    s = HAAR
+    even_rows = frame[0::2]
+    odd_rows = frame[1::2]
+    lo = even_rows * s + odd_rows * s
+    hi = even_rows * s - odd_rows * s
+
+    ca = lo[:, 0::2] * s + lo[:, 1::2] * s
+    cv = lo[:, 0::2] * s - lo[:, 1::2] * s
+    ch = hi[:, 0::2] * s + hi[:, 1::2] * s
+    cd = hi[:, 0::2] * s - hi[:, 1::2] * s
+    return ca, (ch, cv, cd)
+
+
+def _haar_merge(lo, hi, axis):
+    """Inverse of one Haar analysis step along the given axis"""
+    s = HAAR
+    even = lo * s + hi * s
+    odd = lo * s - hi * s
+
+    shape = list(lo.shape)
+    shape[axis] *= 2
+    out = np.empty(shape, dtype=np.float64)
+    if axis == 0:
+        out[0::2] = even
+        out[1::2] = odd
+    else:
+        out[:, 0::2] = even
+        out[:, 1::2] = odd
+    return out
+
+
+def haar_idwt2(coeffs):
+    """Single-level 2D inverse Haar DWT, takes (cA, (cH, cV, cD)) like pywt.idwt2"""
+    ca, (ch, cv, cd) = coeffs
+    lo = _haar_merge(ca, cv, axis=1)
+    hi = _haar_merge(ch, cd, axis=1)
+    return _haar_merge(lo, hi, axis=0)
+
+
+def _block_view(frame, block):
+    """Return (blocks, shape) where blocks is (n_blocks, block*block), row-major"""
+    row, col = frame.shape
+    n_rows, n_cols = row // block, col // block
+    tiles = frame[:n_rows * block, :n_cols * block]
+    blocks = tiles.reshape(n_rows, block, n_cols, block).swapaxes(1, 2).reshape(-1, block * block)
+    return blocks, (n_rows, n_cols)
+
+
+def _selected_coefficients(blocks):
+    """Index and value of the largest-magnitude non-DC coefficient per block"""
+    pos = np.argmax(np.abs(blocks[:, 1:]), axis=1) + 1
+    values = blocks[np.arange(len(blocks)), pos]
+    return pos, values
+
+
+def embed_frame(frame, bits, scale, block=DEFAULT_BLOCK, offset=0):
+    """
+    Quantize one coefficient per block of frame (in place) to carry bits
+
+    offset is the index of the frame's first block in the whole image, so a
+    strip carries the same bits it would have in a single pass.
+    """
+    blocks, (n_rows, n_cols) = _block_view(frame, block)
+    if len(blocks) == 0:
+        return frame
+
+    pos, values = _selected_coefficients(blocks)
+    wm_bits = bits[(offset + np.arange(len(blocks))) % len(bits)].astype(np.float64)
+
+    quantized = (np.floor_divide(np.abs(values), scale) + 0.25 + 0.5 * wm_bits) * scale
+    blocks[np.arange(len(blocks)), pos] = np.where(values >= 0.0, quantized, -quantized)
+
+    frame[:n_rows * block, :n_cols * block] = (
+        blocks.reshape(n_rows, n_cols, block, block).swapaxes(1, 2).reshape(n_rows * block, n_cols * block)
+    )
+    return frame
+
+
+def frame_scores(frame, scale, block=DEFAULT_BLOCK):
+    """Per-block 0/1 bit scores of frame, in embedding order"""
+    blocks, _ = _block_view(frame, block)
+    _, values = _selected_coefficients(blocks)
+    return np.remainder(np.abs(values), scale) > 0.5 * scale
+
+
+class DwtDctEngine:
+    """Whole-array equivalent of imwatermark.maxDct.EmbedMaxDct"""
+
+    def __init__(self, watermarks=(), wm_len=8, scales=DEFAULT_SCALES, block=DEFAULT_BLOCK,
+                 tile_budget=0, workers=1, cancelled=None):
+        self._watermarks = np.asarray(watermarks, dtype=np.uint8)
+        self._wm_len = wm_len
+        self._scales = scales
+        self._block = block
+        self._tile_budget = tile_budget
+        self._workers = max(1, workers)
+        self._cancelled = cancelled
+
+    def tile_rows(self, shape):
+        """Strip height for an image shape; the full height when untiled"""
+        row, col = shape[:2]
+        if self._tile_budget <= 0:
+            return row
+
+        align = 2 * self._block
+        rows = self._tile_budget // (self._workers * col * TILE_BYTES_PER_PIXEL)
+        rows = max(align, rows // align * align)
+        return min(rows, row)
+
+    def _strips(self, shape):
+        row = shape[0]
+        step = self.tile_rows(shape)
+        return [(start, min(start + step, row)) for start in range(0, row, step)]
+
+    def _check_cancelled(self):
+        if self._cancelled is not None and self._cancelled():
+            raise Cancelled('decode cancelled')
+
+    def _run(self, task, strips):
+        if len(strips) == 1 or self._workers == 1:
+            return [task(start, stop) for start, stop in strips]
+        with ThreadPoolExecutor(max_workers=self._workers) as pool:
+            return list(pool.map(lambda strip: task(*strip), strips))
+
+    def _block_offset(self, start, col4):
+        """Index of the first block of a strip starting at pixel row start"""
+        n_block_cols = (col4 // 2) // self._block
+        return (start // (2 * self._block)) * n_block_cols
+
+    def encode(self, bgr):
+        row, col, _ = bgr.shape
+        row4, col4 = row // 4 * 4, col // 4 * 4
+        out = np.empty_like(bgr)
+
+        def encode_strip(start, stop):
+            yuv = cv2.cvtColor(bgr[start:stop], cv2.COLOR_BGR2YUV)
+            dwt_rows = min(stop, row4) - start
+
+            for channel in range(2):
+                if self._scales[channel] <= 0 or dwt_rows <= 0:
+                    continue
+
+                ca, (ch, cv, cd) = haar_dwt2(yuv[:dwt_rows, :col4, channel].astype(np.float64))
+                embed_frame(ca, self._watermarks, self._scales[channel], self._block,
+                            self._block_offset(start, col4))
+
+                # imwatermark reconstructs with the H and V bands swapped
+                yuv[:dwt_rows, :col4, channel] = haar_idwt2((ca, (cv, ch, cd)))
+
+            out[start:stop] = cv2.cvtColor(yuv, cv2.COLOR_YUV2BGR)
+
+        self._run(encode_strip, self._strips(bgr.shape))
+        return out
+
+    def decode(self, bgr):
+        return self.decode_lengths(bgr, [self._wm_len])[0]
+
+    def decode_lengths(self, bgr, lengths):
+        """
+        Bits decoded for each watermark length in lengths, from one pass
+
+        The block scores do not depend on the length, only on how blocks
+        are assigned to bits, so trying many lengths costs one DWT.
+        """
+        row, col, _ = bgr.shape
+        row4, col4 = row // 4 * 4, col // 4 * 4
+
+        def decode_strip(start, stop):
+            ones = [np.zeros(length, dtype=np.float64) for length in lengths]
+            counts = [np.zeros(length, dtype=np.float64) for length in lengths]
+            dwt_rows = min(stop, row4) - start
+            if dwt_rows <= 0:
+                return ones, counts
+
+            yuv = cv2.cvtColor(bgr[start:start + dwt_rows], cv2.COLOR_BGR2YUV)
+            offset = self._block_offset(start, col4)
+            for channel in range(2):
+                if self._scales[channel] <= 0:
+                    continue
+                self._check_cancelled()
+
+                ca, _ = haar_dwt2(yuv[:, :col4, channel].astype(np.float64))
+                scores = frame_scores(ca, self._scales[channel], self._block)
+                block_index = offset + np.arange(len(scores))
+                for i, length in enumerate(lengths):
+                    bit_index = block_index % length
+                    ones[i] += np.bincount(bit_index, weights=scores, minlength=length)
+                    counts[i] += np.bincount(bit_index, minlength=length)
+            return ones, counts
+
+        partials = self._run(decode_strip, self._strips(bgr.shape))
+        bits = []
+        for i in range(len(lengths)):
+            ones = sum(p[0][i] for p in partials)
+            counts = sum(p[1][i] for p in partials)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                avg_scores = ones / counts
+            bits.append(np.nan_to_num(avg_scores, nan=0.0) * 255 > 127)
+        return bits
+
+
+def _check_size(cv2_image):
+    row, col, _ = cv2_image.shape
+    if row * col < 256 * 256:
+        raise RuntimeError('image too small, should be larger than 256x256')
+
+
+class DwtDctEncoder:
+    """
+    Same interface as imwatermark.WatermarkEncoder for the 'dwtDct' method
+
+    tile_budget (bytes) caps the temporaries of the strips in flight across
+    all workers threads; 0 processes the image in one pass.
+    """
+
+    def __init__(self, content=b'', tile_budget=0, workers=1):
+        self.set_by_bytes(content)
+        self._tile_budget = tile_budget
+        self._workers = workers
+
+    def set_by_bytes(self, content):
+        self._watermarks = np.unpackbits(np.frombuffer(bytes(content), dtype=np.uint8))
+        self._wm_type = 'bytes'
+
+    def set_by_bits(self, bits=()):
+        self._watermarks = np.asarray([int(bit) % 2 for bit in bits], dtype=np.uint8)
+        self._wm_type = 'bits'
+
+    def set_watermark(self, wm_type='bytes', content=''):
+        if wm_type == 'bytes':
+            self.set_by_bytes(content)
+        elif wm_type == 'bits':
+            self.set_by_bits(content)
+        else:
+            raise NameError('%s is not supported' % wm_type)
+
+    def get_length(self):
+        return len(self._watermarks)
+
+    def encode(self, cv2_image, method='dwtDct', **configs):
+        _check_size(cv2_image)
+        if method != 'dwtDct':
+            raise NameError('%s is not supported' % method)
+
+        engine = DwtDctEngine(self._watermarks, wm_len=len(self._watermarks), tile_budget=self._tile_budget,
+                              workers=self._workers, **configs)
+        return engine.encode(cv2_image)
+
+
+class DwtDctDecoder:
+    """Same interface as imwatermark.WatermarkDecoder for the 'dwtDct' method"""
+
+    def __init__(self, wm_type='bytes', length=0, tile_budget=0, workers=1):
+        if wm_type not in ('bytes', 'bits'):
+            raise NameError('%s is unsupported' % wm_type)
+        self._wm_type = wm_type
+        self._wm_len = length
+        self._tile_budget = tile_budget
+        self._workers = workers
+
+    def reconstruct(self, bits):
+        if len(bits) != self._wm_len:
+            raise RuntimeError('bits are not matched with watermark length')
+        if self._wm_type == 'bits':
+            return bits
+        return np.packbits(bits)[:self._wm_len // 8].tobytes()
+
+    def decode(self, cv2_image, method='dwtDct', **configs):
+        _check_size(cv2_image)
+        if method != 'dwtDct':
+            raise NameError('%s is not supported' % method)
+
+        engine = DwtDctEngine(wm_len=self._wm_len, tile_budget=self._tile_budget, workers=self._workers, **configs)
+        return self.reconstruct(engine.decode(cv2_image))
+
+    def decode_sizes(self, cv2_image, sizes, method='dwtDct', **configs):
+        """Payload bytes read at each byte length in sizes, from a single pass over the image"""
+        _check_size(cv2_image)
+        if method != 'dwtDct' or self._wm_type != 'bytes':
+            raise NameError('%s is not supported' % method)
+
+        engine = DwtDctEngine(tile_budget=self._tile_budget, workers=self._workers, **configs)
+        return [np.packbits(bits).tobytes() for bits in engine.decode_lengths(cv2_image, [size * 8 for size in sizes])]
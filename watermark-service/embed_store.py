@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Idempotent embed results
+
+A retried /embed must not watermark the image again. The payload carries
+the embed time, so a second embed would produce a different watermark,
+and it would repeat the decode, embed and encode for nothing. EmbedStore
+keeps the first watermarked file and its response under an idempotency
+key, and returns them to every retry inside the replay window.
+
+Retries that arrive while the first request is still running wait for it
+instead of starting their own embed. Entries are bounded by total bytes
+and expire after the window. When a directory is configured, each entry is
+one file (a JSON header line followed by the image bytes) that is claimed
+with a hard link. The first process to store a key therefore wins, and
+every worker process on the host replays the same bytes.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class IdempotencyConflict(ValueError):
+    """An idempotency key reused for a different image or different parameters"""
+
+
+class EmbedStore:
+    """Bounded, optionally disk-backed store of watermarked files by idempotency key"""
+
+    def __init__(self, max_bytes, ttl, disk_dir=None, wait_timeout=120):
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self.wait_timeout = wait_timeout  # seconds a retry waits for the running embed
+        self._entries = OrderedDict()  # key -> (stored_at, fingerprint, result, image bytes or None, size)
+        self._bytes = 0
+        self._pending = {}  # key -> threading.Event of the embed in progress
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+
+        self.replays = 0
+        self.waits = 0
+        self.misses = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def request_fingerprint(*params):
+        """Digest of everything that determines the output bytes"""
+        return hashlib.sha256('|'.join('' if p is None else str(p) for p in params).encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + '.embed')
+
+    def _expired(self, stored_at):
+        return time.time() - stored_at > self.ttl
+
+    def get(self, key):
+        """(fingerprint, image bytes, result) stored for key, or None"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                stored_at, fingerprint, result, image, _ = item
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    if image is not None:
+                        return fingerprint, image, result
+                else:
+                    self._forget(key)
+        return self._get_from_disk(key)
+
+    def _get_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'rb') as f:
+                header = json.loads(f.readline())
+                image = f.read()
+        except (OSError, ValueError):
+            return None
+
+        if header.get('key') != key or len(image) != header['size'] or self._expired(header['stored_at']):
+            self._remove(path)
+            return None
+        self._remember(key, header['stored_at'], header['fingerprint'], header['result'], image)
+        return header['fingerprint'], image, header['result']
+
+    def _remember(self, key, stored_at, fingerprint, result, image):
+        with self._lock:
+            self._forget(key)
+            # With a disk copy, memory only holds the header; replays re-read the file
+            kept = None if self.disk_dir else image
+            self._entries[key] = (stored_at, fingerprint, result, kept, len(image))
+            self._bytes += len(image)
+            while self._entries and self._bytes > self.max_bytes:
+                self._forget(next(iter(self._entries)))
+
+    def _forget(self, key):
+        """Drop key from memory (caller holds the lock)"""
+        item = self._entries.pop(key, None)
+        if item is not None:
+            self._bytes -= item[4]
+
+    def put(self, key, fingerprint, image, result):
+        """
+        Store the first result for key and return what is stored
+
+        Returns (image, result, stored): another process that stored the
+        key first wins, and then its image and result come back with
+        stored False.
+        """
+        stored_at = time.time()
+        if self.disk_dir:
+            path = self._disk_path(key)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            header = {'key': key, 'stored_at': stored_at, 'fingerprint': fingerprint, 'size': len(image),
+                      'result': result}
+            try:
+                with open(tmp_path, 'wb') as f:
+                    f.write(json.dumps(header).encode() + b'\n')
+                    f.write(image)
+                try:
+                    os.link(tmp_path, path)
+                except FileExistsError:
+                    existing = self._get_from_disk(key)
+                    if existing is not None:
+                        if existing[0] != fingerprint:
+                            raise IdempotencyConflict('Idempotency key was already used for a different request')
+                        return existing[1], existing[2], False
+                    # Expired (and now removed) entry: take its place
+                    os.replace(tmp_path, path)
+            except OSError as e:
+                print(f"Embed store write failed: {e}")
+            finally:
+                self._remove(tmp_path)
+            self._maybe_prune()
+
+        self._remember(key, stored_at, fingerprint, result, image)
+        return image, result, True
+
+    def run_once(self, key, fingerprint, embed):
+        """
+        The result for key, computed by embed() only if nothing is stored
+
+        embed returns (image bytes, result). Returns (image, result,
+        replayed). Raises IdempotencyConflict if key was stored for a
+        different fingerprint.
+        """
+        while True:
+            stored = self.get(key)
+            if stored is not None:
+                if stored[0] != fingerprint:
+                    raise IdempotencyConflict('Idempotency key was already used for a different request')
+                with self._lock:
+                    self.replays += 1
+                return stored[1], dict(stored[2]), True
+
+            with self._lock:
+                pending = self._pending.get(key)
+                if pending is None:
+                    self._pending[key] = done = threading.Event()
+                    self.misses += 1
+                    break
+                self.waits += 1
+            # Same key in flight here: wait for it, then replay (or retry if it failed)
+            if not pending.wait(self.wait_timeout):
+                raise TimeoutError('Timed out waiting for the original request with this idempotency key')
+
+        try:
+            image, result = embed()
+            image, result, stored = self.put(key, fingerprint, image, dict(result))
+            return image, dict(result), not stored
+        finally:
+            with self._lock:
+                del self._pending[key]
+            done.set()
+
+    def _maybe_prune(self):
+        with self._lock:
+            self._puts_since_prune += 1
+            prune = self._puts_since_prune >= 64
+            if prune:
+                self._puts_since_prune = 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop expired files, then the oldest until the directory fits max_bytes"""
+        try:
+            files = []
+            for name in os.listdir(self.disk_dir):
+                if name.endswith('.embed'):
+                    path = os.path.join(self.disk_dir, name)
+                    stat = os.stat(path)
+                    files.append((stat.st_mtime, stat.st_size, path))
+        except OSError:
+            return
+
+        now = time.time()
+        total = 0
+        for mtime, size, path in sorted(files, reverse=True):
+            total += size
+            if total > self.max_bytes or now - mtime > self.ttl:
+                self._remove(path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'ttl': self.ttl,
+                'disk_dir': self.disk_dir,
+                'in_flight': len(self._pending),
+                'replays': self.replays,
+                'waits': self.waits,
+                'misses': self.misses
+            }
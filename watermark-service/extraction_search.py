@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Multi-strategy watermark extraction with parallel early exit
+
+Shared and resized copies of a minted photo often no longer decode as
+submitted: the DWT block grid moved (a few pixels cropped off the top or
+left), the image was rescaled, or it was embedded with another method.
+This module builds candidate views of the image for those cases and tries
+them concurrently on a thread pool. The first candidate whose payload
+parses wins and the whole search is capped by a latency budget. After a
+win or the deadline, queued attempts are cancelled and running ones stop
+at their next checkpoint: after the rescale/shift, and between the
+decodes an attempt makes. The native dwtDct decode also stops between
+its strips; a decode by imwatermark (the alternate methods) cannot be
+interrupted and runs to the end on its thread, so those candidates, the
+slowest by far, are tried last.
+"""
+
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
+
+import cv2
+
+# Long side of common export / minting resolutions
+COMMON_LONG_SIDES = (4096, 3840, 3000, 2560, 2048, 1920, 1600, 1280, 1080, 1024)
+# The watermark lives in 4x4 blocks of the half-resolution DWT band: 8 pixels
+BLOCK_PIXELS = 8
+MIN_PIXELS = 256 * 256
+
+
+class Candidate:
+    """One way of looking at the image: a transform plus a decoding method"""
+
+    def __init__(self, name, method, transform=None):
+        self.name = name
+        self.method = method
+        self.transform = transform
+
+    def view(self, image):
+        return image if self.transform is None else self.transform(image)
+
+
+def _shift(dy, dx):
+    # Pads the top/left back: payload bits are assigned to blocks in raster
+    # order, so cropping further would realign blocks but reorder the bits
+    return lambda image: cv2.copyMakeBorder(image, dy, 0, dx, 0, cv2.BORDER_REPLICATE)
+
+
+def _resize(width, height):
+    return lambda image: cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA
+                                    if width * height < image.shape[0] * image.shape[1] else cv2.INTER_CUBIC)
+
+
+def build_candidates(shape, primary_method, alternate_methods=(), crop_step=2, long_sides=COMMON_LONG_SIDES,
+                     include_primary=False):
+    """
+    Candidate views of an image of the given shape, cheapest first
+
+    - shifts of up to one block down/right, undoing a crop off the top/left
+    - rescales so the long side matches a common minting resolution
+    - alternate embedding methods on the image as submitted
+    """
+    row, col = shape[:2]
+    candidates = []
+    if include_primary:
+        candidates.append(Candidate('as-submitted', primary_method))
+
+    for dy in range(0, BLOCK_PIXELS, crop_step):
+        for dx in range(0, BLOCK_PIXELS, crop_step):
+            if dy or dx:
+                candidates.append(Candidate(f'shift({dy},{dx})', primary_method, _shift(dy, dx)))
+
+    long_side = max(row, col)
+    for target in long_sides:
+        if target == long_side or not 0.25 <= target / long_side <= 4:
+            continue
+        scale = target / long_side
+        width, height = int(round(col * scale)), int(round(row * scale))
+        if width * height >= MIN_PIXELS:
+            candidates.append(Candidate(f'rescale({width}x{height})', primary_method, _resize(width, height)))
+
+    for method in alternate_methods:
+        if method != primary_method:
+            candidates.append(Candidate('as-submitted', method))
+
+    return candidates
+
+
+def search(image, candidates, attempt, pool, budget):
+    """
+    Run attempt(view, method, cancelled) for every candidate on pool until one succeeds
+
+    attempt returns a truthy result on success. It should call cancelled()
+    between its stages and give up (return None) once it is true: another
+    candidate has won or the budget is spent. Returns (candidate, result,
+    attempts) for the first success, or (None, None, attempts) when nothing
+    succeeded within budget seconds.
+    """
+    deadline = time.monotonic() + budget
+    stop = threading.Event()
+    attempts = [0]
+    lock = threading.Lock()
+
+    def cancelled():
+        return stop.is_set() or time.monotonic() > deadline
+
+    def run(candidate):
+        # Queued work that starts after a win or the deadline is skipped
+        if cancelled():
+            return candidate, None
+        with lock:
+            attempts[0] += 1
+        try:
+            view = candidate.view(image)
+            if cancelled():
+                return candidate, None
+            return candidate, attempt(view, candidate.method, cancelled)
+        except Exception:
+            return candidate, None
+
+    pending = {pool.submit(run, candidate) for candidate in candidates}
+    try:
+        while pending:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+            for future in done:
+                candidate, result = future.result()
+                if result:
+                    return candidate, result, attempts[0]
+        return None, None, attempts[0]
+    finally:
+        stop.set()
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Single-decode image fingerprints
+
+Computes every hash the minting flow needs from one decoded image: the
+SHA-256 of the file plus pHash, dHash, aHash and a colour histogram
+signature. The grayscale conversion and the 32x32 thumbnail are shared:
+pHash is the DCT of the thumbnail (as in phash_index), aHash averages its
+4x4 blocks down to 8x8 and dHash compares neighbours of a 9x8 reduction of
+it. Beyond the decode, the full-resolution pixels are only touched by the
+grayscale resize and the histogram.
+"""
+
+import cv2
+import numpy as np
+
+from phash_index import PHASH_SIZE, phash64_from_thumbnail, phash_hex, phash_thumbnail
+
+HASH_SIDE = 8
+# Per-channel bins of the BGR colour histogram (4 x 4 x 4 = 64 buckets)
+HISTOGRAM_BINS = 4
+
+
+def _bits_to_int(bits):
+    return int.from_bytes(np.packbits(bits.ravel()).tobytes(), 'big')
+
+
+def ahash64(thumbnail):
+    """Average hash: 8x8 block means of the thumbnail against their mean"""
+    step = PHASH_SIZE // HASH_SIDE
+    blocks = thumbnail.reshape(HASH_SIDE, step, HASH_SIDE, step).mean(axis=(1, 3))
+    return _bits_to_int(blocks > blocks.mean())
+
+
+def dhash64(thumbnail):
+    """Difference hash: each pixel of a 9x8 reduction brighter than its right neighbour"""
+    small = cv2.resize(thumbnail, (HASH_SIDE + 1, HASH_SIDE), interpolation=cv2.INTER_AREA).astype(np.int16)
+    return _bits_to_int(small[:, :-1] > small[:, 1:])
+
+
+def color_histogram(cv2_image):
+    """
+    Hex signature of the normalized BGR histogram
+
+    One byte per bucket, scaled so the buckets sum to about 255; compare two
+    signatures with histogram_distance.
+    """
+    if cv2_image.ndim == 2:
+        cv2_image = cv2.cvtColor(cv2_image, cv2.COLOR_GRAY2BGR)
+    hist = cv2.calcHist([cv2_image], [0, 1, 2], None, [HISTOGRAM_BINS] * 3, [0, 256] * 3).ravel()
+    hist *= 255.0 / max(float(hist.sum()), 1.0)
+    return np.round(hist).astype(np.uint8).tobytes().hex()
+
+
+def histogram_distance(a, b):
+    """L1 distance between two color_histogram signatures, 0 (same) to 1"""
+    va = np.frombuffer(bytes.fromhex(a), np.uint8).astype(np.int32)
+    vb = np.frombuffer(bytes.fromhex(b), np.uint8).astype(np.int32)
+    return float(np.abs(va - vb).sum()) / 510
+
+
+def fingerprint(cv2_image, sha256):
+    """All hashes of a decoded image whose file digest is sha256"""
+    thumbnail = phash_thumbnail(cv2_image)
+    return {
+        'sha256': sha256,
+        'phash': phash_hex(phash64_from_thumbnail(thumbnail)),
+        'dhash': phash_hex(dhash64(thumbnail)),
+        'ahash': phash_hex(ahash64(thumbnail)),
+        'color_histogram': color_histogram(cv2_image),
+        'width': int(cv2_image.shape[1]),
+        'height': int(cv2_image.shape[0])
+    }
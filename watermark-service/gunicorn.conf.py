@@ -0,0 +1,47 @@
+"""
+gunicorn settings for the watermarking service (see wsgi.py)
+
+Every value can be overridden from the environment, e.g.
+WATERMARK_WORKERS=8 gunicorn -c gunicorn.conf.py wsgi:app
+"""
+
+import multiprocessing
+import os
+import tempfile
+
+bind = os.environ.get('WATERMARK_BIND', '0.0.0.0:5001')
+
+# Pre-forked workers; the app and its warmed engine are loaded once in the master
+workers = int(os.environ.get('WATERMARK_WORKERS', multiprocessing.cpu_count()))
+preload_app = True
+
+# A few threads per worker keep idle keep-alive connections from blocking a
+# whole process; the DWT-DCT work itself releases the GIL
+worker_class = 'gthread'
+threads = int(os.environ.get('WATERMARK_THREADS', 4))
+
+keepalive = int(os.environ.get('WATERMARK_KEEPALIVE', 5))  # seconds an idle connection is kept
+timeout = int(os.environ.get('WATERMARK_TIMEOUT', 120))  # seconds before a stuck worker is restarted
+graceful_timeout = int(os.environ.get('WATERMARK_GRACEFUL_TIMEOUT', 30))
+
+# Recycle workers now and then to bound fragmentation from large images
+max_requests = int(os.environ.get('WATERMARK_MAX_REQUESTS', 1000))
+max_requests_jitter = max_requests // 10
+
+accesslog = os.environ.get('WATERMARK_ACCESS_LOG', '-')
+
+# Job status has to be visible to whichever worker receives the poll
+os.environ.setdefault('WATERMARK_JOB_STATE_DIR', os.path.join(tempfile.gettempdir(), 'photomint-jobs'))
+
+# The admission limits are for the whole host; each worker enforces its share
+os.environ.setdefault('WATERMARK_ADMISSION_PROCESSES', str(workers))
+
+# Each worker would otherwise start one batch process and one tile thread per core
+os.environ.setdefault('WATERMARK_BATCH_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+os.environ.setdefault('WATERMARK_TILE_WORKERS', str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def post_fork(server, worker):
+    # Workers share the cores, so OpenCV's own thread pool would only oversubscribe them
+    import cv2
+    cv2.setNumThreads(1)
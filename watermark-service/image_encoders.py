@@ -0,0 +1,106 @@
+#!/usr/bin/env python3
+"""
+Output encoders for watermarked images
+
+Each output format maps a quality and a speed/size preset to OpenCV
+imencode parameters:
+
+    fast      the cheapest encode (the service's historical output)
+    balanced  optimized Huffman tables for JPEG, PNG level 3, AVIF speed 8
+    small     progressive optimized JPEG, PNG level 9, AVIF speed 6
+
+WebP and AVIF are offered when the local OpenCV build can write them.
+encode() returns the codec's own output array, so callers that only hash,
+base64 or write the result can use it as a buffer without the copy
+tobytes() makes.
+"""
+
+import cv2
+
+PRESETS = ('fast', 'balanced', 'small')
+
+
+class EncodeOptionError(ValueError):
+    """An output format this build cannot write, or an unknown preset"""
+
+
+class OutputFormat:
+    """One writable format: file extension, MIME type and imencode parameters"""
+
+    def __init__(self, name, extension, mimetype, params):
+        self.name = name
+        self.extension = extension
+        self.mimetype = mimetype
+        self._params = params
+
+    @property
+    def available(self):
+        return cv2.haveImageWriter(self.extension)
+
+    def params(self, quality, preset):
+        return self._params(int(quality), preset)
+
+
+def _jpeg_params(quality, preset):
+    params = [cv2.IMWRITE_JPEG_QUALITY, quality]
+    if preset in ('balanced', 'small'):
+        params += [cv2.IMWRITE_JPEG_OPTIMIZE, 1]
+    if preset == 'small':
+        params += [cv2.IMWRITE_JPEG_PROGRESSIVE, 1]
+    return params
+
+
+def _png_params(quality, preset):
+    # Lossless: quality does not apply
+    return [cv2.IMWRITE_PNG_COMPRESSION, {'fast': 1, 'balanced': 3, 'small': 9}[preset]]
+
+
+def _webp_params(quality, preset):
+    # OpenCV exposes no WebP speed setting; quality above 100 selects lossless
+    return [cv2.IMWRITE_WEBP_QUALITY, quality]
+
+
+def _avif_params(quality, preset):
+    return [cv2.IMWRITE_AVIF_QUALITY, min(quality, 100),
+            cv2.IMWRITE_AVIF_SPEED, {'fast': 10, 'balanced': 8, 'small': 6}[preset]]
+
+
+FORMATS = {
+    'JPEG': OutputFormat('JPEG', '.jpg', 'image/jpeg', _jpeg_params),
+    'PNG': OutputFormat('PNG', '.png', 'image/png', _png_params),
+    'WEBP': OutputFormat('WEBP', '.webp', 'image/webp', _webp_params),
+}
+if hasattr(cv2, 'IMWRITE_AVIF_QUALITY'):
+    FORMATS['AVIF'] = OutputFormat('AVIF', '.avif', 'image/avif', _avif_params)
+
+ALIASES = {'JPG': 'JPEG'}
+
+
+def available_formats():
+    """Names of the formats this OpenCV build can write"""
+    return [name for name, output in FORMATS.items() if output.available]
+
+
+def get_format(name):
+    """The OutputFormat for a case-insensitive name; raises EncodeOptionError"""
+    key = str(name or 'JPEG').upper()
+    output = FORMATS.get(ALIASES.get(key, key))
+    if output is None or not output.available:
+        raise EncodeOptionError(f"Unsupported output format: {name} (available: {', '.join(available_formats())})")
+    return output
+
+
+def get_preset(preset, default='fast'):
+    preset = preset or default
+    if preset not in PRESETS:
+        raise EncodeOptionError(f"Unknown encode preset: {preset} (one of {', '.join(PRESETS)})")
+    return preset
+
+
+def encode(cv2_image, format='JPEG', quality=95, preset='fast'):
+    """Encode an image; returns the 1-D uint8 array OpenCV produced"""
+    output = get_format(format)
+    success, encoded = cv2.imencode(output.extension, cv2_image, output.params(quality, get_preset(preset)))
+    if not success:
+        raise Exception(f"Failed to encode image as {output.name}")
+    return encoded
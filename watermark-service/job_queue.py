@@ -0,0 +1,276 @@
+#!/usr/bin/env python3
+"""
+In-process job queue for long-running embed/extract/verify requests
+
+POST /jobs hands the work to a bounded queue and returns a job ID at once;
+a fixed set of worker threads drains the queue. NumPy and OpenCV release
+the GIL for the DWT-DCT work, so threads keep the cores busy without
+copying images between processes.
+
+When the queue is at its configured depth, submit raises QueueFull so the
+caller can answer 429 instead of letting latency grow without bound.
+Finished jobs are kept for a TTL and then dropped; when more than
+max_retained jobs or max_retained_bytes of results are held (an embed
+result carries the whole base64 image), the oldest finished ones are
+dropped early.
+
+With several server processes a poll may reach a process other than the
+one running the job, so when a state directory is configured every status
+change is also written there as JSON and lookups fall back to it.
+"""
+
+import json
+import os
+from collections import OrderedDict
+import queue
+import threading
+import time
+import uuid
+
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+class QueueFull(Exception):
+    """Raised when the job queue is at its configured depth"""
+
+
+class Job:
+    """One unit of work and its outcome"""
+
+    def __init__(self, job_type, func, args):
+        self.id = uuid.uuid4().hex
+        self.type = job_type
+        self.func = func
+        self.args = args
+        self.status = QUEUED
+        self.result = None
+        self.result_bytes = 0
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    def to_dict(self):
+        data = {
+            'job_id': self.id,
+            'type': self.type,
+            'status': self.status,
+            'submitted_at': self.submitted_at,
+            'started_at': self.started_at,
+            'finished_at': self.finished_at
+        }
+        if self.status == DONE:
+            data['result'] = self.result
+        elif self.status == FAILED:
+            data['error'] = self.error
+        return data
+
+
+class JobQueue:
+    """Bounded FIFO of jobs processed by a fixed pool of worker threads"""
+
+    def __init__(self, workers=2, max_depth=64, ttl=3600, state_dir=None, max_retained=256,
+                 max_retained_bytes=256 * 1024 * 1024):
+        self.workers = max(1, workers)
+        self.max_depth = max_depth
+        self.ttl = ttl
+        self.state_dir = state_dir
+        self.max_retained = max_retained
+        self.max_retained_bytes = max_retained_bytes
+        self._queue = queue.Queue(maxsize=max_depth)
+        self._jobs = {}
+        # Finished job IDs, oldest first, for eviction
+        self._finished = OrderedDict()
+        self._retained_bytes = 0
+        self._evicted = 0
+        self._lock = threading.Lock()
+        self._running = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+
+        if self.state_dir:
+            os.makedirs(self.state_dir, exist_ok=True)
+
+        self._threads = [
+            threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            for i in range(self.workers)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def submit(self, job_type, func, *args):
+        """Queue func(*args) and return the Job, or raise QueueFull"""
+        self._expire()
+        job = Job(job_type, func, args)
+        with self._lock:
+            self._jobs[job.id] = job
+        # Saved before a worker can pick it up so a stale 'queued' never lands last
+        self._save(job)
+        try:
+            self._queue.put_nowait(job)
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+                self._rejected += 1
+            self._remove_state(job.id)
+            raise QueueFull(f'job queue is full ({self.max_depth} jobs waiting)')
+        return job
+
+    def get(self, job_id):
+        """Job status dict by ID, or None when unknown or expired"""
+        self._expire()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                return job.to_dict()
+        return self._load(job_id)
+
+    def _state_path(self, job_id):
+        return os.path.join(self.state_dir, f'{job_id}.json')
+
+    def _save(self, job):
+        if not self.state_dir:
+            return
+        path = self._state_path(job.id)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump(job.to_dict(), f)
+            os.replace(tmp_path, path)
+        except (OSError, TypeError, ValueError) as e:
+            print(f"Job state write failed: {e}")
+
+    def _load(self, job_id):
+        # IDs come from URLs; only ever read uuid-shaped names
+        if not self.state_dir or not job_id.isalnum():
+            return None
+        path = self._state_path(job_id)
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        finished_at = data.get('finished_at')
+        if self.ttl > 0 and finished_at is not None and time.time() - finished_at > self.ttl:
+            self._remove_state(job_id)
+            return None
+        return data
+
+    def _remove_state(self, job_id):
+        if not self.state_dir:
+            return
+        try:
+            os.remove(self._state_path(job_id))
+        except OSError:
+            pass
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            with self._lock:
+                job.status = RUNNING
+                job.started_at = time.time()
+                self._running += 1
+            self._save(job)
+            try:
+                result = job.func(*job.args)
+                error = None
+            except Exception as e:
+                result = None
+                error = str(e)
+            result_bytes = self._result_size(result)
+
+            with self._lock:
+                # The inputs can be large images; only the outcome is kept
+                job.func = job.args = None
+                job.finished_at = time.time()
+                self._running -= 1
+                if error is None:
+                    job.status = DONE
+                    job.result = result
+                    job.result_bytes = result_bytes
+                    self._completed += 1
+                else:
+                    print(f"Job {job.id} failed: {error}")
+                    job.status = FAILED
+                    job.error = error
+                    self._failed += 1
+                self._finished[job.id] = None
+                self._retained_bytes += job.result_bytes
+                evicted = self._evict()
+            self._save(job)
+            with self._lock:
+                # Another worker may have evicted it while the state was written
+                if job.id not in self._jobs:
+                    evicted.append(job.id)
+            for job_id in evicted:
+                self._remove_state(job_id)
+            self._queue.task_done()
+
+    @staticmethod
+    def _result_size(result):
+        """Approximate retained size of a result: its JSON length"""
+        if result is None:
+            return 0
+        try:
+            return len(json.dumps(result))
+        except (TypeError, ValueError):
+            return 0
+
+    def _drop(self, job_id):
+        """Forget a finished job (caller holds the lock)"""
+        job = self._jobs.pop(job_id)
+        self._finished.pop(job_id, None)
+        self._retained_bytes -= job.result_bytes
+
+    def _evict(self):
+        """Drop the oldest finished jobs beyond the retention caps (caller holds the lock)"""
+        evicted = []
+        # The newest job is always kept, so its result can be fetched once
+        while len(self._finished) > 1 and (len(self._finished) > self.max_retained or
+                                           self._retained_bytes > self.max_retained_bytes):
+            job_id = next(iter(self._finished))
+            self._drop(job_id)
+            evicted.append(job_id)
+        self._evicted += len(evicted)
+        return evicted
+
+    def _expire(self):
+        """Drop finished jobs older than the TTL"""
+        if self.ttl <= 0:
+            return
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            expired = [
+                job_id for job_id, job in self._jobs.items()
+                if job.finished_at is not None and job.finished_at < cutoff
+            ]
+            for job_id in expired:
+                self._drop(job_id)
+
+        for job_id in expired:
+            self._remove_state(job_id)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'max_depth': self.max_depth,
+                'queued': self._queue.qsize(),
+                'running': self._running,
+                'completed': self._completed,
+                'failed': self._failed,
+                'rejected': self._rejected,
+                'retained': len(self._finished),
+                'retained_mb': round(self._retained_bytes / (1024 * 1024), 1),
+                'evicted': self._evicted,
+                'max_retained': self.max_retained,
+                'max_retained_mb': round(self.max_retained_bytes / (1024 * 1024), 1),
+                'ttl': self.ttl,
+                'state_dir': self.state_dir
+            }
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Perceptual hash index for Level 3 verification
+
+Computes the same 64-bit DCT pHash as src/phase.ts (grayscale, 32x32,
+top-left 8x8 of the 2D DCT compared against the mean of its AC terms) with
+two matrix products instead of nested loops. The thumbnail is OpenCV's area
+average, not sharp's resampler, so the two hashes of one file are close but
+not always equal (usually 0-2 bits apart): compare pHashes by Hamming
+distance, never by equality. Every embedded image is kept
+in a BK-tree keyed by Hamming distance so the closest minted token can be
+found without scanning the whole collection.
+
+The index is persisted as an append-only JSONL log and rebuilt on startup.
+Several server processes can share one log: each process tails it before a
+lookup, so entries appended by the others become visible without a restart.
+"""
+
+import json
+import os
+import threading
+
+import cv2
+import numpy as np
+
+PHASH_SIZE = 32
+PHASH_LOW_FREQ = 8
+
+
+def _dct_matrix(n):
+    """Unnormalized DCT-II basis, matching the dct1 helper in src/phase.ts"""
+    k = np.arange(n)[:, None]
+    x = np.arange(n)[None, :]
+    return np.cos((np.pi / n) * (x + 0.5) * k)
+
+
+_DCT_32 = _dct_matrix(PHASH_SIZE)
+
+
+def phash_thumbnail(cv2_image):
+    """Grayscale 32x32 area-averaged thumbnail the pHash is computed from"""
+    gray = cv2_image if cv2_image.ndim == 2 else cv2.cvtColor(cv2_image, cv2.COLOR_BGR2GRAY)
+    return cv2.resize(gray, (PHASH_SIZE, PHASH_SIZE), interpolation=cv2.INTER_AREA)
+
+
+def phash64(cv2_image):
+    """64-bit perceptual hash of a decoded BGR (or grayscale) image"""
+    return phash64_from_thumbnail(phash_thumbnail(cv2_image))
+
+
+def phash64_from_thumbnail(thumbnail):
+    """pHash of a PHASH_SIZE x PHASH_SIZE grayscale thumbnail"""
+    small = thumbnail.astype(np.float64)
+    dct = _DCT_32 @ small @ _DCT_32.T
+    block = dct[:PHASH_LOW_FREQ, :PHASH_LOW_FREQ].ravel()
+    bits = block > block[1:].mean()
+
+    return int.from_bytes(np.packbits(bits).tobytes(), 'big')
+
+
+def phash_hex(value):
+    """Format a pHash as 0x-prefixed hex, like computePHash64 in scripts/utils.ts"""
+    return f"0x{value:016x}"
+
+
+def parse_phash(value):
+    """Accept a pHash as int or (0x-prefixed) hex string"""
+    if isinstance(value, int):
+        return value
+    return int(value, 16)
+
+
+def hamming(a, b):
+    return (a ^ b).bit_count()
+
+
+class BKTree:
+    """BK-tree over 64-bit hashes; each node holds every entry with that hash"""
+
+    def __init__(self):
+        self._root = None
+        self._size = 0
+
+    def __len__(self):
+        return self._size
+
+    def add(self, key, entry):
+        self._size += 1
+        if self._root is None:
+            self._root = [key, [entry], {}]
+            return
+
+        node = self._root
+        while True:
+            distance = hamming(key, node[0])
+            if distance == 0:
+                node[1].append(entry)
+                return
+            child = node[2].get(distance)
+            if child is None:
+                node[2][distance] = [key, [entry], {}]
+                return
+            node = child
+
+    def search(self, key, max_distance):
+        """All (distance, entry) pairs within max_distance, closest first"""
+        if self._root is None:
+            return []
+
+        results = []
+        stack = [self._root]
+        while stack:
+            node_key, entries, children = stack.pop()
+            distance = hamming(key, node_key)
+            if distance <= max_distance:
+                results.extend((distance, entry) for entry in entries)
+
+            # Triangle inequality: only subtrees in this band can hold matches
+            low, high = distance - max_distance, distance + max_distance
+            stack.extend(child for d, child in children.items() if low <= d <= high)
+
+        results.sort(key=lambda match: match[0])
+        return results
+
+
+class PerceptualHashIndex:
+    """Thread-safe persistent near-duplicate index of embedded images"""
+
+    def __init__(self, path):
+        self.path = path
+        self._tree = BKTree()
+        self._lock = threading.Lock()
+        self._offset = 0
+        with self._lock:
+            self._catch_up()
+
+    def _catch_up(self):
+        """Add log lines appended since the last read (caller holds the lock)"""
+        if not self.path:
+            return
+        try:
+            if os.path.getsize(self.path) <= self._offset:
+                return
+            with open(self.path, 'rb') as log:
+                log.seek(self._offset)
+                data = log.read()
+        except OSError:
+            return
+
+        # A line still being written by another process is picked up next time
+        end = data.rfind(b'\n') + 1
+        self._offset += end
+        for line in data[:end].splitlines():
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                entry = json.loads(line)
+                self._tree.add(parse_phash(entry['phash']), entry)
+            except (ValueError, KeyError) as e:
+                print(f"Skipping bad pHash index entry: {e}")
+
+    def __len__(self):
+        with self._lock:
+            self._catch_up()
+            return len(self._tree)
+
+    def add(self, phash, **fields):
+        """Append an embedded image to the on-disk log and the index"""
+        entry = dict(fields, phash=phash_hex(phash))
+        with self._lock:
+            if not self.path:
+                self._tree.add(phash, entry)
+                return entry
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            # One O_APPEND write per line keeps concurrent writers from interleaving
+            with open(self.path, 'ab') as log:
+                log.write((json.dumps(entry) + '\n').encode())
+            self._catch_up()
+        return entry
+
+    def nearest(self, phash, max_distance, limit=5):
+        """Closest indexed images within max_distance bits, as (distance, entry)"""
+        with self._lock:
+            self._catch_up()
+            return self._tree.search(phash, max_distance)[:limit]
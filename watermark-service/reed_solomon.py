@@ -0,0 +1,204 @@
+#!/usr/bin/env python3
+"""
+Reed-Solomon codec over GF(2^8) for watermark payloads
+
+Systematic RS(n, n - nsym) with the 0x11d primitive polynomial and
+generator roots alpha^0 .. alpha^(nsym-1). Corrects up to nsym // 2 byte
+errors anywhere in the codeword. Payloads are a few dozen bytes, so plain
+Python lookup tables are plenty fast.
+"""
+
+PRIMITIVE_POLY = 0x11d
+
+GF_EXP = [0] * 512
+GF_LOG = [0] * 256
+
+_x = 1
+for _i in range(255):
+    GF_EXP[_i] = _x
+    GF_LOG[_x] = _i
+    _x <<= 1
+    if _x & 0x100:
+        _x ^= PRIMITIVE_POLY
+for _i in range(255, 512):
+    GF_EXP[_i] = GF_EXP[_i - 255]
+
+
+class ReedSolomonError(Exception):
+    """Raised when a codeword has more errors than the parity can correct"""
+
+
+def gf_mul(a, b):
+    if a == 0 or b == 0:
+        return 0
+    return GF_EXP[GF_LOG[a] + GF_LOG[b]]
+
+
+def gf_div(a, b):
+    if b == 0:
+        raise ZeroDivisionError()
+    if a == 0:
+        return 0
+    return GF_EXP[(GF_LOG[a] + 255 - GF_LOG[b]) % 255]
+
+
+def gf_pow(x, power):
+    return GF_EXP[(GF_LOG[x] * power) % 255]
+
+
+def gf_inverse(x):
+    return GF_EXP[255 - GF_LOG[x]]
+
+
+def gf_poly_scale(p, x):
+    return [gf_mul(c, x) for c in p]
+
+
+def gf_poly_add(p, q):
+    r = [0] * max(len(p), len(q))
+    for i, c in enumerate(p):
+        r[i + len(r) - len(p)] = c
+    for i, c in enumerate(q):
+        r[i + len(r) - len(q)] ^= c
+    return r
+
+
+def gf_poly_mul(p, q):
+    r = [0] * (len(p) + len(q) - 1)
+    for j, qc in enumerate(q):
+        for i, pc in enumerate(p):
+            r[i + j] ^= gf_mul(pc, qc)
+    return r
+
+
+def gf_poly_eval(p, x):
+    y = p[0]
+    for c in p[1:]:
+        y = gf_mul(y, x) ^ c
+    return y
+
+
+_generators = {}
+
+
+def generator_poly(nsym):
+    if nsym not in _generators:
+        g = [1]
+        for i in range(nsym):
+            g = gf_poly_mul(g, [1, gf_pow(2, i)])
+        _generators[nsym] = g
+    return _generators[nsym]
+
+
+def rs_encode(data, nsym):
+    """Append nsym parity bytes to data"""
+    if len(data) + nsym > 255:
+        raise ValueError('message too long for GF(2^8) Reed-Solomon')
+
+    gen = generator_poly(nsym)
+    msg = list(data) + [0] * nsym
+    for i in range(len(data)):
+        coef = msg[i]
+        if coef != 0:
+            for j in range(1, len(gen)):
+                msg[i + j] ^= gf_mul(gen[j], coef)
+    return bytes(data) + bytes(msg[len(data):])
+
+
+def gf_poly_div(dividend, divisor):
+    """Synthetic division, returns (quotient, remainder)"""
+    out = list(dividend)
+    for i in range(len(dividend) - (len(divisor) - 1)):
+        coef = out[i]
+        if coef != 0:
+            for j in range(1, len(divisor)):
+                if divisor[j] != 0:
+                    out[i + j] ^= gf_mul(divisor[j], coef)
+    separator = -(len(divisor) - 1)
+    return out[:separator], out[separator:]
+
+
+def _syndromes(msg, nsym):
+    # Leading 0 keeps the indices of the textbook formulation
+    return [0] + [gf_poly_eval(msg, gf_pow(2, i)) for i in range(nsym)]
+
+
+def _error_locator(synd, nsym):
+    """Berlekamp-Massey: error locator polynomial from the syndromes"""
+    err_loc = [1]
+    old_loc = [1]
+    shift = len(synd) - nsym
+    for i in range(nsym):
+        k = i + shift
+        delta = synd[k]
+        for j in range(1, len(err_loc)):
+            delta ^= gf_mul(err_loc[-(j + 1)], synd[k - j])
+        old_loc = old_loc + [0]
+        if delta != 0:
+            if len(old_loc) > len(err_loc):
+                new_loc = gf_poly_scale(old_loc, delta)
+                old_loc = gf_poly_scale(err_loc, gf_inverse(delta))
+                err_loc = new_loc
+            err_loc = gf_poly_add(err_loc, gf_poly_scale(old_loc, delta))
+
+    while err_loc and err_loc[0] == 0:
+        err_loc = err_loc[1:]
+    if (len(err_loc) - 1) * 2 > nsym:
+        raise ReedSolomonError('too many errors to correct')
+    return err_loc
+
+
+def _error_positions(err_loc, n):
+    """Chien search: codeword positions of the roots of the error locator"""
+    positions = [n - 1 - i for i in range(n) if gf_poly_eval(err_loc, gf_pow(2, i)) == 0]
+    if len(positions) != len(err_loc) - 1:
+        raise ReedSolomonError('could not locate errors')
+    return positions
+
+
+def _correct_errata(msg, synd, positions):
+    """Forney algorithm: fix the bytes at the known error positions"""
+    coef_pos = [len(msg) - 1 - p for p in positions]
+
+    err_loc = [1]
+    for i in coef_pos:
+        err_loc = gf_poly_mul(err_loc, gf_poly_add([1], [gf_pow(2, i), 0]))
+
+    # Error evaluator: (S(x) * Lambda(x)) mod x^(nsym+1)
+    _, err_eval = gf_poly_div(gf_poly_mul(synd[::-1], err_loc), [1] + [0] * len(err_loc))
+    err_eval = err_eval[::-1]
+
+    x_roots = [gf_pow(2, -(255 - i)) for i in coef_pos]
+    magnitudes = [0] * len(msg)
+    for i, xi in enumerate(x_roots):
+        xi_inv = gf_inverse(xi)
+        denominator = 1
+        for j, xj in enumerate(x_roots):
+            if j != i:
+                denominator = gf_mul(denominator, 1 ^ gf_mul(xi_inv, xj))
+        if denominator == 0:
+            raise ReedSolomonError('could not correct errors')
+        y = gf_mul(xi, gf_poly_eval(err_eval[::-1], xi_inv))
+        magnitudes[positions[i]] = gf_div(y, denominator)
+
+    return gf_poly_add(msg, magnitudes)
+
+
+def rs_decode(codeword, nsym):
+    """
+    Correct codeword and return (data, corrected_bytes)
+
+    Raises ReedSolomonError when more than nsym // 2 bytes are wrong.
+    """
+    msg = list(codeword)
+    synd = _syndromes(msg, nsym)
+    if max(synd) == 0:
+        return bytes(msg[:-nsym]), 0
+
+    err_loc = _error_locator(synd, nsym)
+    positions = _error_positions(err_loc[::-1], len(msg))
+    corrected = _correct_errata(msg, synd, positions)
+
+    if max(_syndromes(corrected, nsym)) != 0:
+        raise ReedSolomonError('could not correct errors')
+    return bytes(corrected[:-nsym]), len(positions)
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Gallery renditions of watermarked images
+
+/embed can scale the watermarked image down to display sizes while it is
+still decoded in memory. The default sizes are a thumbnail, a preview and
+a full-size web copy. The gallery serves these files, so showing a
+thumbnail never decodes a full-resolution master, and an upload is decoded
+exactly once.
+
+Each rendition is fitted to a longest edge with area interpolation, which
+averages every source pixel a target pixel covers and so does not alias
+when shrinking. Images are never scaled up. Renditions are meant for
+display. Their watermark may not survive the downscale, so verify the
+master.
+
+Files are stored in a content-addressed disk cache under the SHA-256 of
+their bytes, so identical renditions are stored once. For example, the
+preview and full copies of a small image are the same file. Each master
+gets a small manifest, named by its watermarked SHA-256, that maps
+rendition names to files. Reading a file refreshes its modification time.
+When the cache grows past its size limit, the least recently used files
+are evicted.
+"""
+
+import hashlib
+import json
+import os
+import re
+import threading
+
+import cv2
+
+from image_encoders import EncodeOptionError, encode, get_format
+
+SHA256_PATTERN = re.compile(r'^[0-9a-f]{64}$')
+# Eviction stops once the cache is this fraction of its limit, so it does not rescan on every put
+LOW_WATER = 0.9
+
+
+def parse_sizes(spec):
+    """{name: longest edge} from "thumbnail:320,preview:1280,full:2560", largest first"""
+    sizes = {}
+    for part in spec.split(','):
+        if part.strip():
+            name, edge = part.split(':')
+            sizes[name.strip()] = int(edge)
+    return dict(sorted(sizes.items(), key=lambda item: -item[1]))
+
+
+def requested_renditions(value, sizes):
+    """
+    Rendition names asked for by a request's "renditions" field
+
+    Accepts a flag (1/true/all for every size, empty/0/false for none), a
+    comma-separated string of names or a list of names. Raises
+    EncodeOptionError for an unknown name.
+    """
+    if value is None or value is False:
+        return []
+    if value is True:
+        return list(sizes)
+    names = value if isinstance(value, (list, tuple)) else str(value).split(',')
+    names = [str(name).strip() for name in names if str(name).strip()]
+    if len(names) == 1 and names[0].lower() in ('0', 'false', 'no', 'none'):
+        return []
+    if len(names) == 1 and names[0].lower() in ('1', 'true', 'yes', 'all'):
+        return list(sizes)
+    unknown = [name for name in names if name not in sizes]
+    if unknown:
+        raise EncodeOptionError(f"Unknown rendition: {', '.join(unknown)} (one of {', '.join(sizes)})")
+    # Largest first, like sizes, so the longest encode starts first
+    return [name for name in sizes if name in names]
+
+
+def fit(cv2_image, max_edge):
+    """The image scaled down (area interpolation) so its longest edge is at most max_edge"""
+    height, width = cv2_image.shape[:2]
+    scale = max_edge / max(height, width)
+    if scale >= 1:
+        return cv2_image
+    size = (max(1, round(width * scale)), max(1, round(height * scale)))
+    return cv2.resize(cv2_image, size, interpolation=cv2.INTER_AREA)
+
+
+def render(cv2_image, max_edge, cache, format='JPEG', quality=85, preset='fast'):
+    """Scale, encode and store one rendition; returns its manifest entry"""
+    scaled = fit(cv2_image, max_edge)
+    data = encode(scaled, format, quality, preset)
+    output = get_format(format)
+    sha256 = cache.put(data, output.extension)
+    height, width = scaled.shape[:2]
+    return {
+        'width': width,
+        'height': height,
+        'format': output.name,
+        'size': data.size,
+        'sha256': sha256,
+        'file': sha256 + output.extension
+    }
+
+
+class RenditionCache:
+    """Content-addressed rendition files with per-master manifests and LRU eviction by total bytes"""
+
+    def __init__(self, disk_dir, max_bytes):
+        self.disk_dir = disk_dir
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._bytes = None  # total size of the files, known after the first scan
+        self._evicting = False
+
+        self.writes = 0
+        self.deduplicated = 0
+        self.evictions = 0
+
+        os.makedirs(os.path.join(self.disk_dir, 'masters'), exist_ok=True)
+
+    def file_path(self, file):
+        """Path of a rendition file name (sha256 + extension), or None if malformed"""
+        sha256, _, extension = file.partition('.')
+        if not SHA256_PATTERN.match(sha256) or not extension.isalnum():
+            return None
+        return os.path.join(self.disk_dir, sha256[:2], file)
+
+    def _manifest_path(self, master_sha256):
+        return os.path.join(self.disk_dir, 'masters', master_sha256 + '.json')
+
+    def put(self, data, extension):
+        """Store encoded bytes under their SHA-256 and return the digest"""
+        sha256 = hashlib.sha256(data).hexdigest()
+        path = self.file_path(sha256 + extension)
+        if os.path.exists(path):
+            self._touch(path)
+            with self._lock:
+                self.deduplicated += 1
+            return sha256
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            self.writes += 1
+            if self._bytes is not None:
+                self._bytes += len(data)
+            evict = not self._evicting and (self._bytes is None or self._bytes > self.max_bytes)
+            if evict:
+                self._evicting = True
+        if evict:
+            try:
+                self._evict()
+            finally:
+                with self._lock:
+                    self._evicting = False
+        return sha256
+
+    def put_manifest(self, master_sha256, renditions):
+        path = self._manifest_path(master_sha256)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(renditions, f)
+        os.replace(tmp_path, path)
+
+    def get_manifest(self, master_sha256):
+        """{name: entry} of the master's renditions still on disk, or None"""
+        if not SHA256_PATTERN.match(master_sha256):
+            return None
+        path = self._manifest_path(master_sha256)
+        try:
+            with open(path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        manifest = {name: entry for name, entry in manifest.items() if os.path.exists(self.file_path(entry['file']))}
+        if not manifest:
+            # Every file was evicted
+            self._remove(path)
+            return None
+        return manifest
+
+    def open(self, file):
+        """Path of a stored rendition file, marking it recently used, or None"""
+        path = self.file_path(file)
+        if path is None or not os.path.exists(path):
+            return None
+        self._touch(path)
+        return path
+
+    def _evict(self):
+        """Rescan the files and delete the least recently used down to LOW_WATER of max_bytes"""
+        files = []
+        try:
+            for prefix in os.scandir(self.disk_dir):
+                if prefix.is_dir() and prefix.name != 'masters':
+                    for entry in os.scandir(prefix.path):
+                        if not entry.name.endswith('.tmp'):
+                            stat = entry.stat()
+                            files.append((stat.st_mtime, stat.st_size, entry.path))
+        except OSError:
+            return
+
+        total = sum(size for _, size, _ in files)
+        evicted = 0
+        if total > self.max_bytes:
+            for _, size, path in sorted(files):
+                if total <= self.max_bytes * LOW_WATER:
+                    break
+                self._remove(path)
+                total -= size
+                evicted += 1
+        if evicted:
+            self._prune_manifests()
+        with self._lock:
+            self._bytes = total
+            self.evictions += evicted
+
+    def _prune_manifests(self):
+        """Delete the manifests of masters whose rendition files have all been evicted"""
+        try:
+            entries = list(os.scandir(os.path.join(self.disk_dir, 'masters')))
+        except OSError:
+            return
+        for entry in entries:
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                with open(entry.path) as f:
+                    manifest = json.load(f)
+            except (OSError, ValueError):
+                continue
+            if not any(os.path.exists(self.file_path(item['file'])) for item in manifest.values()):
+                self._remove(entry.path)
+
+    @staticmethod
+    def _touch(path):
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                'disk_dir': self.disk_dir,
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+                'writes': self.writes,
+                'deduplicated': self.deduplicated,
+                'evictions': self.evictions
+            }
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Content-addressed result cache for /extract and /verify
+
+Results are keyed by the SHA-256 of the uploaded bytes (plus the request
+parameters that affect the result), so checking the same gallery image
+again is a dictionary lookup instead of a decode and DWT-DCT extraction.
+
+Entries live in a bounded in-memory LRU with a TTL. When a directory is
+configured they are also written there as JSON files, which survive
+restarts and are shared by every worker process on the host.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class ResultCache:
+    """Bounded LRU + TTL cache of JSON-serializable results"""
+
+    def __init__(self, max_entries=1024, ttl=3600, disk_dir=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.disk_dir = disk_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._puts_since_prune = 0
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if self.disk_dir:
+            os.makedirs(self.disk_dir, exist_ok=True)
+
+    @staticmethod
+    def make_key(namespace, sha256, *params):
+        """Cache key for a result of namespace over the given content hash"""
+        return '|'.join([namespace, sha256] + ['' if p is None else str(p) for p in params])
+
+    def _disk_path(self, key):
+        return os.path.join(self.disk_dir, hashlib.sha256(key.encode()).hexdigest() + '.json')
+
+    def _expired(self, stored_at):
+        return self.ttl > 0 and time.time() - stored_at > self.ttl
+
+    def get(self, key):
+        """Cached value for key, or None"""
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None:
+                stored_at, value = item
+                if not self._expired(stored_at):
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return value
+                del self._entries[key]
+
+        value = self._get_from_disk(key)
+
+        with self._lock:
+            if value is None:
+                self.misses += 1
+            else:
+                self.disk_hits += 1
+        return value
+
+    def _get_from_disk(self, key):
+        if not self.disk_dir:
+            return None
+        path = self._disk_path(key)
+        try:
+            with open(path, 'r') as f:
+                record = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if record.get('key') != key or self._expired(record['stored_at']):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            return None
+
+        self._remember(key, record['stored_at'], record['value'])
+        return record['value']
+
+    def _remember(self, key, stored_at, value):
+        with self._lock:
+            self._entries[key] = (stored_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key, value):
+        """Store value under key"""
+        stored_at = time.time()
+        self._remember(key, stored_at, value)
+
+        if not self.disk_dir:
+            return
+        path = self._disk_path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(tmp_path, 'w') as f:
+                json.dump({'key': key, 'stored_at': stored_at, 'value': value}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"Result cache write failed: {e}")
+            return
+
+        with self._lock:
+            self._puts_since_prune += 1
+            prune = self._puts_since_prune >= 64
+            if prune:
+                self._puts_since_prune = 0
+        if prune:
+            self._prune_disk()
+
+    def _prune_disk(self):
+        """Drop expired files and keep the newest max_entries on disk"""
+        try:
+            files = [
+                os.path.join(self.disk_dir, name)
+                for name in os.listdir(self.disk_dir)
+                if name.endswith('.json')
+            ]
+            files = sorted(((os.path.getmtime(p), p) for p in files), reverse=True)
+        except OSError:
+            return
+
+        now = time.time()
+        for position, (mtime, path) in enumerate(files):
+            if position >= self.max_entries or (self.ttl > 0 and now - mtime > self.ttl):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.disk_hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl': self.ttl,
+                'disk_dir': self.disk_dir,
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,273 @@
+#!/usr/bin/env python3
+"""
+Robustness-vs-speed evaluation of watermark configurations
+
+Embeds with the current service code for every configuration (method x
+payload version x output format), then runs a matrix of attacks on each
+watermarked image: JPEG recompression, rescaling, downscaling, cropping,
+blur and a PNG round trip. Embeds and attacks are spread across a process
+pool. For every configuration and attack it records the bit error rate,
+how often parse_payload succeeded and the embed/extract times, then lists
+the configurations that meet a target survival rate, fastest first.
+
+    python robustness_harness.py
+    python robustness_harness.py --methods dwtDct --formats PNG,JPEG95 --target 0.9 --output robustness.json
+"""
+
+import argparse
+import itertools
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# Keep harness embeds out of the real pHash index and registry
+os.environ.setdefault('PHASH_INDEX_PATH', os.path.join(tempfile.mkdtemp(prefix='photomint-robustness-'), 'phash.jsonl'))
+os.environ.setdefault('WATERMARK_REGISTRY_PATH', '')
+
+import cv2
+import numpy as np
+
+import watermark_server as ws
+from benchmark_suite import synthetic_photo
+
+TOKEN_ID = '123'
+CREATOR = '0x1234567890abcdef1234567890abcdef12345678'
+
+DEFAULT_METHODS = ('dwtDct', 'dwtDctSvd')
+DEFAULT_PAYLOADS = ('v2', 'v1')
+# Output format of the embed step: PNG, or JPEG at a quality
+DEFAULT_FORMATS = ('PNG', 'JPEG95', 'JPEG85')
+DEFAULT_ATTACKS = ('none', 'png', 'jpeg90', 'jpeg75', 'jpeg50', 'rescale0.75', 'downscale0.5',
+                   'crop_br10', 'crop_center10', 'blur1')
+
+
+def _jpeg(image, quality):
+    ok, buf = cv2.imencode('.jpg', image, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+    return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+
+def _crop(image, fraction, centered):
+    row, col = image.shape[:2]
+    dr, dc = int(row * fraction), int(col * fraction)
+    if centered:
+        return image[dr // 2:row - (dr - dr // 2), dc // 2:col - (dc - dc // 2)]
+    # Keeps the top-left origin, so the DWT block grid stays aligned
+    return image[:row - dr, :col - dc]
+
+
+def attack(image, name):
+    """Apply one named transformation to a decoded BGR image"""
+    row, col = image.shape[:2]
+    if name == 'none':
+        return image
+    if name == 'png':
+        ok, buf = cv2.imencode('.png', image)
+        return cv2.imdecode(buf, cv2.IMREAD_COLOR)
+    if name.startswith('jpeg'):
+        return _jpeg(image, int(name[4:]))
+    if name.startswith('rescale'):
+        # Scaled copy brought back to the original size
+        scale = float(name[7:])
+        small = cv2.resize(image, (int(col * scale), int(row * scale)), interpolation=cv2.INTER_AREA)
+        return cv2.resize(small, (col, row), interpolation=cv2.INTER_CUBIC)
+    if name.startswith('downscale'):
+        scale = float(name[9:])
+        return cv2.resize(image, (int(col * scale), int(row * scale)), interpolation=cv2.INTER_AREA)
+    if name.startswith('crop_br'):
+        return _crop(image, int(name[7:]) / 100, centered=False)
+    if name.startswith('crop_center'):
+        return _crop(image, int(name[11:]) / 100, centered=True)
+    if name.startswith('blur'):
+        return cv2.GaussianBlur(image, (0, 0), float(name[4:]))
+    raise ValueError(f'unknown attack: {name}')
+
+
+def make_payload(version):
+    if version == 'v2':
+        return ws.WatermarkPayload.create_payload_v2(TOKEN_ID, CREATOR)
+    return ws.WatermarkPayload.create_payload_v1(TOKEN_ID, CREATOR)
+
+
+def _output_format(fmt):
+    """('JPEG', 95) for 'JPEG95', ('PNG', None) for 'PNG'"""
+    if fmt.upper().startswith('JPEG'):
+        return 'JPEG', int(fmt[4:] or 95)
+    return 'PNG', None
+
+
+def embed_task(image_index, image, method, payload_version, fmt):
+    """Embed one configuration into one image (runs in a pool worker)"""
+    payload = make_payload(payload_version)
+    output_format, quality = _output_format(fmt)
+
+    started = time.perf_counter()
+    watermarked = ws.make_encoder(payload, method).encode(image, method)
+    encoded = ws.cv2_to_bytes(watermarked, output_format, quality or 95)
+    embed_seconds = time.perf_counter() - started
+
+    return {
+        'image': image_index,
+        'method': method,
+        'payload': payload_version,
+        'format': fmt,
+        'payload_bytes': payload,
+        'encoded': encoded,
+        'embed_seconds': embed_seconds
+    }
+
+
+def extract_task(embedded, attack_name):
+    """Attack one watermarked image and try to read the payload back"""
+    payload = embedded['payload_bytes']
+    image = attack(cv2.imdecode(np.frombuffer(embedded['encoded'], np.uint8), cv2.IMREAD_COLOR), attack_name)
+
+    started = time.perf_counter()
+    try:
+        extracted = ws.make_decoder(len(payload), embedded['method']).decode(image, embedded['method'])
+        parsed = ws.WatermarkPayload.parse_payload(extracted)
+    except Exception:
+        # Too small after the attack, or the decoder gave up
+        extracted, parsed = b'', None
+    extract_seconds = time.perf_counter() - started
+
+    expected_bits = np.unpackbits(np.frombuffer(payload, np.uint8))
+    if len(extracted) == len(payload):
+        errors = int(np.count_nonzero(np.unpackbits(np.frombuffer(extracted, np.uint8)) != expected_bits))
+    else:
+        errors = len(expected_bits)
+
+    survived = bool(parsed) and parsed['token_id'] == TOKEN_ID
+    return {
+        'image': embedded['image'],
+        'method': embedded['method'],
+        'payload': embedded['payload'],
+        'format': embedded['format'],
+        'attack': attack_name,
+        'bit_error_rate': errors / len(expected_bits),
+        'survived': survived,
+        'embed_seconds': embedded['embed_seconds'],
+        'extract_seconds': extract_seconds
+    }
+
+
+def summarize(rows):
+    """Aggregate per (method, payload, format, attack) over the test images"""
+    groups = {}
+    for row in rows:
+        groups.setdefault((row['method'], row['payload'], row['format'], row['attack']), []).append(row)
+
+    table = []
+    for (method, payload, fmt, attack_name), items in sorted(groups.items()):
+        table.append({
+            'method': method,
+            'payload': payload,
+            'format': fmt,
+            'attack': attack_name,
+            'images': len(items),
+            'survival_rate': round(sum(r['survived'] for r in items) / len(items), 3),
+            'mean_ber': round(float(np.mean([r['bit_error_rate'] for r in items])), 4),
+            'embed_ms': round(float(np.mean([r['embed_seconds'] for r in items])) * 1000, 1),
+            'extract_ms': round(float(np.mean([r['extract_seconds'] for r in items])) * 1000, 1)
+        })
+    return table
+
+
+def rank_configurations(table, target, target_attacks):
+    """Per configuration survival over target_attacks, fastest first among those meeting target"""
+    configs = {}
+    for row in table:
+        if row['attack'] in target_attacks:
+            configs.setdefault((row['method'], row['payload'], row['format']), []).append(row)
+
+    ranking = []
+    for (method, payload, fmt), rows in configs.items():
+        survival = float(np.mean([r['survival_rate'] for r in rows]))
+        ranking.append({
+            'method': method,
+            'payload': payload,
+            'format': fmt,
+            'survival_rate': round(survival, 3),
+            'worst_attack': min(rows, key=lambda r: r['survival_rate'])['attack'],
+            'mean_ber': round(float(np.mean([r['mean_ber'] for r in rows])), 4),
+            'embed_ms': rows[0]['embed_ms'],
+            'extract_ms': round(float(np.mean([r['extract_ms'] for r in rows])), 1),
+            'meets_target': survival >= target
+        })
+    ranking.sort(key=lambda r: (not r['meets_target'], r['embed_ms'] + r['extract_ms']))
+    return ranking
+
+
+def print_table(rows, columns):
+    widths = {c: max(len(c), *(len(str(r[c])) for r in rows)) for c in columns}
+    print('  '.join(c.ljust(widths[c]) for c in columns))
+    for row in rows:
+        print('  '.join(str(row[c]).ljust(widths[c]) for c in columns))
+
+
+def _split(value):
+    return [item.strip() for item in value.split(',') if item.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Watermark robustness vs speed evaluation')
+    parser.add_argument('--methods', default=','.join(DEFAULT_METHODS))
+    parser.add_argument('--payloads', default=','.join(DEFAULT_PAYLOADS), help='payload versions (v1, v2)')
+    parser.add_argument('--formats', default=','.join(DEFAULT_FORMATS), help='embed output: PNG or JPEG<quality>')
+    parser.add_argument('--attacks', default=','.join(DEFAULT_ATTACKS))
+    parser.add_argument('--images', type=int, default=3, help='number of synthetic test photos')
+    parser.add_argument('--megapixels', type=float, default=1.0)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--target', type=float, default=0.9, help='required survival rate (0-1)')
+    parser.add_argument('--target-attacks', help='attacks the target applies to (default: all)')
+    parser.add_argument('--output', help='write the full table and ranking as JSON')
+    args = parser.parse_args()
+
+    attacks = _split(args.attacks)
+    for name in attacks:
+        attack(np.zeros((16, 16, 3), np.uint8), name)  # reject typos before any work starts
+
+    images = [synthetic_photo(args.megapixels, seed) for seed in range(args.images)]
+    configs = list(itertools.product(_split(args.methods), _split(args.payloads), _split(args.formats)))
+    print(f"{len(configs)} configurations x {len(images)} images x {len(attacks)} attacks "
+          f"on {args.workers} workers")
+
+    started = time.time()
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=ws._init_batch_worker) as pool:
+        embed_futures = [
+            pool.submit(embed_task, index, image, method, payload, fmt)
+            for (method, payload, fmt) in configs
+            for index, image in enumerate(images)
+        ]
+        extract_futures = [
+            pool.submit(extract_task, future.result(), name)
+            for future in embed_futures
+            for name in attacks
+        ]
+        rows = [future.result() for future in extract_futures]
+
+    table = summarize(rows)
+    target_attacks = _split(args.target_attacks) if args.target_attacks else attacks
+    ranking = rank_configurations(table, args.target, target_attacks)
+
+    print(f"\nPer attack ({time.time() - started:.1f}s):")
+    print_table(table, ['method', 'payload', 'format', 'attack', 'survival_rate', 'mean_ber', 'embed_ms', 'extract_ms'])
+    print(f"\nConfigurations by speed, target survival {args.target:.0%} over {', '.join(target_attacks)}:")
+    print_table(ranking, ['method', 'payload', 'format', 'survival_rate', 'worst_attack', 'mean_ber',
+                          'embed_ms', 'extract_ms', 'meets_target'])
+
+    best = next((r for r in ranking if r['meets_target']), None)
+    if best:
+        print(f"\nFastest configuration meeting the target: {best['method']} / {best['payload']} / {best['format']}")
+    else:
+        print("\nNo configuration meets the target survival rate")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'target': args.target, 'attacks': attacks, 'target_attacks': target_attacks, 'table': table, 'ranking': ranking}, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
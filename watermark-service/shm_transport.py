@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""
+Shared-memory transport for decoded images
+
+Moves np.ndarray images between the web process and compute workers by
+handle instead of pickling them: the web process copies the decoded image
+into a shared-memory segment, the worker maps the same segment, and the
+result comes back the same way. A 24MP frame then costs one memcpy each
+way instead of a pickle, a pipe transfer and an unpickle.
+
+Lifecycle: the web process owns every segment. SharedImagePool creates
+them, keeps released ones for reuse (best fit, within a byte budget) and
+unlinks them on eviction or close(). Workers only attach, and detach()
+once the task is done, so an idle worker maps nothing and a segment the
+pool unlinks is freed at once. A worker that crashes therefore cannot leak a
+segment: the lease is released by the caller, and the segment either
+returns to the pool or is unlinked. If the web process itself dies,
+Python's resource tracker unlinks the segments it created.
+"""
+
+import threading
+from multiprocessing import shared_memory
+
+import numpy as np
+
+SEGMENT_ALIGN = 1024 * 1024  # segment sizes are rounded up to whole MB
+
+
+class ImageSlot:
+    """A leased segment viewed as one image; pass .handle to workers"""
+
+    def __init__(self, segment, shape, dtype):
+        self.segment = segment
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.array = np.ndarray(self.shape, self.dtype, buffer=segment.buf)
+
+    @property
+    def handle(self):
+        return (self.segment.name, self.shape, self.dtype.str)
+
+
+class SharedImagePool:
+    """Reusable shared-memory segments for images, owned by the creating process"""
+
+    def __init__(self, budget_bytes):
+        self.budget_bytes = budget_bytes
+        self._free = []  # released segments, kept for reuse
+        self._leased = {}  # name -> segment
+        self._lock = threading.Lock()
+        self.created = 0
+        self.reused = 0
+
+    def _total(self):
+        return sum(s.size for s in self._free) + sum(s.size for s in self._leased.values())
+
+    def lease(self, shape, dtype=np.uint8):
+        """An ImageSlot for an array of shape/dtype; release() it when done"""
+        nbytes = int(np.prod(shape)) * np.dtype(dtype).itemsize
+        with self._lock:
+            # Smallest free segment that fits without wasting more than half of it
+            fits = [s for s in self._free if nbytes <= s.size <= 2 * max(nbytes, SEGMENT_ALIGN)]
+            if fits:
+                segment = min(fits, key=lambda s: s.size)
+                self._free.remove(segment)
+                self.reused += 1
+            else:
+                size = -(-max(nbytes, 1) // SEGMENT_ALIGN) * SEGMENT_ALIGN
+                segment = shared_memory.SharedMemory(create=True, size=size)
+                self.created += 1
+            self._leased[segment.name] = segment
+        return ImageSlot(segment, shape, dtype)
+
+    def put(self, image):
+        """Lease a slot and copy image into it"""
+        slot = self.lease(image.shape, image.dtype)
+        np.copyto(slot.array, image)
+        return slot
+
+    def release(self, slot):
+        """Return a slot to the pool; views of slot.array must not be used afterwards"""
+        slot.array = None
+        with self._lock:
+            segment = self._leased.pop(slot.segment.name, None)
+            if segment is None:
+                return
+            self._free.append(segment)
+            # Over budget: unlink the largest idle segments first
+            while self._free and self._total() > self.budget_bytes:
+                evicted = max(self._free, key=lambda s: s.size)
+                self._free.remove(evicted)
+                _destroy(evicted)
+
+    def close(self):
+        """Unlink every segment, leased or not"""
+        with self._lock:
+            for segment in self._free + list(self._leased.values()):
+                _destroy(segment)
+            self._free = []
+            self._leased = {}
+
+    def unmap_inherited(self):
+        """In a forked child: drop the mappings inherited with the pool, unlinking nothing"""
+        # The parent's lock may have been held at fork time; the child is single-threaded here
+        for segment in self._free + list(self._leased.values()):
+            try:
+                segment.close()
+            except BufferError:
+                pass
+        self._free = []
+        self._leased = {}
+
+    def stats(self):
+        with self._lock:
+            return {
+                'segments_free': len(self._free),
+                'segments_leased': len(self._leased),
+                'bytes': self._total(),
+                'budget_bytes': self.budget_bytes,
+                'created': self.created,
+                'reused': self.reused
+            }
+
+
+def _destroy(segment):
+    try:
+        segment.close()
+    except BufferError:
+        # A view is still alive; the mapping goes with it, the name goes now
+        pass
+    try:
+        segment.unlink()
+    except FileNotFoundError:
+        pass
+
+
+# Worker side: segments mapped by the current task
+_attached = []
+
+
+def attach(handle):
+    """ndarray view of a slot handle, inside a worker process; detach() after the task"""
+    name, shape, dtype = handle
+    # Pool workers share the web process's resource tracker, so the
+    # registration this makes is a no-op and their exit unlinks nothing
+    segment = shared_memory.SharedMemory(name=name)
+    _attached.append(segment)
+    return np.ndarray(shape, np.dtype(dtype), buffer=segment.buf)
+
+
+def detach():
+    """Unmap the segments attached since the last detach()"""
+    still_viewed = []
+    for segment in _attached:
+        try:
+            segment.close()
+        except BufferError:
+            # A view outlived the task (e.g. held by a traceback); retried next time
+            still_viewed.append(segment)
+    _attached[:] = still_viewed
@@ -19,11 +19,20 @@ echo "📥 Installing dependencies..."
 pip install --upgrade pip
 pip install -r requirements.txt
 
+# "./start.sh production" (or WATERMARK_SERVER_MODE=production) runs the
+# pre-forked gunicorn server; the default is the Flask development server
+MODE=${1:-${WATERMARK_SERVER_MODE:-development}}
+
+if [ "$MODE" = "production" ]; then
+    echo "🚀 Starting watermarking service (production, gunicorn) on port 5001..."
+    exec gunicorn -c gunicorn.conf.py wsgi:app
+fi
+
 # Set environment variables
 export FLASK_APP=watermark_server.py
 export FLASK_ENV=development
 
 # Start the service
-echo "🚀 Starting watermarking service on port 5000..."
+echo "🚀 Starting watermarking service on port 5001..."
 python watermark_server.py
 
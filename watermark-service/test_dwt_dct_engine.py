@@ -0,0 +1,89 @@
+"""Bit-compatibility checks for the vectorized DWT-DCT engine against imwatermark"""
+
+import cv2
+import numpy as np
+import pytest
+import pywt
+from imwatermark import WatermarkDecoder, WatermarkEncoder
+
+from dwt_dct_engine import DwtDctDecoder, DwtDctEncoder, haar_dwt2, haar_idwt2
+
+PAYLOAD = b'v1|123|0x12345678|1640995200|a1b2c3d4'
+
+
+def synthetic_image(height, width, seed):
+    """Textured BGR test image with smooth and noisy regions"""
+    rng = np.random.default_rng(seed)
+    noise = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    smooth = cv2.GaussianBlur(noise, (15, 15), 0)
+    mask = (np.arange(width) < width // 2)[None, :, None]
+    return np.where(mask, smooth, noise).astype(np.uint8)
+
+
+@pytest.mark.parametrize('shape', [(256, 256), (480, 640), (301, 517), (1023, 769)])
+def test_haar_matches_pywt(shape):
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (shape[0] // 4 * 4, shape[1] // 4 * 4)).astype(np.float64)
+
+    ca, (ch, cv, cd) = haar_dwt2(frame)
+    ref_ca, (ref_ch, ref_cv, ref_cd) = pywt.dwt2(frame, 'haar')
+    for ours, ref in zip((ca, ch, cv, cd), (ref_ca, ref_ch, ref_cv, ref_cd)):
+        assert np.array_equal(ours, ref)
+
+    # Swapped detail bands as used by imwatermark's reconstruction
+    assert np.array_equal(haar_idwt2((ca, (cv, ch, cd))), pywt.idwt2((ref_ca, (ref_cv, ref_ch, ref_cd)), 'haar'))
+
+
+@pytest.mark.parametrize('shape,seed', [((256, 256), 1), ((480, 640), 2), ((301, 517), 3), ((1023, 769), 4)])
+def test_encode_matches_imwatermark(shape, seed):
+    image = synthetic_image(*shape, seed)
+
+    reference = WatermarkEncoder()
+    reference.set_watermark('bytes', PAYLOAD)
+    expected = reference.encode(image.copy(), 'dwtDct')
+
+    encoder = DwtDctEncoder()
+    encoder.set_watermark('bytes', PAYLOAD)
+    actual = encoder.encode(image.copy(), 'dwtDct')
+
+    assert actual.dtype == expected.dtype
+    assert np.array_equal(actual, expected)
+
+
+@pytest.mark.parametrize('quality', [None, 90, 60])
+def test_decode_matches_imwatermark(quality):
+    encoder = WatermarkEncoder()
+    encoder.set_watermark('bytes', PAYLOAD)
+    watermarked = encoder.encode(synthetic_image(512, 768, 5), 'dwtDct')
+    if quality is not None:
+        ok, buf = cv2.imencode('.jpg', watermarked, [int(cv2.IMWRITE_JPEG_QUALITY), quality])
+        watermarked = cv2.imdecode(buf, cv2.IMREAD_COLOR)
+
+    length = len(PAYLOAD) * 8
+    expected = WatermarkDecoder('bytes', length).decode(watermarked, 'dwtDct')
+    actual = DwtDctDecoder('bytes', length).decode(watermarked, 'dwtDct')
+
+    assert actual == expected
+
+
+def test_rejects_small_images():
+    with pytest.raises(RuntimeError):
+        DwtDctEncoder(PAYLOAD).encode(synthetic_image(128, 128, 6))
+    with pytest.raises(RuntimeError):
+        DwtDctDecoder('bytes', 64).decode(synthetic_image(128, 128, 6))
+
+
+@pytest.mark.parametrize('shape,workers', [((1023, 769), 1), ((1023, 769), 3), ((517, 1283), 4)])
+def test_tiled_matches_single_pass(shape, workers):
+    image = synthetic_image(*shape, 7)
+    # Budget small enough to force strips of a few block rows each
+    budget = 24 * shape[1] * workers * 48
+
+    single = DwtDctEncoder(PAYLOAD).encode(image, 'dwtDct')
+    tiled = DwtDctEncoder(PAYLOAD, tile_budget=budget, workers=workers).encode(image, 'dwtDct')
+    assert np.array_equal(tiled, single)
+
+    length = len(PAYLOAD) * 8
+    expected = WatermarkDecoder('bytes', length).decode(tiled, 'dwtDct')
+    actual = DwtDctDecoder('bytes', length, tile_budget=budget, workers=workers).decode(tiled, 'dwtDct')
+    assert actual == expected
@@ -0,0 +1,111 @@
+"""Images minted with legacy v1 payloads must still extract and verify under v2"""
+
+import base64
+import importlib.util
+import os
+import tempfile
+import time
+import zlib
+
+import cv2
+import numpy as np
+import pytest
+
+# Keep the registry in memory and the pHash index out of data/
+os.environ.setdefault('WATERMARK_REGISTRY_PATH', '')
+os.environ.setdefault('PHASH_INDEX_PATH', os.path.join(tempfile.mkdtemp(), 'phash_index.jsonl'))
+
+import watermark_payload
+import watermark_server as ws
+from dwt_dct_engine import DwtDctEncoder
+from watermark_payload import WatermarkPayload
+
+MINTED_AT = 1640995200
+
+
+def smooth_image(height, width, seed):
+    rng = np.random.default_rng(seed)
+    return cv2.GaussianBlur(rng.integers(0, 256, (height, width, 3), dtype=np.uint8), (15, 15), 0)
+
+
+def unpadded_v1_payload(token_id, creator_short, custom_data):
+    """A v1 payload as minted before padding: the bare text, here 44 bytes"""
+    base = f'v1|{token_id}|{creator_short}|{MINTED_AT}|{custom_data}'
+    return f'{base}|{zlib.crc32(base.encode()) & 0xffffffff:08x}'.encode()
+
+
+@pytest.fixture(params=['padded', 'unpadded'])
+def v1_image(request, monkeypatch):
+    """A v1-watermarked image (large enough to decode without bit errors), with the service on v2"""
+    if request.param == 'padded':
+        monkeypatch.setattr(watermark_payload.time, 'time', lambda: MINTED_AT)
+        payload = WatermarkPayload.create_payload_v1('123', '0x1234567890abcdef', 'Edition')
+        monkeypatch.undo()
+    else:
+        payload = unpadded_v1_payload('123', '0x12345678', 'Edition')
+    monkeypatch.setattr(watermark_payload, 'PAYLOAD_VERSION', 'v2')
+
+    encoder = DwtDctEncoder()
+    encoder.set_watermark('bytes', payload)
+    return encoder.encode(smooth_image(1024, 1024, 7), 'dwtDct')
+
+
+def test_payload_sizes_fall_back_to_v1(monkeypatch):
+    monkeypatch.setattr(watermark_payload, 'PAYLOAD_VERSION', 'v2')
+    sizes = ws.payload_sizes()
+    assert sizes[:2] == [24, 64]
+    assert len(unpadded_v1_payload('123', '0x12345678', 'Edition')) in sizes
+    assert ws.payload_sizes(64) == [64]
+    assert ws.payload_sizes(method='dwtDctSvd') == [24, 64]
+
+
+def test_extract_v1_payload_under_v2(v1_image):
+    result = ws.extract_cv2_image(v1_image)
+    assert result['parsed']['version'] == 'v1'
+    assert result['parsed']['token_id'] == '123'
+    assert result['parsed']['timestamp'] == MINTED_AT
+
+
+def test_verify_v1_payload_under_v2(v1_image):
+    result = ws.verify_cv2_image(v1_image, 'ab' * 32, expected_token_id='123')
+    level = result['verification_levels']['watermark']
+    assert level['valid'] and level['match']
+    assert level['extracted_data']['custom_data'] == 'Edition'
+    assert result['overall_result'] == 'verified'
+
+
+def test_serverless_verify_v1_payload_under_v2(v1_image):
+    # The serverless function decodes and grades with the same shared code
+    pytest.importorskip('flask_cors')
+    path = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'api', 'watermark.py')
+    spec = importlib.util.spec_from_file_location('serverless_watermark', path)
+    serverless = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(serverless)
+
+    _, parsed = serverless.decode_payload(v1_image)
+    assert parsed['version'] == 'v1'
+    assert parsed['custom_data'] == 'Edition'
+
+    image = base64.b64encode(cv2.imencode('.png', v1_image)[1].tobytes()).decode()
+    result = serverless.app.test_client().post('/verify', json={'image': image, 'expected_token_id': '123'}).get_json()
+    assert result['verification_levels']['watermark']['match']
+    assert result['overall_result'] == 'verified'
+
+
+def test_search_budget_covers_every_payload_size(monkeypatch):
+    monkeypatch.setattr(watermark_payload, 'PAYLOAD_VERSION', 'v2')
+    monkeypatch.setattr(ws, 'SEARCH_BUDGET_MS', 400)
+    image = smooth_image(1500, 2000, 11)
+    assert len(ws.payload_sizes()) > 1
+
+    started = time.perf_counter()
+    ws.extract_cv2_image(image)
+    plain = time.perf_counter() - started
+
+    started = time.perf_counter()
+    result = ws.extract_cv2_image(image, search=True)
+    searched = time.perf_counter() - started
+
+    assert result['parsed'] is None
+    # One budget for the whole search, not one per size
+    assert searched - plain < 0.4 * 1.5
@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+"""
+Streaming, size-bounded upload ingestion
+
+Uploads are copied chunk by chunk into a spooled temporary file while
+SHA-256 is computed over the same chunks, so the full body is never held
+as one Python bytes object. Small uploads stay in memory. Larger ones roll
+over to disk and are memory-mapped, so the decoder reads the pages
+straight from the page cache. A maximum size is enforced from the declared
+length (or the base64 length) before reading anything, and again while
+streaming for bodies of unknown length.
+
+The resulting Upload exposes a read-only memoryview that np.frombuffer
+and hashlib accept without copying.
+"""
+
+import base64
+import binascii
+import hashlib
+import mmap
+import tempfile
+
+CHUNK_SIZE = 1024 * 1024  # bytes read (or decoded) per step
+# base64 decodes 4 characters into 3 bytes; chunks must stay 4-aligned
+BASE64_CHUNK_CHARS = CHUNK_SIZE // 3 * 4
+
+
+class UploadTooLarge(ValueError):
+    """The upload is bigger than the configured maximum"""
+
+    def __init__(self, max_bytes):
+        super().__init__(f'Upload too large (max {max_bytes // (1024 * 1024)}MB)')
+        self.max_bytes = max_bytes
+
+
+class Upload:
+    """Encoded image bytes held in a spooled temp file, with their SHA-256"""
+
+    def __init__(self, spool, size, sha256):
+        self.size = size
+        self.sha256 = sha256
+        self._spool = spool
+        self._mmap = None
+        rolled = getattr(spool, '_rolled', True)
+        if rolled and size:
+            # On disk: map it instead of reading it back
+            spool.flush()
+            self._mmap = mmap.mmap(spool.fileno(), size, access=mmap.ACCESS_READ)
+            self.view = memoryview(self._mmap)
+        else:
+            self.view = spool._file.getbuffer()[:size].toreadonly()
+
+    @property
+    def in_memory(self):
+        return self._mmap is None
+
+    def __len__(self):
+        return self.size
+
+    def tobytes(self):
+        """A standalone copy, for work that outlives the request"""
+        return self.view.tobytes()
+
+    def close(self):
+        """
+        Release the buffer and delete the temp file
+
+        Arrays still viewing the buffer keep it alive; in that case the
+        mapping is left for the garbage collector.
+        """
+        try:
+            self.view.release()
+            if self._mmap is not None:
+                self._mmap.close()
+            self._spool.close()
+        except BufferError:
+            pass
+
+
+def _new_spool(spool_bytes):
+    return tempfile.SpooledTemporaryFile(max_size=spool_bytes, prefix='photomint-upload-')
+
+
+def ingest_stream(stream, max_bytes, spool_bytes, declared_length=None):
+    """Copy a file-like object into an Upload, hashing as it streams"""
+    if declared_length is not None and declared_length > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    spool = _new_spool(spool_bytes)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            size += len(chunk)
+            if size > max_bytes:
+                raise UploadTooLarge(max_bytes)
+            digest.update(chunk)
+            spool.write(chunk)
+        return Upload(spool, size, digest.hexdigest())
+    except BaseException:
+        spool.close()
+        raise
+
+
+def ingest_base64(text, max_bytes, spool_bytes):
+    """
+    Decode a base64 string into an Upload in 4-aligned chunks
+
+    Strings with whitespace or other characters outside the alphabet (which
+    base64.b64decode skips) are decoded in one go instead.
+    """
+    if len(text) // 4 * 3 > max_bytes + 2:
+        raise UploadTooLarge(max_bytes)
+
+    spool = _new_spool(spool_bytes)
+    digest = hashlib.sha256()
+    size = 0
+    try:
+        try:
+            for start in range(0, len(text), BASE64_CHUNK_CHARS):
+                chunk = base64.b64decode(text[start:start + BASE64_CHUNK_CHARS], validate=True)
+                size += len(chunk)
+                digest.update(chunk)
+                spool.write(chunk)
+        except binascii.Error:
+            spool.seek(0)
+            spool.truncate()
+            chunk = base64.b64decode(text)
+            digest = hashlib.sha256(chunk)
+            size = len(chunk)
+            spool.write(chunk)
+        if size > max_bytes:
+            raise UploadTooLarge(max_bytes)
+        return Upload(spool, size, digest.hexdigest())
+    except BaseException:
+        spool.close()
+        raise
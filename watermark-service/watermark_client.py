@@ -0,0 +1,354 @@
+#!/usr/bin/env python3
+"""
+Python client for the watermark service
+
+The Python counterpart of watermark-client.js, for ingestion workers and
+scripts. Requests go over pooled keep-alive connections (one
+requests.Session per client) with the binary transport: image files are
+streamed from disk as the request body, and watermarked images come back as
+the response body with their metadata in headers. Nothing is
+base64-encoded, and nothing is read into memory whole unless you ask for
+the bytes.
+
+    from watermark_client import WatermarkClient
+
+    client = WatermarkClient('http://localhost:5001')
+    result = client.embed('photo.jpg', 123, '0x1234...', output_path='photo.wm.jpg')
+    report = client.verify('photo.wm.jpg', expected_token_id=123)
+
+    items = [{'image': path, 'token_id': i, 'creator_address': creator} for i, path in enumerate(paths)]
+    for item, result, error in client.embed_many(items, concurrency=8):
+        ...
+
+AsyncWatermarkClient offers the same calls as coroutines.
+
+Failed calls are retried with exponential backoff and jitter: connection
+errors, 429, 502, 503 and 504, honouring Retry-After. Embeds carry an
+Idempotency-Key, so a retry of an embed the service already finished
+returns the same watermarked file instead of a second watermark.
+"""
+
+import asyncio
+import json
+import os
+import random
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from urllib.parse import unquote
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = (429, 502, 503, 504)
+STREAM_CHUNK = 1024 * 1024  # bytes per read when writing a response to disk
+
+
+class WatermarkServiceError(Exception):
+    """The service answered with an error status (after any retries)"""
+
+    def __init__(self, status, message):
+        super().__init__(f'{status}: {message}')
+        self.status = status
+        self.message = message
+
+
+class WatermarkClient:
+    """Synchronous client over a pooled keep-alive session; safe to share between threads"""
+
+    def __init__(self, service_url='http://localhost:5001', timeout=120, max_connections=16, max_retries=4,
+                 backoff=0.5, max_backoff=30):
+        self.service_url = service_url.rstrip('/')
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.session = requests.Session()
+        # Retries are done here, where the request body can be reopened
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_connections, max_retries=0)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _delay(self, attempt, response=None):
+        """Seconds to wait before retry number attempt (Retry-After wins when given)"""
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff)
+        return min(self.backoff * 2 ** attempt, self.max_backoff) * random.uniform(0.5, 1.0)
+
+    def _request(self, method, path, image=None, stream=False, **kwargs):
+        """Send a request, reopening image for every attempt, and retry transient failures"""
+        for attempt in range(self.max_retries + 1):
+            body = None
+            try:
+                if image is not None:
+                    body = _open_image(image)
+                    kwargs['data'] = body
+                response = self.session.request(method, self.service_url + path, timeout=self.timeout,
+                                                stream=stream, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+                time.sleep(self._delay(attempt))
+                continue
+            finally:
+                if body is not None and body is not image:
+                    body.close()
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                response.close()
+                time.sleep(self._delay(attempt, response))
+                continue
+            if response.status_code >= 400:
+                try:
+                    message = response.json().get('error', response.text)
+                except ValueError:
+                    message = response.text
+                raise WatermarkServiceError(response.status_code, message)
+            return response
+
+    def health(self):
+        return self._request('GET', '/health').json()
+
+    def embed(self, image, token_id, creator_address, custom_data='', output_format='JPEG', quality=95,
+              preset=None, renditions=None, output_path=None, idempotency_key=None):
+        """
+        Watermark an image (a path, bytes or a binary file object)
+
+        Returns the /embed metadata. The watermarked file is streamed to
+        output_path when given, otherwise returned as result['watermarked_bytes'].
+        renditions (True or a list of names) also has the service write
+        gallery sizes; see rendition_url().
+        """
+        params = {'token_id': str(token_id), 'creator_address': creator_address, 'custom_data': custom_data,
+                  'output_format': output_format, 'quality': str(quality), 'response': 'binary'}
+        if preset:
+            params['preset'] = preset
+        if renditions:
+            params['renditions'] = 'all' if renditions is True else ','.join(renditions)
+        headers = {'Content-Type': 'application/octet-stream', 'Accept': 'image/*',
+                   'Idempotency-Key': idempotency_key or uuid.uuid4().hex}
+        response = self._request('POST', '/embed', image, stream=output_path is not None, params=params,
+                                 headers=headers)
+
+        header = response.headers.get
+        result = {
+            'success': True,
+            'payload': unquote(header('X-Watermark-Payload', '')),
+            'payload_size': int(header('X-Watermark-Payload-Size', 0)),
+            'method': header('X-Watermark-Method'),
+            'original_sha256': header('X-Original-SHA256'),
+            'watermarked_sha256': header('X-Watermarked-SHA256'),
+            'phash': header('X-Watermark-PHash'),
+            'fingerprint': {
+                'sha256': header('X-Watermarked-SHA256'),
+                'phash': header('X-Watermark-PHash'),
+                'dhash': header('X-Watermark-DHash'),
+                'ahash': header('X-Watermark-AHash'),
+                'color_histogram': header('X-Watermark-Color-Histogram')
+            },
+            'format': unquote(header('X-Watermark-Format', '')),
+            'timestamp': int(header('X-Watermark-Timestamp', 0)),
+            'replayed': header('Idempotent-Replayed') == 'true',
+            'custom_data_dropped': header('X-Watermark-Custom-Data-Dropped') == 'true',
+            'renditions': [name for name in header('X-Watermark-Renditions', '').split(',') if name]
+        }
+        if output_path is None:
+            result['watermarked_bytes'] = response.content
+        else:
+            with response, open(output_path, 'wb') as f:
+                for chunk in response.iter_content(STREAM_CHUNK):
+                    f.write(chunk)
+            result['output_path'] = output_path
+        return result
+
+    def rendition_url(self, watermarked_sha256, name):
+        """URL of a gallery rendition made by an embed with renditions"""
+        return f'{self.service_url}/renditions/{watermarked_sha256}/{name}'
+
+    def extract(self, image, expected_payload_size=None, search=False):
+        params = {'search': '1'} if search else {}
+        if expected_payload_size:
+            params['expected_payload_size'] = str(expected_payload_size)
+        return self._raw_json('/extract', image, params)
+
+    def verify(self, image, expected_sha256=None, expected_token_id=None, expected_creator=None, search=False):
+        params = {'expected_sha256': expected_sha256, 'expected_creator': expected_creator,
+                  'expected_token_id': None if expected_token_id is None else str(expected_token_id),
+                  'search': '1' if search else None}
+        return self._raw_json('/verify', image, {k: v for k, v in params.items() if v is not None})
+
+    def fingerprint(self, image):
+        return self._raw_json('/fingerprint', image, {})
+
+    def _raw_json(self, path, image, params):
+        return self._request('POST', path, image, params=params,
+                             headers={'Content-Type': 'application/octet-stream'}).json()
+
+    def submit_job(self, job_type, image, **fields):
+        """Queue an embed, extract or verify job; returns {job_id, status, ...}"""
+        params = dict({k: str(v) for k, v in fields.items()}, type=job_type)
+        return self._raw_json('/jobs', image, params)
+
+    def wait_for_job(self, job_id, interval=0.5, timeout=120):
+        """Poll a job until it finishes and return its result"""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = self._request('GET', f'/jobs/{job_id}').json()
+            if job['status'] == 'done':
+                return job['result']
+            if job['status'] == 'failed':
+                raise WatermarkServiceError(500, f"Job {job_id} failed: {job.get('error')}")
+            time.sleep(interval)
+        raise TimeoutError(f'Job {job_id} did not finish within {timeout}s')
+
+    def map(self, func, items, concurrency=8):
+        """
+        Call func(**item) for every item, at most concurrency at a time
+
+        Yields (item, result, error) in completion order, with error None on
+        success. Items are pulled from the iterable only as slots free up,
+        so it can be a generator over millions of files.
+        """
+        items = iter(items)
+        with ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='watermark-client') as pool:
+            pending = {}
+            for item in items:
+                pending[pool.submit(func, **item)] = item
+                if len(pending) >= concurrency:
+                    break
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    item = pending.pop(future)
+                    error = future.exception()
+                    yield item, None if error else future.result(), error
+                    for item in items:
+                        pending[pool.submit(func, **item)] = item
+                        break
+
+    def embed_many(self, items, concurrency=8):
+        """embed() every item (a dict of embed arguments); see map()"""
+        return self.map(self.embed, items, concurrency)
+
+    def verify_many(self, items, concurrency=8):
+        """verify() every item (a dict of verify arguments); see map()"""
+        return self.map(self.verify, items, concurrency)
+
+
+class AsyncWatermarkClient:
+    """
+    asyncio client: WatermarkClient's calls as coroutines
+
+    Each call runs the pooled synchronous client on a worker thread, with
+    at most concurrency calls in flight, so no other HTTP library is
+    needed.
+    """
+
+    def __init__(self, service_url='http://localhost:5001', concurrency=8, **kwargs):
+        self.client = WatermarkClient(service_url, max_connections=max(concurrency, 1), **kwargs)
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='watermark-async')
+        self._semaphore = None
+
+    async def _call(self, func, *args, **kwargs):
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+        async with self._semaphore:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    async def close(self):
+        self._executor.shutdown(wait=True)
+        self.client.close()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def health(self):
+        return await self._call(self.client.health)
+
+    async def embed(self, image, token_id, creator_address, **kwargs):
+        return await self._call(self.client.embed, image, token_id, creator_address, **kwargs)
+
+    async def extract(self, image, **kwargs):
+        return await self._call(self.client.extract, image, **kwargs)
+
+    async def verify(self, image, **kwargs):
+        return await self._call(self.client.verify, image, **kwargs)
+
+    async def fingerprint(self, image):
+        return await self._call(self.client.fingerprint, image)
+
+    async def map(self, func, items):
+        """Async generator of (item, result, error) in completion order; see WatermarkClient.map"""
+        items = iter(items)
+        pending = {}
+
+        def submit():
+            for item in items:
+                pending[asyncio.ensure_future(func(**item))] = item
+                return True
+            return False
+
+        while len(pending) < self.concurrency and submit():
+            pass
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                item = pending.pop(task)
+                error = task.exception()
+                yield item, None if error else task.result(), error
+                submit()
+
+    def embed_many(self, items):
+        return self.map(self.embed, items)
+
+    def verify_many(self, items):
+        return self.map(self.verify, items)
+
+
+def _open_image(image):
+    """A request body for image: an open file for paths, else image itself"""
+    if isinstance(image, (str, os.PathLike)):
+        return open(image, 'rb')
+    if hasattr(image, 'seek'):
+        image.seek(0)
+    return image
+
+
+if __name__ == '__main__':
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Call the watermark service')
+    parser.add_argument('command', choices=['health', 'embed', 'extract', 'verify', 'fingerprint'])
+    parser.add_argument('image', nargs='?')
+    parser.add_argument('--url', default=os.environ.get('WATERMARK_SERVICE_URL', 'http://localhost:5001'))
+    parser.add_argument('--token-id')
+    parser.add_argument('--creator')
+    parser.add_argument('--output', help='where embed writes the watermarked image')
+    args = parser.parse_args()
+
+    with WatermarkClient(args.url) as cli:
+        if args.command == 'health':
+            out = cli.health()
+        elif args.command == 'embed':
+            out = cli.embed(args.image, args.token_id, args.creator, output_path=args.output)
+            out.pop('watermarked_bytes', None)
+        elif args.command == 'verify':
+            out = cli.verify(args.image, expected_token_id=args.token_id, expected_creator=args.creator)
+        else:
+            out = getattr(cli, args.command)(args.image)
+        print(json.dumps(out, indent=2))
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""
+Watermark payload format
+
+Creation and parsing of the bytes embedded in every image, shared by the
+watermark service and the serverless function in api/watermark.py so both
+read and write exactly the same payloads. Standard library only (plus the
+pure-Python Reed-Solomon codec), so importing it costs next to nothing.
+"""
+
+import hashlib
+import os
+import struct
+import time
+import zlib
+from datetime import datetime
+
+from reed_solomon import ReedSolomonError, rs_decode, rs_encode
+
+MAX_PAYLOAD_SIZE = 64  # bytes, v1 text payloads
+# v1 payloads minted before they were NUL-padded were embedded at their own
+# length; "v1|<token>|<creator>|<10-digit timestamp>|<crc32>" is never shorter
+V1_MIN_PAYLOAD_SIZE = 32
+VERSION = 'v1'
+# 'v2' is the compact binary payload with Reed-Solomon parity; 'v1' the text format
+PAYLOAD_VERSION = os.environ.get('WATERMARK_PAYLOAD_VERSION', 'v2')
+V2_VERSION_BYTE = 2
+V2_PAYLOAD_STRUCT = struct.Struct('>B5s4sIH')  # version, tokenId, creator prefix, timestamp, crc16
+V2_PARITY_BYTES = 8  # corrects up to 4 damaged bytes
+V2_PAYLOAD_SIZE = V2_PAYLOAD_STRUCT.size + V2_PARITY_BYTES
+
+
+class InvalidPayloadField(ValueError):
+    """A token ID the payload format cannot carry (a client error, not a server failure)"""
+
+
+class WatermarkPayload:
+    """Handles watermark payload creation and parsing"""
+    
+    @staticmethod
+    def payload_size(version=None):
+        """Number of bytes embedded per image for a payload version"""
+        if (version or PAYLOAD_VERSION) == 'v2':
+            return V2_PAYLOAD_SIZE
+        return MAX_PAYLOAD_SIZE
+    
+    @staticmethod
+    def check_token_id(token_id, version=None):
+        """Raise InvalidPayloadField unless the payload version can embed token_id"""
+        if (version or PAYLOAD_VERSION) == 'v2':
+            if not str(token_id).isdigit():
+                raise InvalidPayloadField(f'token_id must be a non-negative integer, got {token_id!r}')
+            if int(token_id) >= 1 << 40:
+                raise InvalidPayloadField('token_id does not fit the v2 payload (40 bits)')
+        elif '|' in str(token_id):
+            raise InvalidPayloadField("token_id must not contain '|'")
+    
+    @staticmethod
+    def embeds_custom_data(version=None):
+        """Whether the payload version carries custom_data (v2 has no room for it)"""
+        return (version or PAYLOAD_VERSION) != 'v2'
+    
+    @staticmethod
+    def create_payload(token_id, creator_address, custom_data=""):
+        """Create a watermark payload in the configured format"""
+        if PAYLOAD_VERSION == 'v2':
+            return WatermarkPayload.create_payload_v2(token_id, creator_address, custom_data)
+        return WatermarkPayload.create_payload_v1(token_id, creator_address, custom_data)
+    
+    @staticmethod
+    def create_payload_v1(token_id, creator_address, custom_data=""):
+        """
+        Create watermark payload with format:
+        version|tokenId|creatorAddr|timestamp|customData|checksum
+        
+        NUL-padded to MAX_PAYLOAD_SIZE so extraction knows the length.
+        """
+        timestamp = str(int(time.time()))
+        
+        # Truncate addresses for space efficiency
+        creator_short = creator_address[:10] if creator_address.startswith('0x') else creator_address[:8]
+        
+        # Build base payload
+        base_payload = f"{VERSION}|{token_id}|{creator_short}|{timestamp}"
+        if custom_data:
+            base_payload += f"|{custom_data[:10]}"  # Limit custom data
+        
+        # Add CRC32 checksum
+        checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
+        full_payload = f"{base_payload}|{checksum:08x}"
+        
+        # Ensure payload fits in size limit
+        if len(full_payload.encode()) > MAX_PAYLOAD_SIZE:
+            # Truncate if too long
+            available_space = MAX_PAYLOAD_SIZE - len(f"{VERSION}|{token_id}|{creator_short}|{timestamp}||{checksum:08x}")
+            if available_space > 0:
+                custom_data = custom_data[:available_space]
+                base_payload = f"{VERSION}|{token_id}|{creator_short}|{timestamp}|{custom_data}"
+                checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
+                full_payload = f"{base_payload}|{checksum:08x}"
+            else:
+                # Remove custom data entirely
+                base_payload = f"{VERSION}|{token_id}|{creator_short}|{timestamp}"
+                checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
+                full_payload = f"{base_payload}|{checksum:08x}"
+        
+        return full_payload.encode().ljust(MAX_PAYLOAD_SIZE, b'\0')
+    
+    @staticmethod
+    def create_payload_v2(token_id, creator_address, custom_data=""):
+        """
+        Create a compact binary payload:
+        version(1) | tokenId(5) | creator prefix(4) | timestamp(4) | crc16(2)
+        followed by V2_PARITY_BYTES of Reed-Solomon parity.
+        
+        custom_data is not embedded in v2 (see embeds_custom_data).
+        """
+        WatermarkPayload.check_token_id(token_id, 'v2')
+        token = int(token_id)
+        
+        body = V2_PAYLOAD_STRUCT.pack(
+            V2_VERSION_BYTE,
+            token.to_bytes(5, 'big'),
+            WatermarkPayload.creator_prefix(creator_address),
+            int(time.time()),
+            0
+        )[:-2]
+        checksum = zlib.crc32(body) & 0xffff
+        return rs_encode(body + checksum.to_bytes(2, 'big'), V2_PARITY_BYTES)
+    
+    @staticmethod
+    def creator_prefix(creator_address):
+        """First 4 bytes of a 0x address (hash of anything else)"""
+        hex_part = creator_address[2:10] if creator_address.lower().startswith('0x') else ''
+        try:
+            if len(hex_part) == 8:
+                return bytes.fromhex(hex_part)
+        except ValueError:
+            pass
+        return hashlib.sha256(creator_address.encode()).digest()[:4]
+    
+    @staticmethod
+    def to_display(payload_bytes):
+        """Printable form of a payload: v1 text, or hex for binary formats"""
+        if WatermarkPayload.is_v2(payload_bytes):
+            return payload_bytes.hex()
+        return payload_bytes.rstrip(b'\0').decode('utf-8', errors='ignore')
+    
+    @staticmethod
+    def is_v2(payload_bytes):
+        return len(payload_bytes) == V2_PAYLOAD_SIZE and not payload_bytes.startswith(f"{VERSION}|".encode())
+    
+    @staticmethod
+    def parse_payload(payload_bytes):
+        """Parse and validate watermark payload (v2 binary or v1 text)"""
+        if WatermarkPayload.is_v2(payload_bytes):
+            return WatermarkPayload.parse_payload_v2(payload_bytes)
+        return WatermarkPayload.parse_payload_v1(payload_bytes)
+    
+    @staticmethod
+    def parse_payload_v2(payload_bytes):
+        """Correct bit errors with Reed-Solomon, then validate the v2 payload"""
+        try:
+            data, corrected = rs_decode(payload_bytes, V2_PARITY_BYTES)
+            version, token, creator, timestamp, checksum = V2_PAYLOAD_STRUCT.unpack(data)
+            
+            if version != V2_VERSION_BYTE or zlib.crc32(data[:-2]) & 0xffff != checksum:
+                return None
+            
+            return {
+                'version': 'v2',
+                'token_id': str(int.from_bytes(token, 'big')),
+                'creator_address': '0x' + creator.hex(),
+                'timestamp': timestamp,
+                'custom_data': '',
+                'valid': True,
+                'corrected_bytes': corrected,
+                'created_at': datetime.fromtimestamp(timestamp).isoformat()
+            }
+            
+        except (ReedSolomonError, struct.error) as e:
+            print(f"Payload parsing error: {e}")
+            return None
+    
+    @staticmethod
+    def parse_payload_v1(payload_bytes):
+        """Parse and validate a v1 text payload"""
+        try:
+            payload_str = payload_bytes.rstrip(b'\0').decode('utf-8', errors='ignore')
+            parts = payload_str.split('|')
+            
+            if len(parts) < 5:
+                return None
+            
+            version = parts[0]
+            token_id = parts[1]
+            creator_address = parts[2]
+            timestamp = parts[3]
+            
+            # Handle optional custom data
+            if len(parts) == 5:
+                custom_data = ""
+                checksum_hex = parts[4]
+            else:
+                custom_data = parts[4]
+                checksum_hex = parts[5]
+            
+            # Verify checksum
+            base_payload = f"{version}|{token_id}|{creator_address}|{timestamp}"
+            if custom_data:
+                base_payload += f"|{custom_data}"
+            
+            expected_checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
+            actual_checksum = int(checksum_hex, 16)
+            
+            if expected_checksum != actual_checksum:
+                return None
+            
+            return {
+                'version': version,
+                'token_id': token_id,
+                'creator_address': creator_address,
+                'timestamp': int(timestamp),
+                'custom_data': custom_data,
+                'valid': True,
+                'created_at': datetime.fromtimestamp(int(timestamp)).isoformat()
+            }
+            
+        except Exception as e:
+            print(f"Payload parsing error: {e}")
+            return None
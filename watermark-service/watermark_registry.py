@@ -0,0 +1,261 @@
+#!/usr/bin/env python3
+"""
+Persistent registry of embedded watermarks
+
+Every embed is recorded in SQLite (WAL mode, so server processes and
+threads read while one writes) with the full creator address, the payload
+and the hashes of the minted file. Indexes on token ID, creator prefix and
+both SHA-256s make the lookups /verify needs, "who minted this file" and
+"which full address does this truncated payload creator belong to", a few
+microseconds each, without a chain RPC.
+
+Existing mints can be bulk imported:
+
+    python watermark_registry.py import data/phash_index.jsonl minting-records/
+    python watermark_registry.py lookup --token-id 123
+"""
+
+import argparse
+import calendar
+import csv
+import json
+import os
+import sqlite3
+import threading
+import time
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeds (
+    id INTEGER PRIMARY KEY,
+    token_id TEXT NOT NULL,
+    creator_address TEXT NOT NULL,
+    creator_prefix TEXT NOT NULL,
+    payload TEXT,
+    payload_version TEXT,
+    watermarked_sha256 TEXT,
+    original_sha256 TEXT,
+    phash TEXT,
+    timestamp INTEGER NOT NULL,
+    source TEXT NOT NULL DEFAULT 'embed',
+    UNIQUE (token_id, watermarked_sha256)
+);
+CREATE INDEX IF NOT EXISTS embeds_token_id ON embeds (token_id);
+CREATE INDEX IF NOT EXISTS embeds_creator_prefix ON embeds (creator_prefix);
+CREATE INDEX IF NOT EXISTS embeds_watermarked_sha256 ON embeds (watermarked_sha256);
+CREATE INDEX IF NOT EXISTS embeds_original_sha256 ON embeds (original_sha256);
+CREATE INDEX IF NOT EXISTS embeds_phash ON embeds (phash);
+"""
+
+COLUMNS = ('token_id', 'creator_address', 'creator_prefix', 'payload', 'payload_version', 'watermarked_sha256',
+           'original_sha256', 'phash', 'timestamp', 'source')
+INSERT = (f"INSERT OR IGNORE INTO embeds ({', '.join(COLUMNS)}) "
+          f"VALUES ({', '.join('?' * len(COLUMNS))})")
+SELECT = f"SELECT {', '.join(COLUMNS)} FROM embeds"
+
+
+def normalize_hex(value):
+    """Lowercase hex without the 0x prefix, as stored"""
+    if not value:
+        return None
+    value = str(value).strip().lower()
+    return value[2:] if value.startswith('0x') else value
+
+
+class WatermarkRegistry:
+    """Thread-safe SQLite store of embedded watermarks; path None keeps it in memory"""
+
+    def __init__(self, path, prefix_fn):
+        """prefix_fn maps a creator address to the hex prefix carried in payloads"""
+        self.path = path
+        self.prefix_fn = prefix_fn
+        self._local = threading.local()
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._target, self._uri = path, False
+        else:
+            # Shared-cache memory database, kept alive by the first connection
+            self._target, self._uri = f'file:watermark-registry-{id(self)}?mode=memory&cache=shared', True
+        self._keepalive = self._connection()
+        with self._keepalive:
+            self._keepalive.executescript(SCHEMA)
+
+    def _connection(self):
+        """This thread's connection (sqlite3 connections are not shared across threads)"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self._target, uri=self._uri, timeout=5.0)
+            conn.row_factory = sqlite3.Row
+            if not self._uri:
+                conn.execute('PRAGMA journal_mode=WAL')
+                # WAL already makes commits atomic; NORMAL skips the fsync per commit
+                conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    def _row(self, record, source):
+        token_id, creator = str(record['token_id']).strip(), str(record['creator_address']).strip()
+        if not token_id or not creator:
+            raise ValueError('token_id and creator_address are required')
+        return (
+            token_id,
+            creator,
+            normalize_hex(record.get('creator_prefix')) or self.prefix_fn(creator),
+            record.get('payload') or None,
+            record.get('payload_version') or None,
+            normalize_hex(record.get('watermarked_sha256')),
+            normalize_hex(record.get('original_sha256')),
+            normalize_hex(record.get('phash')),
+            int(record.get('timestamp') or time.time()),
+            record.get('source') or source
+        )
+
+    def add(self, source='embed', **record):
+        """Record one embed: token_id, creator_address, payload, hashes, timestamp"""
+        conn = self._connection()
+        with conn:
+            conn.execute(INSERT, self._row(record, source))
+
+    def import_records(self, records, source='import', batch_size=10000):
+        """Insert many records, batch_size per transaction; returns how many were new"""
+        conn = self._connection()
+        before = conn.total_changes
+        batch = []
+        for record in records:
+            try:
+                batch.append(self._row(record, source))
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Skipping bad registry record: {e!r}")
+                continue
+            if len(batch) >= batch_size:
+                with conn:
+                    conn.executemany(INSERT, batch)
+                batch = []
+        if batch:
+            with conn:
+                conn.executemany(INSERT, batch)
+        return conn.total_changes - before
+
+    def _select(self, where, *args, limit=20):
+        rows = self._connection().execute(f"{SELECT} WHERE {where} ORDER BY timestamp DESC LIMIT ?", (*args, limit))
+        return [dict(row) for row in rows]
+
+    def by_token(self, token_id, limit=20):
+        return self._select('token_id = ?', str(token_id), limit=limit)
+
+    def by_sha256(self, sha256, limit=20):
+        """Embeds whose watermarked (minted) or original file has this digest"""
+        sha256 = normalize_hex(sha256)
+        return self._select('watermarked_sha256 = ? OR original_sha256 = ?', sha256, sha256, limit=limit)
+
+    def by_creator_prefix(self, prefix, limit=20):
+        return self._select('creator_prefix = ?', normalize_hex(prefix), limit=limit)
+
+    def by_creator(self, creator_address, limit=20):
+        return self._select('creator_prefix = ? AND lower(creator_address) = ?',
+                            self.prefix_fn(creator_address), str(creator_address).lower(), limit=limit)
+
+    def by_payload(self, token_id, creator_prefix, limit=20):
+        """Embeds matching a decoded payload: token ID plus truncated creator"""
+        return self._select('token_id = ? AND creator_prefix = ?', str(token_id), normalize_hex(creator_prefix),
+                            limit=limit)
+
+    def __len__(self):
+        return self._connection().execute('SELECT count(*) FROM embeds').fetchone()[0]
+
+    def stats(self):
+        return {'entries': len(self), 'path': self.path}
+
+
+def _from_mint_record(record):
+    """Map an enhanced-mint.js minting record to registry fields"""
+    watermark = record.get('watermarkData') or {}
+    minted_at = record.get('mintedAt')
+    timestamp = None
+    if minted_at:
+        try:
+            # mintedAt is an ISO UTC string from Date.toISOString()
+            timestamp = calendar.timegm(time.strptime(minted_at[:19], '%Y-%m-%dT%H:%M:%S'))
+        except ValueError:
+            pass
+    return {
+        'token_id': record['tokenId'],
+        'creator_address': record['creator'],
+        'payload': watermark.get('payload'),
+        'watermarked_sha256': record.get('processedSha256'),
+        'original_sha256': record.get('originalSha256'),
+        'phash': record.get('pHash'),
+        'timestamp': timestamp
+    }
+
+
+def _normalize(record):
+    """Accept pHash index entries, minting records and flat CSV/JSON rows"""
+    if 'tokenId' in record:
+        return _from_mint_record(record)
+    record = dict(record)
+    record.setdefault('watermarked_sha256', record.pop('sha256', None))
+    record.setdefault('creator_address', record.pop('creator', None))
+    if record['creator_address'] is None:
+        del record['creator_address']
+    return record
+
+
+def read_records(path):
+    """Yield records from a .jsonl/.json/.csv file, or every such file in a directory"""
+    if os.path.isdir(path):
+        for name in sorted(os.listdir(path)):
+            if name.endswith(('.json', '.jsonl', '.csv')):
+                yield from read_records(os.path.join(path, name))
+        return
+
+    with open(path, newline='') as f:
+        if path.endswith('.csv'):
+            for row in csv.DictReader(f):
+                yield _normalize(row)
+        elif path.endswith('.jsonl'):
+            for line in f:
+                if line.strip():
+                    yield _normalize(json.loads(line))
+        else:
+            data = json.load(f)
+            for record in data if isinstance(data, list) else [data]:
+                yield _normalize(record)
+
+
+def main():
+    from watermark_server import get_registry
+
+    parser = argparse.ArgumentParser(description='Watermark registry maintenance')
+    sub = parser.add_subparsers(dest='command', required=True)
+    importer = sub.add_parser('import', help='bulk import existing mints')
+    importer.add_argument('paths', nargs='+', help='.jsonl/.json/.csv files or directories of them')
+    lookup = sub.add_parser('lookup', help='query the registry')
+    lookup.add_argument('--token-id')
+    lookup.add_argument('--sha256')
+    lookup.add_argument('--creator')
+    args = parser.parse_args()
+
+    registry = get_registry()
+    if args.command == 'import':
+        started = time.time()
+        added = 0
+        for path in args.paths:
+            count = registry.import_records(read_records(path))
+            print(f"{path}: {count} new entries")
+            added += count
+        print(f"Imported {added} entries in {time.time() - started:.2f}s; registry holds {len(registry)}")
+    else:
+        if args.token_id:
+            rows = registry.by_token(args.token_id)
+        elif args.sha256:
+            rows = registry.by_sha256(args.sha256)
+        elif args.creator:
+            rows = registry.by_creator(args.creator)
+        else:
+            parser.error('give --token-id, --sha256 or --creator')
+        for row in rows:
+            print(json.dumps(row))
+
+
+if __name__ == '__main__':
+    main()
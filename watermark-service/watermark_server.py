@@ -11,146 +11,1168 @@ This service provides:
 
 import os
 import io
+import atexit
 import base64
 import hashlib
 import time
-import zlib
-from datetime import datetime
-from flask import Flask, request, jsonify, send_file
+import json
+from contextlib import ExitStack, contextmanager
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from urllib.parse import quote
+from flask import Flask, Response, g, has_request_context, request, jsonify, send_file
 from flask_cors import CORS
+from werkzeug.exceptions import RequestEntityTooLarge
 import cv2
 import numpy as np
 from PIL import Image
 from imwatermark import WatermarkEncoder, WatermarkDecoder
+from dwt_dct_engine import DwtDctEncoder, DwtDctDecoder
+from result_cache import ResultCache
+from job_queue import JobQueue, QueueFull
+from metrics import SIZE_BUCKETS, Registry, StageTimer
+from extraction_search import build_candidates, search as search_candidates
+from watermark_payload import PAYLOAD_VERSION, InvalidPayloadField, WatermarkPayload
+import watermark_verification
+from watermark_verification import normalize_sha256
+from phash_index import PerceptualHashIndex, phash64, phash_hex, parse_phash
+from fingerprint import fingerprint
+from watermark_registry import WatermarkRegistry, normalize_hex
+from upload_ingest import UploadTooLarge, ingest_base64, ingest_stream
+from shm_transport import SharedImagePool, attach, detach
+from admission import AdmissionBudget, ExceedsBudget, Overloaded, decoded_size
+from embed_store import EmbedStore, IdempotencyConflict
+from image_encoders import EncodeOptionError, available_formats, encode as encode_image, get_format, get_preset
+from renditions import RenditionCache, parse_sizes, render, requested_renditions
 
 app = Flask(__name__)
-CORS(app)
 
 # Configuration
 WATERMARK_METHOD = 'dwtDct'  # Most robust method
-MAX_PAYLOAD_SIZE = 64  # bytes
-VERSION = 'v1'
-
-class WatermarkPayload:
-    """Handles watermark payload creation and parsing"""
-    
-    @staticmethod
-    def create_payload(token_id, creator_address, custom_data=""):
-        """
-        Create watermark payload with format:
-        version|tokenId|creatorAddr|timestamp|customData|checksum
-        """
-        timestamp = str(int(time.time()))
-        
-        # Truncate addresses for space efficiency
-        creator_short = creator_address[:10] if creator_address.startswith('0x') else creator_address[:8]
-        
-        # Build base payload
-        base_payload = f"{VERSION}|{token_id}|{creator_short}|{timestamp}"
-        if custom_data:
-            base_payload += f"|{custom_data[:10]}"  # Limit custom data
-        
-        # Add CRC32 checksum
-        checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
-        full_payload = f"{base_payload}|{checksum:08x}"
-        
-        # Ensure payload fits in size limit
-        if len(full_payload.encode()) > MAX_PAYLOAD_SIZE:
-            # Truncate if too long
-            available_space = MAX_PAYLOAD_SIZE - len(f"{VERSION}|{token_id}|{creator_short}|{timestamp}||{checksum:08x}")
-            if available_space > 0:
-                custom_data = custom_data[:available_space]
-                base_payload = f"{VERSION}|{token_id}|{creator_short}|{timestamp}|{custom_data}"
-                checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
-                full_payload = f"{base_payload}|{checksum:08x}"
-            else:
-                # Remove custom data entirely
-                base_payload = f"{VERSION}|{token_id}|{creator_short}|{timestamp}"
-                checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
-                full_payload = f"{base_payload}|{checksum:08x}"
-        
-        return full_payload.encode()
-    
-    @staticmethod
-    def parse_payload(payload_bytes):
-        """Parse and validate watermark payload"""
-        try:
-            payload_str = payload_bytes.decode('utf-8', errors='ignore')
-            parts = payload_str.split('|')
-            
-            if len(parts) < 5:
-                return None
-            
-            version = parts[0]
-            token_id = parts[1]
-            creator_address = parts[2]
-            timestamp = parts[3]
-            
-            # Handle optional custom data
-            if len(parts) == 6:
-                custom_data = ""
-                checksum_hex = parts[4]
-            else:
-                custom_data = parts[4]
-                checksum_hex = parts[5]
-            
-            # Verify checksum
-            base_payload = f"{version}|{token_id}|{creator_address}|{timestamp}"
-            if custom_data:
-                base_payload += f"|{custom_data}"
-            
-            expected_checksum = zlib.crc32(base_payload.encode()) & 0xffffffff
-            actual_checksum = int(checksum_hex, 16)
-            
-            if expected_checksum != actual_checksum:
-                return None
-            
-            return {
-                'version': version,
-                'token_id': token_id,
-                'creator_address': creator_address,
-                'timestamp': int(timestamp),
-                'custom_data': custom_data,
-                'valid': True,
-                'created_at': datetime.fromtimestamp(int(timestamp)).isoformat()
-            }
-            
-        except Exception as e:
-            print(f"Payload parsing error: {e}")
-            return None
+# 'native' uses the vectorized in-service dwtDct engine (bit-compatible),
+# 'imwatermark' the reference per-block implementation
+WATERMARK_ENGINE = os.environ.get('WATERMARK_ENGINE', 'native')
+BATCH_WORKERS = int(os.environ.get('WATERMARK_BATCH_WORKERS', os.cpu_count() or 1))
+MAX_BATCH_SIZE = int(os.environ.get('WATERMARK_MAX_BATCH_SIZE', 256))
+# Run the /embed watermark encode on the batch worker pool, handing the
+# decoded image over (and the result back) through shared memory
+EMBED_OFFLOAD = os.environ.get('WATERMARK_EMBED_OFFLOAD', '0') == '1'
+SHM_POOL_MB = int(os.environ.get('WATERMARK_SHM_POOL_MB', 512))  # idle segments kept for reuse
+# Output encode preset when a request names none: fast, balanced or small (see image_encoders)
+ENCODE_PRESET = os.environ.get('WATERMARK_ENCODE_PRESET', 'fast')
+# Uploads are streamed into a spooled temp file (hashed on the way) and
+# rejected once they exceed the maximum; past the spool size they go to
+# disk and are memory-mapped for decoding
+MAX_UPLOAD_MB = int(os.environ.get('WATERMARK_MAX_UPLOAD_MB', 64))
+UPLOAD_SPOOL_MB = int(os.environ.get('WATERMARK_UPLOAD_SPOOL_MB', 4))
+MAX_UPLOAD_BYTES = MAX_UPLOAD_MB * 1024 * 1024
+# JSON and multipart bodies carry the image base64-encoded plus other fields
+MAX_REQUEST_BYTES = MAX_UPLOAD_BYTES * 4 // 3 + 1024 * 1024
+# A whole /embed/batch body; each of its images is still held to MAX_UPLOAD_MB
+MAX_BATCH_UPLOAD_MB = int(os.environ.get('WATERMARK_MAX_BATCH_UPLOAD_MB', 256))
+MAX_BATCH_REQUEST_BYTES = MAX_BATCH_UPLOAD_MB * 1024 * 1024 * 4 // 3 + 1024 * 1024
+UPLOAD_ROUTES = ('/embed', '/embed/batch', '/fingerprint', '/extract', '/verify', '/jobs')
+# Large images are embedded/extracted in DWT-aligned strips across threads;
+# the budget caps the strip temporaries in flight (0 = whole image at once)
+TILE_BUDGET_MB = int(os.environ.get('WATERMARK_TILE_BUDGET_MB', 256))
+TILE_WORKERS = int(os.environ.get('WATERMARK_TILE_WORKERS', os.cpu_count() or 1))
+PHASH_INDEX_PATH = os.environ.get(
+    'PHASH_INDEX_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'phash_index.jsonl')
+)
+PHASH_MATCH_DISTANCE = int(os.environ.get('PHASH_MATCH_DISTANCE', 10))  # bits out of 64
+# SQLite registry of every embed (full creator address, payload, hashes);
+# an empty value keeps it in memory
+REGISTRY_PATH = os.environ.get(
+    'WATERMARK_REGISTRY_PATH',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'watermark_registry.db')
+) or None
+# Admission control: per endpoint, how many requests may decode and process
+# images at once and how many bytes of decoded pixels (width x height x 3)
+# they may hold together, for the whole host. Requests that do not fit wait
+# briefly in a bounded queue, then get 503 with Retry-After.
+ADMISSION = os.environ.get('WATERMARK_ADMISSION', '1') == '1'
+ADMISSION_QUEUE = int(os.environ.get('WATERMARK_ADMISSION_QUEUE', 8))  # waiting requests per endpoint
+ADMISSION_WAIT_MS = int(os.environ.get('WATERMARK_ADMISSION_WAIT_MS', 2000))
+# Server processes sharing the limits (set by gunicorn.conf.py); each
+# enforces an equal part, since they cannot see each other's requests
+ADMISSION_PROCESSES = max(1, int(os.environ.get('WATERMARK_ADMISSION_PROCESSES', 1)))
+# Default memory limit per endpoint: an eighth of physical memory, at least 1GB
+try:
+    ADMISSION_DEFAULT_MB = max(1024, os.sysconf('SC_PHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 8 // (1024 * 1024))
+except (ValueError, OSError, AttributeError):
+    ADMISSION_DEFAULT_MB = 1024
+ADMISSION_LIMITS = {
+    endpoint: (int(os.environ.get(f'WATERMARK_{endpoint.upper()}_CONCURRENCY', max(2, os.cpu_count() or 1))),
+               int(os.environ.get(f'WATERMARK_{endpoint.upper()}_MEMORY_MB', ADMISSION_DEFAULT_MB)))
+    for endpoint in ('embed', 'extract', 'verify')
+}
+# A retried /embed (same Idempotency-Key, or same source SHA-256, token,
+# creator and output options) gets the first watermarked file back
+EMBED_IDEMPOTENCY = os.environ.get('WATERMARK_EMBED_IDEMPOTENCY', '1') == '1'
+IDEMPOTENCY_TTL = int(os.environ.get('WATERMARK_IDEMPOTENCY_TTL', 86400))  # seconds a result is replayed
+IDEMPOTENCY_MAX_MB = int(os.environ.get('WATERMARK_IDEMPOTENCY_MAX_MB', 1024))
+# Shared by all workers on the host; an empty value keeps results in memory
+IDEMPOTENCY_DIR = os.environ.get(
+    'WATERMARK_IDEMPOTENCY_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'embed_results')
+) or None
+# Gallery renditions /embed writes when asked (renditions=1 or a list of names)
+RENDITION_SIZES = parse_sizes(os.environ.get('WATERMARK_RENDITIONS', 'thumbnail:320,preview:1280,full:2560'))  # name:longest edge
+# JPEG encodes a 2560px rendition in ~25ms; WEBP halves the file but takes ~25x longer
+RENDITION_FORMAT = os.environ.get('WATERMARK_RENDITION_FORMAT', 'JPEG')
+RENDITION_QUALITY = int(os.environ.get('WATERMARK_RENDITION_QUALITY', 85))
+RENDITION_WORKERS = int(os.environ.get('WATERMARK_RENDITION_WORKERS', os.cpu_count() or 1))
+RENDITION_CACHE_MB = int(os.environ.get('WATERMARK_RENDITION_CACHE_MB', 2048))
+RENDITION_DIR = os.environ.get(
+    'WATERMARK_RENDITION_DIR',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'data', 'renditions')
+)
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 1024))  # entries
+RESULT_CACHE_TTL = int(os.environ.get('RESULT_CACHE_TTL', 3600))  # seconds, 0 = no expiry
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR')  # optional disk backing
+JOB_WORKERS = int(os.environ.get('WATERMARK_JOB_WORKERS', 2))
+JOB_QUEUE_DEPTH = int(os.environ.get('WATERMARK_JOB_QUEUE_DEPTH', 64))  # jobs waiting before 429
+JOB_RESULT_TTL = int(os.environ.get('WATERMARK_JOB_RESULT_TTL', 3600))  # seconds finished jobs are kept
+JOB_STATE_DIR = os.environ.get('WATERMARK_JOB_STATE_DIR')  # shared job status for multi-process serving
+# Finished jobs held for polling; embed results carry the whole image, so
+# the oldest are dropped before the TTL once either cap is reached
+JOB_RETAINED = int(os.environ.get('WATERMARK_JOB_RETAINED', 256))  # jobs
+JOB_RETAINED_MB = int(os.environ.get('WATERMARK_JOB_RETAINED_MB', 256))
+JOB_RETRY_AFTER = 5  # seconds suggested to clients on 429
+# Send a Server-Timing breakdown on every response; otherwise only when the
+# request asks for it with ?timing=1 or an "X-Server-Timing: 1" header
+SERVER_TIMING = os.environ.get('WATERMARK_SERVER_TIMING', '0') == '1'
+# When the payload read from the image as submitted does not parse, try
+# realigned, rescaled and alternate-method views (per request with search=1)
+EXTRACT_SEARCH = os.environ.get('WATERMARK_EXTRACT_SEARCH', '0') == '1'
+SEARCH_BUDGET_MS = int(os.environ.get('WATERMARK_SEARCH_BUDGET_MS', 2000))
+SEARCH_WORKERS = int(os.environ.get('WATERMARK_SEARCH_WORKERS', os.cpu_count() or 1))
+SEARCH_METHODS = [m for m in os.environ.get('WATERMARK_SEARCH_METHODS', 'dwtDctSvd').split(',') if m]
+SEARCH_CROP_STEP = int(os.environ.get('WATERMARK_SEARCH_CROP_STEP', 2))  # pixels; 1 tries every grid offset
 
-def image_to_cv2(image_data):
-    """Convert various image formats to OpenCV format"""
+# Binary transport: raw image bytes in, raw image bytes out, metadata in headers
+EMBED_RESPONSE_HEADERS = {
+    'payload': 'X-Watermark-Payload',
+    'payload_size': 'X-Watermark-Payload-Size',
+    'method': 'X-Watermark-Method',
+    'original_sha256': 'X-Original-SHA256',
+    'watermarked_sha256': 'X-Watermarked-SHA256',
+    'phash': 'X-Watermark-PHash',
+    'format': 'X-Watermark-Format',
+    'timestamp': 'X-Watermark-Timestamp'
+}
+# Fingerprint fields of the watermarked image (pHash is X-Watermark-PHash)
+FINGERPRINT_RESPONSE_HEADERS = {
+    'dhash': 'X-Watermark-DHash',
+    'ahash': 'X-Watermark-AHash',
+    'color_histogram': 'X-Watermark-Color-Histogram'
+}
+
+CORS(app, expose_headers=list(EMBED_RESPONSE_HEADERS.values()) + list(FINGERPRINT_RESPONSE_HEADERS.values())
+     + ['Server-Timing', 'Idempotent-Replayed', 'X-Watermark-Renditions', 'X-Watermark-Custom-Data-Dropped'])
+
+# Prometheus metrics served at /metrics (per process)
+METRICS = Registry()
+REQUEST_SECONDS = METRICS.histogram('watermark_request_duration_seconds', 'Request latency by endpoint', ['endpoint'])
+STAGE_SECONDS = METRICS.histogram('watermark_stage_duration_seconds', 'Time spent in each pipeline stage', ['endpoint', 'stage'])
+REQUEST_BYTES = METRICS.histogram('watermark_request_size_bytes', 'Request body size', ['endpoint'], SIZE_BUCKETS)
+RESPONSE_BYTES = METRICS.histogram('watermark_response_size_bytes', 'Response body size (unstreamed responses)', ['endpoint'], SIZE_BUCKETS)
+REQUESTS_TOTAL = METRICS.counter('watermark_requests_total', 'Requests by endpoint and status', ['endpoint', 'status'])
+ERRORS_TOTAL = METRICS.counter('watermark_request_errors_total', 'Requests answered with 4xx/5xx', ['endpoint', 'status'])
+IN_FLIGHT = METRICS.gauge('watermark_requests_in_flight', 'Requests being processed', ['endpoint'])
+ADMITTED_BYTES = METRICS.gauge('watermark_admitted_bytes', 'Decoded image bytes admitted and in progress', ['endpoint'])
+SHED_TOTAL = METRICS.counter('watermark_requests_shed_total', 'Requests refused by admission control', ['endpoint'])
+
+ADMISSION_BUDGETS = {
+    endpoint: AdmissionBudget(endpoint, max(1, concurrency // ADMISSION_PROCESSES),
+                              memory_mb * 1024 * 1024 // ADMISSION_PROCESSES, ADMISSION_QUEUE, ADMISSION_WAIT_MS / 1000)
+    for endpoint, (concurrency, memory_mb) in ADMISSION_LIMITS.items()
+}
+
+def metrics_endpoint():
+    """Route of the current request (e.g. /embed), 'background' outside requests"""
+    if has_request_context():
+        return request.url_rule.rule if request.url_rule else 'unmatched'
+    return 'background'
+
+@contextmanager
+def stage(name):
+    """Time one pipeline step into the stage histogram and Server-Timing"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        STAGE_SECONDS.observe(elapsed, endpoint=metrics_endpoint(), stage=name)
+        if has_request_context() and 'stage_timer' in g:
+            g.stage_timer.add(name, elapsed)
+
+@app.before_request
+def start_request_metrics():
+    g.request_started = time.perf_counter()
+    g.stage_timer = StageTimer()
+    g.metrics_endpoint = metrics_endpoint()
+    IN_FLIGHT.inc(endpoint=g.metrics_endpoint)
+    if g.metrics_endpoint in UPLOAD_ROUTES:
+        # Werkzeug refuses larger form/JSON bodies before buffering them
+        request.max_content_length = (MAX_BATCH_REQUEST_BYTES if g.metrics_endpoint == '/embed/batch'
+                                      else MAX_REQUEST_BYTES)
+    if request.content_length is not None:
+        REQUEST_BYTES.observe(request.content_length, endpoint=g.metrics_endpoint)
+
+@app.after_request
+def record_request_metrics(response):
+    elapsed = time.perf_counter() - g.request_started
+    endpoint = g.metrics_endpoint
+    REQUEST_SECONDS.observe(elapsed, endpoint=endpoint)
+    REQUESTS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+    if response.status_code >= 400:
+        ERRORS_TOTAL.inc(endpoint=endpoint, status=response.status_code)
+    if not response.is_streamed and response.content_length is not None:
+        RESPONSE_BYTES.observe(response.content_length, endpoint=endpoint)
+    
+    if SERVER_TIMING or request.args.get('timing') == '1' or request.headers.get('X-Server-Timing') == '1':
+        response.headers['Server-Timing'] = g.stage_timer.server_timing(elapsed)
+    g.metrics_recorded = True
+    return response
+
+@app.teardown_request
+def finish_request_metrics(error=None):
+    for upload in g.pop('uploads', ()):
+        upload.close()
+    if 'metrics_endpoint' in g:
+        IN_FLIGHT.dec(endpoint=g.metrics_endpoint)
+        if error is not None and 'metrics_recorded' not in g:
+            # Exception propagated past Flask: after_request did not run
+            REQUESTS_TOTAL.inc(endpoint=g.metrics_endpoint, status=500)
+            ERRORS_TOTAL.inc(endpoint=g.metrics_endpoint, status=500)
+
+def read_image_bytes(image_data):
+    """Get the encoded image bytes from base64, a file-like object or bytes"""
     if isinstance(image_data, str):
         # Base64 encoded image
-        image_bytes = base64.b64decode(image_data)
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return base64.b64decode(image_data)
     elif hasattr(image_data, 'read'):
         # File-like object
-        image_bytes = image_data.read()
-        nparr = np.frombuffer(image_bytes, np.uint8)
-        return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
+        return image_data.read()
     else:
         # Assume it's already bytes
-        nparr = np.frombuffer(image_data, np.uint8)
+        return image_data
+
+def track_upload(upload):
+    """
+    Bytes-like view of an Upload, released when the request ends
+    
+    Outside a request (batch workers) the bytes are copied out instead.
+    """
+    if not has_request_context():
+        try:
+            return upload.tobytes()
+        finally:
+            upload.close()
+    g.setdefault('uploads', []).append(upload)
+    return upload.view
+
+def read_stream_hashed(stream):
+    """
+    Stream an upload into a spooled buffer, feeding each chunk to SHA-256
+    
+    Raises UploadTooLarge past WATERMARK_MAX_UPLOAD_MB, from the declared
+    Content-Length of a raw body before anything is read.
+    """
+    declared = None
+    if has_request_context() and stream is request.stream:
+        declared = request.content_length
+    with stage('read_sha256'):
+        upload = ingest_stream(stream, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_MB * 1024 * 1024, declared)
+    return track_upload(upload), upload.sha256
+
+def upload_size(image_data):
+    """Encoded size of an upload without reading it: a file part, base64 or bytes"""
+    if hasattr(image_data, 'seek'):
+        # Multipart parts are already spooled by Werkzeug; measure, then rewind
+        size = image_data.seek(0, os.SEEK_END)
+        image_data.seek(0)
+        return size
+    if isinstance(image_data, str):
+        return len(image_data) // 4 * 3
+    return len(image_data)
+
+def read_image_hashed(image_data):
+    """
+    Get the encoded image bytes and their SHA-256 hex digest
+    
+    The digest is of the file exactly as uploaded, so it matches
+    sha256Hex() in scripts/utils.ts (minus the 0x prefix) and the hash
+    recorded on-chain.
+    """
+    if hasattr(image_data, 'read'):
+        return read_stream_hashed(image_data)
+    if isinstance(image_data, str):
+        with stage('base64_decode'):
+            upload = ingest_base64(image_data, MAX_UPLOAD_BYTES, UPLOAD_SPOOL_MB * 1024 * 1024)
+        return track_upload(upload), upload.sha256
+    with stage('read'):
+        image_bytes = read_image_bytes(image_data)
+    with stage('sha256'):
+        return image_bytes, hashlib.sha256(image_bytes).hexdigest()
+
+def read_json_body():
+    """Parse the JSON body without keeping the raw bytes cached on the request"""
+    with stage('json_parse'):
+        return request.get_json(cache=False)
+
+def upload_too_large_response():
+    return jsonify({'error': f'Upload too large (max {MAX_UPLOAD_MB}MB)'}), 413
+
+class InvalidImage(ValueError):
+    """Uploaded bytes that OpenCV cannot decode"""
+
+@contextmanager
+def admitted(endpoint, image_bytes):
+    """
+    Hold the endpoint's admission budget while image_bytes is decoded and processed
+    
+    Raises Overloaded or ExceedsBudget. Only requests are admitted: jobs and
+    batch items are already bounded by their queue and worker pool.
+    """
+    if not ADMISSION or not has_request_context():
+        yield
+        return
+    with ExitStack() as admission:
+        with stage('admission'):
+            cost = decoded_size(image_bytes) or len(image_bytes)
+            admission.enter_context(ADMISSION_BUDGETS[endpoint].admit(cost))
+        ADMITTED_BYTES.inc(cost, endpoint=endpoint)
+        try:
+            yield
+        finally:
+            ADMITTED_BYTES.dec(cost, endpoint=endpoint)
+
+def overloaded_response(e):
+    """503 with Retry-After for a request refused by admission control"""
+    SHED_TOTAL.inc(endpoint=e.endpoint)
+    response = jsonify({'error': str(e)})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+def image_to_cv2(image_data):
+    """Convert various image formats to OpenCV format"""
+    nparr = np.frombuffer(read_image_bytes(image_data), np.uint8)
+    with stage('imdecode'):
         return cv2.imdecode(nparr, cv2.IMREAD_COLOR)
 
-def cv2_to_bytes(cv2_image, format='JPEG', quality=95):
-    """Convert OpenCV image to bytes"""
-    if format.upper() == 'JPEG':
-        encode_param = [int(cv2.IMWRITE_JPEG_QUALITY), quality]
-        success, encoded_img = cv2.imencode('.jpg', cv2_image, encode_param)
-    elif format.upper() == 'PNG':
-        encode_param = [int(cv2.IMWRITE_PNG_COMPRESSION), 1]
-        success, encoded_img = cv2.imencode('.png', cv2_image, encode_param)
+def make_encoder(payload, method=WATERMARK_METHOD):
+    """Create a watermark encoder for the configured engine"""
+    if WATERMARK_ENGINE == 'native' and method == 'dwtDct':
+        encoder = DwtDctEncoder(tile_budget=TILE_BUDGET_MB * 1024 * 1024, workers=TILE_WORKERS)
     else:
-        success, encoded_img = cv2.imencode('.jpg', cv2_image)
+        encoder = WatermarkEncoder()
+    encoder.set_watermark('bytes', payload)
+    return encoder
+
+def make_decoder(size, method=WATERMARK_METHOD, workers=None):
+    """Create a watermark decoder for the configured engine reading size payload bytes"""
+    length = int(size) * 8  # decoders count bits
+    if WATERMARK_ENGINE == 'native' and method == 'dwtDct':
+        return DwtDctDecoder('bytes', length, tile_budget=TILE_BUDGET_MB * 1024 * 1024,
+                             workers=workers or TILE_WORKERS)
+    return WatermarkDecoder('bytes', length)
+
+def cv2_to_bytes(cv2_image, format='JPEG', quality=95, preset=None):
+    """
+    Encode an OpenCV image (JPEG, PNG, WEBP or AVIF) as a bytes-like array
+    
+    The codec's own uint8 array is returned: hashlib, base64 and file writes
+    take it as a buffer, so only a WSGI response body needs bytes(...) of it.
+    """
+    return encode_image(cv2_image, format, quality, get_preset(preset, ENCODE_PRESET))
+
+def check_encode_options(output_format, preset):
+    """Reject an unwritable format or unknown preset before any work is done"""
+    get_format(output_format)
+    get_preset(preset, ENCODE_PRESET)
+
+def embed_payload(cv2_image, original_sha256, token_id, creator_address, custom_data='', output_format='JPEG', quality=95,
+                  preset=None, renditions=()):
+    """
+    Embed a watermark payload into a decoded image
+    
+    original_sha256 is the digest of the uploaded file (see read_image_hashed).
+    Returns (watermarked_bytes, result) where result holds the /embed
+    response fields except the image itself, which is the encoder's array
+    (see cv2_to_bytes). The named renditions are made
+    from the watermarked pixels while the master is encoded.
+    """
+    # Create watermark payload
+    with stage('payload'):
+        payload = WatermarkPayload.create_payload(token_id, creator_address, custom_data)
+    
+    print(f"Embedding watermark: {WatermarkPayload.to_display(payload)}")
     
-    if success:
-        return encoded_img.tobytes()
+    # Embed watermark
+    with encoded_watermark(cv2_image, payload) as watermarked_bgr:
+        pending = start_renditions(watermarked_bgr, renditions)
+        try:
+            # Convert back to bytes
+            with stage('imencode'):
+                watermarked_bytes = cv2_to_bytes(watermarked_bgr, output_format, quality, preset)
+            
+            # Calculate hashes for verification
+            with stage('sha256'):
+                watermarked_sha256 = hashlib.sha256(watermarked_bytes).hexdigest()
+            # Hashes of the minted image, so the minting client need not decode it again
+            with stage('fingerprint'):
+                hashes = fingerprint(watermarked_bgr, watermarked_sha256)
+        finally:
+            # Offloaded pixels are only valid inside this block
+            made = finish_renditions(pending)
+    
+    result = {
+        'success': True,
+        'payload': WatermarkPayload.to_display(payload),
+        'payload_version': PAYLOAD_VERSION,
+        'payload_size': len(payload),
+        'method': WATERMARK_METHOD,
+        'original_sha256': original_sha256,
+        'watermarked_sha256': watermarked_sha256,
+        'phash': hashes['phash'],
+        'fingerprint': hashes,
+        'format': get_format(output_format).name,
+        'preset': get_preset(preset, ENCODE_PRESET),
+        # v2 payloads have no room for custom_data; say so rather than drop it silently
+        'custom_data_dropped': bool(custom_data) and not WatermarkPayload.embeds_custom_data(),
+        'timestamp': int(time.time())
+    }
+    if renditions:
+        result['renditions'] = store_renditions(watermarked_sha256, made)
+    return watermarked_bytes, result
+
+# Renditions are scaled and encoded on a thread pool (OpenCV releases the
+# GIL) while the request thread encodes the master
+_rendition_pool = None
+
+def get_rendition_pool():
+    """Lazily create the rendition thread pool"""
+    global _rendition_pool
+    if _rendition_pool is None:
+        _rendition_pool = ThreadPoolExecutor(max_workers=RENDITION_WORKERS, thread_name_prefix='renditions')
+    return _rendition_pool
+
+_rendition_cache = None
+
+def get_rendition_cache():
+    """Lazily open the content-addressed rendition cache"""
+    global _rendition_cache
+    if _rendition_cache is None:
+        _rendition_cache = RenditionCache(RENDITION_DIR, RENDITION_CACHE_MB * 1024 * 1024)
+    return _rendition_cache
+
+def start_renditions(watermarked_bgr, names):
+    """Submit one scale-and-encode task per rendition name; returns {name: future}"""
+    if not names:
+        return {}
+    pool = get_rendition_pool()
+    cache = get_rendition_cache()
+    preset = get_preset(None, ENCODE_PRESET)
+    return {name: pool.submit(render, watermarked_bgr, RENDITION_SIZES[name], cache, RENDITION_FORMAT,
+                              RENDITION_QUALITY, preset)
+            for name in names}
+
+def finish_renditions(pending):
+    """Wait for every rendition task; a failed rendition is logged and left out"""
+    made = {}
+    with stage('renditions'):
+        for name, future in pending.items():
+            try:
+                made[name] = future.result()
+            except Exception as e:
+                print(f"Rendition {name} failed: {e}")
+    return made
+
+def store_renditions(watermarked_sha256, made):
+    """Write the master's rendition manifest and return it with each rendition's URL"""
+    try:
+        get_rendition_cache().put_manifest(watermarked_sha256, made)
+    except OSError as e:
+        print(f"Rendition manifest write failed: {e}")
+    return {name: dict(entry, url=f'/renditions/{watermarked_sha256}/{name}') for name, entry in made.items()}
+
+# Every embedded image is recorded in the pHash index so /verify can find
+# the minted token even when the watermark did not survive.
+_phash_index = None
+
+def get_phash_index():
+    """Lazily load the persistent pHash index"""
+    global _phash_index
+    if _phash_index is None:
+        _phash_index = PerceptualHashIndex(PHASH_INDEX_PATH)
+    return _phash_index
+
+# Every embed is also recorded with its full creator address, so /verify
+# can say who minted a file without a chain lookup
+_registry = None
+
+def get_registry():
+    """Lazily open the watermark registry (one connection per thread)"""
+    global _registry
+    if _registry is None:
+        _registry = WatermarkRegistry(REGISTRY_PATH, lambda address: WatermarkPayload.creator_prefix(address).hex())
+    return _registry
+
+def record_embed(result, token_id, creator_address):
+    """Add a successful embed result to the registry and the pHash index"""
+    try:
+        with stage('registry'):
+            get_registry().add(
+                token_id=str(token_id),
+                creator_address=creator_address,
+                payload=result['payload'],
+                payload_version=result.get('payload_version'),
+                watermarked_sha256=result['watermarked_sha256'],
+                original_sha256=result['original_sha256'],
+                phash=result['phash'],
+                timestamp=result['timestamp']
+            )
+    except Exception as e:
+        print(f"Registry update failed: {e}")
+    
+    try:
+        with stage('phash_index'):
+            get_phash_index().add(
+                parse_phash(result['phash']),
+                token_id=str(token_id),
+                creator_address=creator_address,
+                payload=result['payload'],
+                original_sha256=result['original_sha256'],
+                watermarked_sha256=result['watermarked_sha256'],
+                timestamp=result['timestamp']
+            )
+    except Exception as e:
+        print(f"pHash index update failed: {e}")
+
+# /extract and /verify results keyed by the SHA-256 of the uploaded bytes
+_result_cache = None
+
+def get_result_cache():
+    """Lazily create the content-addressed result cache"""
+    global _result_cache
+    if _result_cache is None:
+        _result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL, RESULT_CACHE_DIR)
+    return _result_cache
+
+# First /embed results by idempotency key, replayed to retries
+_embed_store = None
+
+def get_embed_store():
+    """Lazily create the idempotent embed store"""
+    global _embed_store
+    if _embed_store is None:
+        _embed_store = EmbedStore(IDEMPOTENCY_MAX_MB * 1024 * 1024, IDEMPOTENCY_TTL, IDEMPOTENCY_DIR)
+    return _embed_store
+
+def request_idempotency_key(params):
+    """Client idempotency key: the Idempotency-Key header or an idempotency_key field"""
+    if has_request_context() and request.headers.get('Idempotency-Key'):
+        return request.headers['Idempotency-Key']
+    return params.get('idempotency_key')
+
+def embed_once(image_bytes, original_sha256, token_id, creator_address, custom_data='', output_format='JPEG',
+               quality=95, preset=None, idempotency_key=None, renditions=()):
+    """
+    Decode, embed and record an upload, unless this embed was already done
+    
+    Without an idempotency key, the key is derived from the source SHA-256,
+    token, creator and output options. Returns (watermarked_bytes, result);
+    a replay returns the stored file and response, and result['idempotency']
+    says which it was. Raises IdempotencyConflict for a client key reused
+    on a different request.
+    """
+    def embed():
+        with admitted('embed', image_bytes):
+            cv2_image = image_to_cv2(image_bytes)
+            if cv2_image is None:
+                raise InvalidImage('Invalid image format')
+            return embed_payload(cv2_image, original_sha256, token_id, creator_address, custom_data, output_format,
+                                 quality, preset, renditions)
+    
+    if not EMBED_IDEMPOTENCY:
+        watermarked_bytes, result = embed()
+        record_embed(result, token_id, creator_address)
+        return watermarked_bytes, result
+    
+    fingerprint = EmbedStore.request_fingerprint(original_sha256, token_id, str(creator_address).lower(), custom_data,
+                                                 get_format(output_format).name, int(quality),
+                                                 get_preset(preset, ENCODE_PRESET),
+                                                 *([','.join(renditions)] if renditions else []))
+    key = f'client:{idempotency_key}' if idempotency_key else f'derived:{fingerprint}'
+    watermarked_bytes, result, replayed = get_embed_store().run_once(key, fingerprint, embed)
+    if not replayed:
+        record_embed(result, token_id, creator_address)
+    result['idempotency'] = {'key': idempotency_key or fingerprint, 'replayed': replayed}
+    return watermarked_bytes, result
+
+def cached_extract(image_bytes, image_sha256, expected_size, search=False):
+    """
+    /extract result for uploaded bytes, from the result cache when possible
+    
+    Returns None when the bytes are not a decodable image.
+    """
+    # Repeat extractions of the same bytes are served without decoding
+    cache = get_result_cache()
+    cache_key = ResultCache.make_key('extract', image_sha256, WATERMARK_METHOD, expected_size, search)
+    with stage('cache_lookup'):
+        cached = cache.get(cache_key)
+    if cached is not None:
+        return dict(cached, cached=True)
+    
+    with admitted('extract', image_bytes):
+        cv2_image = image_to_cv2(image_bytes)
+        if cv2_image is None:
+            return None
+        
+        response_data = extract_cv2_image(cv2_image, expected_size, search)
+    with stage('cache_store'):
+        cache.put(cache_key, response_data)
+    return response_data
+
+def cached_verify(image_bytes, image_sha256, expected_sha256=None, expected_token_id=None, expected_creator=None,
+                  search=False):
+    """
+    /verify result for uploaded bytes, from the result cache when possible
+    
+    Only the pixel evidence (see image_evidence) is cached; the registry
+    and pHash index are consulted on every call, so an image minted after
+    its first verification is reported as minted. Returns None when the
+    bytes are not a decodable image.
+    """
+    verification_results = verify_hashes(image_sha256, expected_sha256)
+    if verification_results['overall_result'] == 'verified':
+        return verification_results
+    
+    # Repeat verifications of the same bytes are served without decoding
+    cache = get_result_cache()
+    cache_key = ResultCache.make_key('verify_evidence', image_sha256, WATERMARK_METHOD, search)
+    with stage('cache_lookup'):
+        evidence = cache.get(cache_key)
+    cached = evidence is not None
+    
+    if not cached:
+        with admitted('verify', image_bytes):
+            cv2_image = image_to_cv2(image_bytes)
+            if cv2_image is None:
+                return None
+            
+            evidence = image_evidence(cv2_image, search)
+        with stage('cache_store'):
+            cache.put(cache_key, evidence)
+    
+    verification_results = verify_evidence(verification_results, evidence, expected_token_id, expected_creator)
+    if cached:
+        verification_results['cached'] = True
+    return verification_results
+
+def warmup():
+    """
+    Run one embed/extract round trip on a synthetic image
+    
+    Called before the production server forks its workers, so codec tables,
+    OpenCV's lazy initialization and the pHash index load are paid once in
+    the parent instead of by the first request of every worker. Starts no
+    threads or processes, which would not survive the fork.
+    """
+    started = time.time()
+    rng = np.random.default_rng(0)
+    image = cv2.GaussianBlur(rng.integers(0, 256, (512, 512, 3), dtype=np.uint8), (5, 5), 0)
+    
+    payload = WatermarkPayload.create_payload(0, '0x0000000000000000000000000000000000000000')
+    watermarked = make_encoder(payload).encode(image, WATERMARK_METHOD)
+    for output_format in ('JPEG', 'PNG'):
+        decoded = image_to_cv2(cv2_to_bytes(watermarked, output_format))
+    make_decoder(len(payload)).decode(decoded, WATERMARK_METHOD)
+    WatermarkPayload.parse_payload(payload)
+    fingerprint(decoded, None)
+    get_phash_index()
+    
+    print(f"🔥 Engine warmed up in {time.time() - started:.2f}s")
+
+# Asynchronous jobs: POST /jobs queues the work, GET /jobs/<id> polls it
+_job_queue = None
+
+def get_job_queue():
+    """Lazily start the job queue and its worker threads"""
+    global _job_queue
+    if _job_queue is None:
+        _job_queue = JobQueue(JOB_WORKERS, JOB_QUEUE_DEPTH, JOB_RESULT_TTL, JOB_STATE_DIR, JOB_RETAINED,
+                              JOB_RETAINED_MB * 1024 * 1024)
+    return _job_queue
+
+def embed_job(image_bytes, original_sha256, token_id, creator_address, custom_data='', output_format='JPEG', quality=95,
+              preset=None, idempotency_key=None, renditions=()):
+    """Run an /embed request inside a job worker, returning the JSON result"""
+    watermarked_bytes, result = embed_once(image_bytes, original_sha256, token_id, creator_address, custom_data,
+                                           output_format, quality, preset, idempotency_key, renditions)
+    with stage('base64_encode'):
+        result['watermarked_image'] = base64.b64encode(watermarked_bytes).decode('utf-8')
+    return result
+
+def extract_job(image_bytes, image_sha256, expected_size, search=False):
+    """Run an /extract request inside a job worker"""
+    result = cached_extract(image_bytes, image_sha256, expected_size, search)
+    if result is None:
+        raise ValueError('Invalid image format')
+    return result
+
+def verify_job(image_bytes, image_sha256, expected_sha256=None, expected_token_id=None, expected_creator=None,
+               search=False):
+    """Run a /verify request inside a job worker"""
+    result = cached_verify(image_bytes, image_sha256, expected_sha256, expected_token_id, expected_creator, search)
+    if result is None:
+        raise ValueError('Invalid image format')
+    return result
+
+# Batch embedding runs in a pool of worker processes so the DWT-DCT work
+# of a whole collection is spread across every core instead of the
+# single Flask request thread.
+_batch_pool = None
+
+def _init_batch_worker():
+    """Keep each worker on one thread so N workers use N cores"""
+    global TILE_WORKERS, EMBED_OFFLOAD, _shm_pool
+    cv2.setNumThreads(1)
+    TILE_WORKERS = 1
+    # Workers are the offload target; they encode in place
+    EMBED_OFFLOAD = False
+    # Forked after segments existed (a rebuilt pool): let go of the parent's
+    # mappings, or an unlinked segment stays resident in every worker
+    if _shm_pool is not None:
+        _shm_pool.unmap_inherited()
+        _shm_pool = None
+
+def get_batch_pool():
+    """Lazily create the shared batch worker pool"""
+    global _batch_pool
+    if _batch_pool is None:
+        _batch_pool = ProcessPoolExecutor(max_workers=BATCH_WORKERS, initializer=_init_batch_worker)
+        # Fork the workers now, not on the first offload, when that request's
+        # shared-memory segments would be inherited
+        _batch_pool.submit(os.getpid).result()
+    return _batch_pool
+
+# Offloaded encodes exchange images through pooled shared-memory segments
+# owned by this process (see shm_transport)
+_shm_pool = None
+
+def get_shm_pool():
+    """Lazily create the shared-memory segment pool, unlinked at exit"""
+    global _shm_pool
+    if _shm_pool is None:
+        _shm_pool = SharedImagePool(SHM_POOL_MB * 1024 * 1024)
+        atexit.register(_shm_pool.close)
+    return _shm_pool
+
+def encode_shared(image_handle, output_handle, payload, method=WATERMARK_METHOD):
+    """Watermark the image behind image_handle into output_handle (runs in a pool worker)"""
+    try:
+        watermarked = make_encoder(payload, method).encode(attach(image_handle), method)
+        np.copyto(attach(output_handle), watermarked)
+    finally:
+        # Keep no mapping past the task: the pool may unlink the segment
+        detach()
+
+@contextmanager
+def encoded_watermark(cv2_image, payload):
+    """
+    The watermarked image, encoded here or on the worker pool (EMBED_OFFLOAD)
+    
+    Offloaded results are views of a shared-memory slot, valid only inside
+    the with block.
+    """
+    global _batch_pool
+    if not EMBED_OFFLOAD:
+        with stage('watermark_encode'):
+            watermarked = make_encoder(payload).encode(cv2_image, WATERMARK_METHOD)
+        yield watermarked
+        return
+    
+    shm = get_shm_pool()
+    with stage('shm_put'):
+        image_slot = shm.put(cv2_image)
+    output_slot = shm.lease(cv2_image.shape, cv2_image.dtype)
+    try:
+        with stage('watermark_encode'):
+            try:
+                get_batch_pool().submit(encode_shared, image_slot.handle, output_slot.handle, payload).result()
+            except BrokenProcessPool:
+                # A worker died; rebuild the pool for the next request
+                _batch_pool = None
+                raise
+        yield output_slot.array
+    finally:
+        shm.release(image_slot)
+        shm.release(output_slot)
+
+def embed_batch_item(index, image_bytes, token_id, creator_address, custom_data='', output_format='JPEG', quality=95,
+                     preset=None):
+    """Embed one batch item inside a worker process, never raising"""
+    try:
+        if not token_id or not creator_address:
+            return {'index': index, 'success': False, 'error': 'token_id and creator_address are required'}
+        WatermarkPayload.check_token_id(token_id)
+        
+        image_bytes, original_sha256 = read_image_hashed(image_bytes)
+        cv2_image = image_to_cv2(image_bytes)
+        if cv2_image is None:
+            return {'index': index, 'success': False, 'error': 'Invalid image format'}
+        
+        watermarked_bytes, result = embed_payload(cv2_image, original_sha256, token_id, creator_address, custom_data, output_format, quality,
+                                                  preset)
+        with stage('base64_encode'):
+            result['watermarked_image'] = base64.b64encode(watermarked_bytes).decode('utf-8')
+        result['index'] = index
+        result['token_id'] = str(token_id)
+        return result
+        
+    except InvalidPayloadField as e:
+        return {'index': index, 'success': False, 'token_id': str(token_id), 'error': str(e)}
+    except Exception as e:
+        return {'index': index, 'success': False, 'token_id': str(token_id), 'error': f'Watermark embedding failed: {str(e)}'}
+
+def is_raw_image_request():
+    """True when the request body is the image itself rather than JSON or multipart"""
+    return request.mimetype.startswith('image/') or request.mimetype == 'application/octet-stream'
+
+def wants_binary_response():
+    """True when the client asked for the image bytes instead of base64-in-JSON"""
+    if request.values.get('response') == 'binary':
+        return True
+    accept = request.accept_mimetypes
+    return max(accept[get_format(name).mimetype] for name in available_formats()) > accept['application/json']
+
+def binary_embed_response(watermarked_bytes, result):
+    """Send the watermarked image as the body with its metadata in headers"""
+    # WSGI servers only send bytes; a replayed embed already is bytes, so this copies at most once
+    response = Response(bytes(watermarked_bytes), mimetype=get_format(result['format']).mimetype)
+    for field, header in EMBED_RESPONSE_HEADERS.items():
+        # Header values must be latin-1; custom data in the payload may not be
+        response.headers[header] = quote(str(result[field]), safe="|:/@!$&'()*+,;=")
+    for field, header in FINGERPRINT_RESPONSE_HEADERS.items():
+        response.headers[header] = result['fingerprint'][field]
+    if 'idempotency' in result:
+        response.headers['Idempotent-Replayed'] = 'true' if result['idempotency']['replayed'] else 'false'
+    if result.get('custom_data_dropped'):
+        response.headers['X-Watermark-Custom-Data-Dropped'] = 'true'
+    if result.get('renditions'):
+        # Served at /renditions/<X-Watermarked-SHA256>/<name>
+        response.headers['X-Watermark-Renditions'] = ','.join(result['renditions'])
+    return response
+
+# Candidate views of a failed extraction are decoded on a shared thread pool
+_search_pool = None
+
+def get_search_pool():
+    """Lazily create the extraction search thread pool"""
+    global _search_pool
+    if _search_pool is None:
+        _search_pool = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix='extract-search')
+    return _search_pool
+
+def search_requested(params):
+    """Whether a request asked for the multi-strategy extraction search"""
+    value = params.get('search')
+    if value is None:
+        return EXTRACT_SEARCH
+    return str(value).lower() in ('1', 'true', 'yes')
+
+def search_extract_payload(cv2_image, sizes):
+    """
+    Try crops, rescales and alternate methods until a payload parses
+    
+    Each candidate view is decoded at every payload size in sizes, so one
+    SEARCH_BUDGET_MS covers the whole search whatever the number of sizes.
+    Returns ((payload, parsed, method) or None, search summary).
+    """
+    def attempt(view, method, cancelled):
+        # Candidates already run in parallel, so each decode stays on one thread
+        payload, parsed = read_payload(view, payload_sizes(method=method, sizes=sizes), method, 1, cancelled)
+        return (payload, parsed, method) if parsed else None
+    
+    candidates = build_candidates(cv2_image.shape, WATERMARK_METHOD, SEARCH_METHODS, SEARCH_CROP_STEP)
+    started = time.perf_counter()
+    with stage('extract_search'):
+        candidate, found, attempts = search_candidates(cv2_image, candidates, attempt, get_search_pool(),
+                                                       SEARCH_BUDGET_MS / 1000)
+    
+    return found, {
+        'strategy': candidate.name if candidate else None,
+        'method': candidate.method if candidate else None,
+        'attempts': attempts,
+        'candidates': len(candidates),
+        'elapsed_ms': round((time.perf_counter() - started) * 1000, 1),
+        'budget_ms': SEARCH_BUDGET_MS
+    }
+
+def payload_sizes(expected_size=None, method=WATERMARK_METHOD, sizes=None):
+    """Payload sizes to decode with method (see watermark_verification.payload_sizes)"""
+    # The native engine reads every size from one pass; imwatermark decodes per size
+    return watermark_verification.payload_sizes(expected_size, WATERMARK_ENGINE == 'native' and method == 'dwtDct',
+                                                sizes)
+
+def read_payload(cv2_image, sizes, method=WATERMARK_METHOD, workers=None, cancelled=None):
+    """(payload, parsed) from the first size that parses (see watermark_verification.read_payload)"""
+    return watermark_verification.read_payload(cv2_image, sizes, lambda size: make_decoder(size, method, workers),
+                                               method, cancelled, stage)
+
+def decode_watermark(cv2_image, expected_size=None, search=False):
+    """
+    Decode and parse the payload of a decoded image at each payload size
+    
+    Returns (payload, parsed, method, search summary). parsed is None when
+    no size parsed; payload is then the raw decode at the first size. With
+    search, the multi-strategy search (see search_extract_payload) runs once,
+    trying every size, after plain decodes have failed at all of them.
+    """
+    sizes = payload_sizes(expected_size)
+    first_payload, parsed = read_payload(cv2_image, sizes)
+    if parsed:
+        return first_payload, parsed, WATERMARK_METHOD, None
+    
+    search_summary = None
+    if search:
+        found, search_summary = search_extract_payload(cv2_image, sizes)
+        if found:
+            payload, parsed, method = found
+            return payload, parsed, method, search_summary
+    return first_payload, None, WATERMARK_METHOD, search_summary
+
+def extract_cv2_image(cv2_image, expected_size=None, search=False):
+    """
+    Extract and parse the watermark payload of a decoded image
+    
+    Without expected_size, every payload version is tried (see
+    payload_sizes). With search, a payload that fails to parse triggers the
+    multi-strategy search (see search_extract_payload).
+    """
+    try:
+        extracted_payload, parsed, method, search_summary = decode_watermark(cv2_image, expected_size, search)
+        
+        if parsed:
+            response_data = {
+                'success': True,
+                'watermark_found': True,
+                'payload': WatermarkPayload.to_display(extracted_payload),
+                'parsed': parsed,
+                'method': method,
+                'extraction_timestamp': int(time.time())
+            }
+        else:
+            response_data = {
+                'success': True,
+                'watermark_found': True,
+                'payload': WatermarkPayload.to_display(extracted_payload),
+                'parsed': None,
+                'error': 'Invalid payload format or checksum mismatch',
+                'method': WATERMARK_METHOD,
+                'extraction_timestamp': int(time.time())
+            }
+        
+        if search_summary:
+            response_data['search'] = search_summary
+        return response_data
+        
+    except Exception as decode_error:
+        print(f"Watermark extraction failed: {decode_error}")
+        return {
+            'success': True,
+            'watermark_found': False,
+            'error': f'No watermark detected: {str(decode_error)}',
+            'method': WATERMARK_METHOD,
+            'extraction_timestamp': int(time.time())
+        }
+
+def minted_by(entry, matched_by):
+    """Public summary of a registry entry for /verify"""
+    return {
+        'token_id': entry['token_id'],
+        'creator_address': entry['creator_address'],
+        'timestamp': entry['timestamp'],
+        'matched_by': matched_by
+    }
+
+def verify_hashes(current_sha256, expected_sha256=None):
+    """
+    Start a verification with the SHA-256 level (see verify_cv2_image)
+    
+    Needs no pixels: when the digest settles it, overall_result is already
+    'verified' and the image does not have to be decoded.
+    """
+    verification_results = watermark_verification.new_verification(current_sha256, int(time.time()))
+    
+    # Level 1: Exact SHA-256 match
+    if expected_sha256:
+        level = watermark_verification.exact_hash_level(current_sha256, expected_sha256)
+        verification_results['verification_levels']['exact_hash'] = level
+        if level['match']:
+            verification_results['overall_result'] = 'verified'
+            verification_results['confidence'] = 100
     else:
-        raise Exception("Failed to encode image")
+        # No expectation given: the file itself may be a recorded mint.
+        # Only the minted file verifies by hash: anyone can embed a copy of
+        # someone else's original, so an original-hash match is reported
+        # but verification carries on through the other levels
+        try:
+            with stage('registry_lookup'):
+                entries = get_registry().by_sha256(current_sha256)
+        except Exception as e:
+            print(f"Registry lookup failed: {e}")
+            entries = []
+        minted = [entry for entry in entries if entry['watermarked_sha256'] == normalize_hex(current_sha256)]
+        if minted:
+            verification_results['verification_levels']['exact_hash'] = {
+                'method': 'SHA-256 (registry)',
+                'match': True,
+                'confidence': 100,
+                'actual': current_sha256,
+                'registry_entry': minted[0]
+            }
+            verification_results['minted_by'] = minted_by(minted[0], 'watermarked_sha256')
+            verification_results['overall_result'] = 'verified'
+            verification_results['confidence'] = 100
+        elif entries:
+            verification_results['verification_levels']['exact_hash'] = {
+                'method': 'SHA-256 (registry)',
+                'match': False,
+                'confidence': 0,
+                'actual': current_sha256,
+                'original_of_minted': True
+            }
+            verification_results['original_of_minted'] = [minted_by(entry, 'original_sha256') for entry in entries]
+    
+    return verification_results
+
+def image_evidence(cv2_image, search=False):
+    """
+    What /verify reads from the pixels: the decoded payload and the pHash
+    
+    Depends only on the image bytes, so it is what the result cache keeps;
+    the registry and pHash index lookups built on it (see verify_evidence)
+    are redone per request, so a later mint is never hidden by a cached
+    verdict. The pHash is skipped when a valid watermark already decides
+    the result.
+    """
+    evidence = {}
+    try:
+        _, parsed, _, search_summary = decode_watermark(cv2_image, search=search)
+        evidence['watermark'] = {'parsed': parsed, 'search': search_summary}
+    except Exception as watermark_error:
+        evidence['watermark'] = {'error': str(watermark_error)}
+        parsed = None
+    
+    if not (parsed and parsed['valid']):
+        try:
+            with stage('phash'):
+                evidence['phash'] = phash_hex(phash64(cv2_image))
+        except Exception as phash_error:
+            evidence['phash_error'] = str(phash_error)
+    return evidence
+
+def verify_evidence(verification_results, evidence, expected_token_id=None, expected_creator=None):
+    """Finish a verification from image_evidence: watermark and pHash levels, then the verdict"""
+    watermark = evidence['watermark']
+    parsed = watermark.get('parsed')
+    
+    # Level 2: Watermark extraction (v2, then legacy v1 payloads)
+    registered = None
+    if parsed and parsed['valid']:
+        # The payload only carries a creator prefix; the registry knows
+        # the full address it was embedded for
+        try:
+            with stage('registry_lookup'):
+                registered = get_registry().by_payload(parsed['token_id'], parsed['creator_address'])
+        except Exception as e:
+            print(f"Registry lookup failed: {e}")
+            registered = []
+    level = watermark_verification.watermark_level(parsed, expected_token_id, expected_creator, registered,
+                                                   watermark.get('search'), watermark.get('error'))
+    verification_results['verification_levels']['watermark'] = level
+    if level['valid']:
+        if registered:
+            verification_results['minted_by'] = minted_by(registered[0], 'watermark')
+        # A valid watermark decides the result; the pHash was not computed
+        verification_results['overall_result'] = 'verified'
+        verification_results['confidence'] = level['confidence']
+        return verification_results
+    
+    # Level 3: Perceptual hash comparison against every embedded image
+    try:
+        if 'phash_error' in evidence:
+            raise ValueError(evidence['phash_error'])
+        index = get_phash_index()
+        current_phash = parse_phash(evidence['phash'])
+        verification_results['current_phash'] = evidence['phash']
+        with stage('phash_lookup'):
+            matches = index.nearest(current_phash, PHASH_MATCH_DISTANCE)
+        
+        perceptual = {
+            'method': 'pHash',
+            'available': True,
+            'indexed_images': len(index),
+            'max_distance': PHASH_MATCH_DISTANCE,
+            'match': False,
+            'confidence': 0
+        }
+        
+        if matches:
+            # Prefer the candidate the caller expects, otherwise the closest
+            distance, entry = matches[0]
+            for candidate_distance, candidate in matches:
+                if expected_token_id and candidate['token_id'] == str(expected_token_id):
+                    distance, entry = candidate_distance, candidate
+                    break
+            
+            phash_match = True
+            if expected_token_id and entry['token_id'] != str(expected_token_id):
+                phash_match = False
+            if expected_creator and entry['creator_address'].lower() != expected_creator.lower():
+                phash_match = False
+            
+            similarity = 1 - distance / 64
+            perceptual.update({
+                'match': phash_match,
+                'distance': distance,
+                'similarity': round(similarity, 3),
+                'confidence': int(round(75 * similarity)) if phash_match else 0,
+                'closest_token': entry
+            })
+        
+        verification_results['verification_levels']['perceptual_hash'] = perceptual
+    
+    except Exception as phash_error:
+        verification_results['verification_levels']['perceptual_hash'] = {
+            'method': 'pHash',
+            'available': False,
+            'match': False,
+            'confidence': 0,
+            'error': str(phash_error)
+        }
+    
+    # Determine overall result
+    return watermark_verification.settle(verification_results)
+
+def verify_cv2_image(cv2_image, current_sha256, expected_sha256=None, expected_token_id=None, expected_creator=None,
+                     search=False):
+    """
+    Run the multi-tier verification on a decoded image
+    
+    current_sha256 is the digest of the uploaded file (see read_image_hashed).
+    With search, an unparseable watermark triggers the extraction search.
+    """
+    verification_results = verify_hashes(current_sha256, expected_sha256)
+    if verification_results['overall_result'] == 'verified':
+        return verification_results
+    return verify_evidence(verification_results, image_evidence(cv2_image, search), expected_token_id,
+                           expected_creator)
 
 @app.route('/health', methods=['GET'])
 def health_check():
@@ -158,11 +1180,36 @@ def health_check():
     return jsonify({
         'status': 'healthy',
         'service': 'PhotoMint Watermarking Service',
-        'version': VERSION,
+        'version': PAYLOAD_VERSION,
         'method': WATERMARK_METHOD,
-        'max_payload_size': MAX_PAYLOAD_SIZE
+        'engine': WATERMARK_ENGINE,
+        'max_payload_size': WatermarkPayload.payload_size(),
+        'batch_workers': BATCH_WORKERS,
+        'embed_offload': EMBED_OFFLOAD,
+        'output_formats': available_formats(),
+        'encode_preset': ENCODE_PRESET,
+        'renditions': {
+            'sizes': RENDITION_SIZES,
+            'format': RENDITION_FORMAT,
+            'quality': RENDITION_QUALITY,
+            'cache': _rendition_cache.stats() if _rendition_cache else None
+        },
+        'tile_budget_mb': TILE_BUDGET_MB,
+        'tile_workers': TILE_WORKERS,
+        'phash_indexed_images': len(get_phash_index()),
+        'result_cache': get_result_cache().stats(),
+        'embed_store': get_embed_store().stats() if EMBED_IDEMPOTENCY else None,
+        'admission': {endpoint: budget.stats() for endpoint, budget in ADMISSION_BUDGETS.items()} if ADMISSION else None,
+        'jobs': get_job_queue().stats(),
+        'registry': get_registry().stats(),
+        'shared_memory': _shm_pool.stats() if _shm_pool else None
     })
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus metrics: latency histograms, stage timings, sizes, in-flight and errors"""
+    return Response(METRICS.render(), content_type=Registry.CONTENT_TYPE)
+
 @app.route('/embed', methods=['POST'])
 def embed_watermark():
     """
@@ -174,76 +1221,278 @@ def embed_watermark():
         "token_id": "123",
         "creator_address": "0x1234...",
         "custom_data": "optional_custom_data",
-        "output_format": "JPEG" (optional),
-        "quality": 95 (optional, for JPEG)
+        "output_format": "JPEG" (optional: JPEG, PNG, WEBP or AVIF),
+        "quality": 95 (optional, for JPEG, WEBP and AVIF),
+        "preset": "fast" (optional: fast, balanced or small),
+        "renditions": "thumbnail,preview" (optional: true for every size)
     }
+    
+    Binary mode: POST the raw image bytes as the body (Content-Type image/*
+    or application/octet-stream) with the other fields in the query string.
+    Send "Accept: image/*" or response=binary to get the watermarked image
+    back as the response body, with the metadata in X-Watermark-* headers.
+    
+    Renditions are scaled from the watermarked pixels before they leave
+    memory and served at GET /renditions/<watermarked_sha256>/<name>.
+    
+    Retries are idempotent: within WATERMARK_IDEMPOTENCY_TTL, a request with
+    the same Idempotency-Key header (or idempotency_key field), or with the
+    same image, token, creator and output options, gets the first
+    watermarked file back unchanged.
     """
     try:
         # Get image data
         if 'file' in request.files:
-            image_file = request.files['file']
-            cv2_image = image_to_cv2(image_file)
+            image_bytes, original_sha256 = read_image_hashed(request.files['file'])
             # Get other parameters from form data
             token_id = request.form.get('token_id')
             creator_address = request.form.get('creator_address')
             custom_data = request.form.get('custom_data', '')
             output_format = request.form.get('output_format', 'JPEG')
             quality = int(request.form.get('quality', 95))
+            preset = request.form.get('preset')
+            idempotency_key = request_idempotency_key(request.form)
+            renditions = requested_renditions(request.form.get('renditions'), RENDITION_SIZES)
+        elif is_raw_image_request():
+            # Raw image body, parameters in the query string
+            image_bytes, original_sha256 = read_stream_hashed(request.stream)
+            token_id = request.args.get('token_id')
+            creator_address = request.args.get('creator_address')
+            custom_data = request.args.get('custom_data', '')
+            output_format = request.args.get('output_format', 'JPEG')
+            quality = int(request.args.get('quality', 95))
+            preset = request.args.get('preset')
+            idempotency_key = request_idempotency_key(request.args)
+            renditions = requested_renditions(request.args.get('renditions'), RENDITION_SIZES)
         else:
             # JSON request
-            data = request.get_json()
+            data = read_json_body()
             if not data or 'image' not in data:
                 return jsonify({'error': 'No image provided'}), 400
             
-            cv2_image = image_to_cv2(data['image'])
+            image_bytes, original_sha256 = read_image_hashed(data.pop('image'))
             token_id = data.get('token_id')
             creator_address = data.get('creator_address')
             custom_data = data.get('custom_data', '')
             output_format = data.get('output_format', 'JPEG')
             quality = data.get('quality', 95)
+            preset = data.get('preset')
+            idempotency_key = request_idempotency_key(data)
+            renditions = requested_renditions(data.get('renditions'), RENDITION_SIZES)
         
         if not token_id or not creator_address:
             return jsonify({'error': 'token_id and creator_address are required'}), 400
+        WatermarkPayload.check_token_id(token_id)
+        check_encode_options(output_format, preset)
         
-        if cv2_image is None:
-            return jsonify({'error': 'Invalid image format'}), 400
+        watermarked_bytes, response_data = embed_once(image_bytes, original_sha256, token_id, creator_address,
+                                                      custom_data, output_format, quality, preset, idempotency_key,
+                                                      renditions)
         
-        # Create watermark payload
-        payload = WatermarkPayload.create_payload(token_id, creator_address, custom_data)
+        if wants_binary_response():
+            return binary_embed_response(watermarked_bytes, response_data)
         
-        print(f"Embedding watermark: {payload.decode('utf-8', errors='ignore')}")
+        with stage('base64_encode'):
+            response_data['watermarked_image'] = base64.b64encode(watermarked_bytes).decode('utf-8')
+        with stage('jsonify'):
+            return jsonify(response_data)
         
-        # Embed watermark
-        encoder = WatermarkEncoder()
-        encoder.set_watermark('bytes', payload)
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return upload_too_large_response()
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ExceedsBudget as e:
+        return jsonify({'error': str(e)}), 413
+    except (EncodeOptionError, InvalidImage, InvalidPayloadField) as e:
+        return jsonify({'error': str(e)}), 400
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
+    except Exception as e:
+        print(f"Watermark embedding error: {e}")
+        return jsonify({'error': f'Watermark embedding failed: {str(e)}'}), 500
+
+@app.route('/embed/batch', methods=['POST'])
+def embed_watermark_batch():
+    """
+    Embed invisible watermarks in many images using the worker pool
+    
+    Request JSON:
+    {
+        "items": [
+            {"image": "base64_encoded_image", "token_id": "123",
+             "creator_address": "0x1234...", "custom_data": "optional"},
+            ...
+        ],
+        "output_format": "JPEG" (optional: JPEG, PNG, WEBP or AVIF),
+        "quality": 95 (optional, for JPEG, WEBP and AVIF),
+        "preset": "fast" (optional: fast, balanced or small)
+    }
+    
+    or multipart with repeated "files", "token_id" and "creator_address"
+    fields (a single creator_address applies to every file). The body is
+    capped at WATERMARK_MAX_BATCH_UPLOAD_MB and each image at
+    WATERMARK_MAX_UPLOAD_MB; a larger image fails on its own line.
+    
+    Response is newline-delimited JSON: one /embed result per item, tagged
+    with its "index", in completion order, followed by a summary line.
+    """
+    try:
+        if request.files:
+            files = request.files.getlist('files') or request.files.getlist('file')
+            token_ids = request.form.getlist('token_id')
+            creators = request.form.getlist('creator_address')
+            custom = request.form.getlist('custom_data')
+            output_format = request.form.get('output_format', 'JPEG')
+            quality = int(request.form.get('quality', 95))
+            preset = request.form.get('preset')
+            
+            if len(creators) == 1:
+                creators = creators * len(files)
+            if len(custom) <= 1:
+                custom = (custom or ['']) * len(files)
+            
+            items = [
+                (f,
+                 token_ids[i] if i < len(token_ids) else None,
+                 creators[i] if i < len(creators) else None,
+                 custom[i] if i < len(custom) else '')
+                for i, f in enumerate(files)
+            ]
+        else:
+            data = read_json_body()
+            if not data or not isinstance(data.get('items'), list):
+                return jsonify({'error': 'No items provided'}), 400
+            
+            output_format = data.get('output_format', 'JPEG')
+            quality = data.get('quality', 95)
+            preset = data.get('preset')
+            default_creator = data.get('creator_address')
+            
+            items = [
+                (item.get('image'),
+                 item.get('token_id'),
+                 item.get('creator_address', default_creator),
+                 item.get('custom_data', ''))
+                for item in data['items']
+            ]
         
-        # Convert BGR to RGB for encoding (OpenCV uses BGR by default)
-        watermarked_bgr = encoder.encode(cv2_image, WATERMARK_METHOD)
+        if not items:
+            return jsonify({'error': 'No images provided'}), 400
         
-        # Convert back to bytes
-        watermarked_bytes = cv2_to_bytes(watermarked_bgr, output_format, quality)
+        if len(items) > MAX_BATCH_SIZE:
+            return jsonify({'error': f'Batch too large: {len(items)} items (max {MAX_BATCH_SIZE})'}), 413
+        check_encode_options(output_format, preset)
         
-        # Calculate hashes for verification
-        original_sha256 = hashlib.sha256(cv2_to_bytes(cv2_image)).hexdigest()
-        watermarked_sha256 = hashlib.sha256(watermarked_bytes).hexdigest()
+        pool = get_batch_pool()
+        futures = {}
+        rejected = {}
+        for index, (image, token_id, creator_address, custom_data) in enumerate(items):
+            # Size-check each image before anything is read or sent to a worker
+            size = upload_size(image) if image else 0
+            if not size:
+                rejected[index] = 'No image provided'
+                continue
+            if size > MAX_UPLOAD_BYTES:
+                rejected[index] = str(UploadTooLarge(MAX_UPLOAD_BYTES))
+                continue
+            if hasattr(image, 'read'):
+                image = image.read()
+            future = pool.submit(embed_batch_item, index, image, token_id, creator_address,
+                                 custom_data, output_format, quality, preset)
+            futures[future] = index
         
-        response_data = {
-            'success': True,
-            'watermarked_image': base64.b64encode(watermarked_bytes).decode('utf-8'),
-            'payload': payload.decode('utf-8', errors='ignore'),
-            'payload_size': len(payload),
-            'method': WATERMARK_METHOD,
-            'original_sha256': original_sha256,
-            'watermarked_sha256': watermarked_sha256,
-            'format': output_format,
-            'timestamp': int(time.time())
-        }
+        started = time.time()
+        
+        def generate():
+            global _batch_pool
+            succeeded = 0
+            failed = 0
+            
+            # Items rejected before submission are reported first
+            for index, error in rejected.items():
+                failed += 1
+                yield json.dumps({'index': index, 'success': False, 'error': error}) + '\n'
+            
+            try:
+                for future in as_completed(futures):
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        # A crashed worker breaks the pool; rebuild it next batch
+                        _batch_pool = None
+                        result = {'index': futures[future], 'success': False,
+                                  'error': f'Worker failed: {str(e)}'}
+                    
+                    if result.get('success'):
+                        succeeded += 1
+                        _, token_id, creator_address, _ = items[result['index']]
+                        record_embed(result, token_id, creator_address)
+                    else:
+                        failed += 1
+                    yield json.dumps(result) + '\n'
+            finally:
+                # Client went away: don't spend workers on abandoned items
+                for future in futures:
+                    future.cancel()
+            
+            yield json.dumps({
+                'done': True,
+                'total': len(items),
+                'succeeded': succeeded,
+                'failed': failed,
+                'workers': BATCH_WORKERS,
+                'elapsed': round(time.time() - started, 3)
+            }) + '\n'
         
-        return jsonify(response_data)
+        return Response(generate(), mimetype='application/x-ndjson')
         
+    except RequestEntityTooLarge:
+        return jsonify({'error': f'Batch too large (max {MAX_BATCH_UPLOAD_MB}MB)'}), 413
+    except EncodeOptionError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        print(f"Watermark embedding error: {e}")
-        return jsonify({'error': f'Watermark embedding failed: {str(e)}'}), 500
+        print(f"Batch embedding error: {e}")
+        return jsonify({'error': f'Batch embedding failed: {str(e)}'}), 500
+
+@app.route('/fingerprint', methods=['POST'])
+def fingerprint_image():
+    """
+    SHA-256, pHash, dHash, aHash and colour histogram of an image, from one decode
+    
+    Request JSON:
+    {
+        "image": "base64_encoded_image" or multipart file
+    }
+    
+    The raw image bytes may also be sent as the body. The pHash is the one
+    the index stores; computePHash64 in scripts/utils.ts gives nearly the
+    same value (see phash_index), so compare them by Hamming distance.
+    """
+    try:
+        if 'file' in request.files:
+            image_bytes, image_sha256 = read_image_hashed(request.files['file'])
+        elif is_raw_image_request():
+            image_bytes, image_sha256 = read_stream_hashed(request.stream)
+        else:
+            data = read_json_body()
+            if not data or 'image' not in data:
+                return jsonify({'error': 'No image provided'}), 400
+            
+            image_bytes, image_sha256 = read_image_hashed(data.pop('image'))
+        
+        cv2_image = image_to_cv2(image_bytes)
+        if cv2_image is None:
+            return jsonify({'error': 'Invalid image format'}), 400
+        
+        with stage('fingerprint'):
+            hashes = fingerprint(cv2_image, image_sha256)
+        return jsonify(dict(hashes, success=True))
+        
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return upload_too_large_response()
+    except Exception as e:
+        print(f"Fingerprint error: {e}")
+        return jsonify({'error': f'Fingerprinting failed: {str(e)}'}), 500
 
 @app.route('/extract', methods=['POST'])
 def extract_watermark():
@@ -253,68 +1502,46 @@ def extract_watermark():
     Request JSON:
     {
         "image": "base64_encoded_image" or multipart file,
-        "expected_payload_size": 64 (optional)
+        "expected_payload_size": 24 (optional, bytes; by default v2 then v1 sizes are tried),
+        "search": true (optional, try crops/rescales/other methods on failure)
     }
+    
+    The raw image bytes may also be sent as the body (Content-Type image/*
+    or application/octet-stream) with parameters in the query string.
     """
     try:
         # Get image data
         if 'file' in request.files:
-            image_file = request.files['file']
-            cv2_image = image_to_cv2(image_file)
-            expected_size = int(request.form.get('expected_payload_size', MAX_PAYLOAD_SIZE))
+            image_bytes, image_sha256 = read_image_hashed(request.files['file'])
+            params = request.form
+        elif is_raw_image_request():
+            # Raw image body, parameters in the query string
+            image_bytes, image_sha256 = read_stream_hashed(request.stream)
+            params = request.args
         else:
             # JSON request
-            data = request.get_json()
+            data = read_json_body()
             if not data or 'image' not in data:
                 return jsonify({'error': 'No image provided'}), 400
             
-            cv2_image = image_to_cv2(data['image'])
-            expected_size = data.get('expected_payload_size', MAX_PAYLOAD_SIZE)
+            image_bytes, image_sha256 = read_image_hashed(data.pop('image'))
+            params = data
         
-        if cv2_image is None:
+        # Without a size, every payload version is tried
+        expected_size = int(params.get('expected_payload_size') or 0) or None
+        response_data = cached_extract(image_bytes, image_sha256, expected_size, search_requested(params))
+        if response_data is None:
             return jsonify({'error': 'Invalid image format'}), 400
         
-        # Try to extract watermark
-        decoder = WatermarkDecoder('bytes', expected_size)
-        
-        try:
-            extracted_payload = decoder.decode(cv2_image, WATERMARK_METHOD)
-            
-            # Parse payload
-            parsed = WatermarkPayload.parse_payload(extracted_payload)
-            
-            if parsed:
-                response_data = {
-                    'success': True,
-                    'watermark_found': True,
-                    'payload': extracted_payload.decode('utf-8', errors='ignore'),
-                    'parsed': parsed,
-                    'method': WATERMARK_METHOD,
-                    'extraction_timestamp': int(time.time())
-                }
-            else:
-                response_data = {
-                    'success': True,
-                    'watermark_found': True,
-                    'payload': extracted_payload.decode('utf-8', errors='ignore'),
-                    'parsed': None,
-                    'error': 'Invalid payload format or checksum mismatch',
-                    'method': WATERMARK_METHOD,
-                    'extraction_timestamp': int(time.time())
-                }
-            
+        with stage('jsonify'):
             return jsonify(response_data)
-            
-        except Exception as decode_error:
-            print(f"Watermark extraction failed: {decode_error}")
-            return jsonify({
-                'success': True,
-                'watermark_found': False,
-                'error': f'No watermark detected: {str(decode_error)}',
-                'method': WATERMARK_METHOD,
-                'extraction_timestamp': int(time.time())
-            })
         
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return upload_too_large_response()
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ExceedsBudget as e:
+        return jsonify({'error': str(e)}), 413
     except Exception as e:
         print(f"Watermark extraction error: {e}")
         return jsonify({'error': f'Watermark extraction failed: {str(e)}'}), 500
@@ -329,137 +1556,186 @@ def verify_image():
         "image": "base64_encoded_image",
         "expected_sha256": "abc123..." (optional),
         "expected_token_id": "123" (optional),
-        "expected_creator": "0x123..." (optional)
+        "expected_creator": "0x123..." (optional),
+        "search": true (optional, see /extract)
     }
+    
+    The image may also be a multipart file (expectations as form fields) or
+    the raw request body (expectations in the query string).
     """
     try:
-        data = request.get_json()
-        if not data or 'image' not in data:
-            return jsonify({'error': 'No image provided'}), 400
-        
-        cv2_image = image_to_cv2(data['image'])
-        if cv2_image is None:
-            return jsonify({'error': 'Invalid image format'}), 400
+        if 'file' in request.files:
+            image_bytes, image_sha256 = read_image_hashed(request.files['file'])
+            params = request.form
+        elif is_raw_image_request():
+            image_bytes, image_sha256 = read_stream_hashed(request.stream)
+            params = request.args
+        else:
+            data = read_json_body()
+            if not data or 'image' not in data:
+                return jsonify({'error': 'No image provided'}), 400
+            
+            image_bytes, image_sha256 = read_image_hashed(data.pop('image'))
+            params = data
         
-        expected_sha256 = data.get('expected_sha256')
-        expected_token_id = data.get('expected_token_id')
-        expected_creator = data.get('expected_creator')
+        expected_sha256 = params.get('expected_sha256')
+        expected_token_id = params.get('expected_token_id')
+        expected_creator = params.get('expected_creator')
         
-        # Calculate current image hash
-        current_image_bytes = cv2_to_bytes(cv2_image)
-        current_sha256 = hashlib.sha256(current_image_bytes).hexdigest()
+        verification_results = cached_verify(image_bytes, image_sha256, expected_sha256,
+                                             expected_token_id, expected_creator, search_requested(params))
+        if verification_results is None:
+            return jsonify({'error': 'Invalid image format'}), 400
         
-        verification_results = {
-            'current_sha256': current_sha256,
-            'verification_levels': {},
-            'overall_result': 'unknown',
-            'confidence': 0,
-            'timestamp': int(time.time())
-        }
+        with stage('jsonify'):
+            return jsonify(verification_results)
         
-        # Level 1: Exact SHA-256 match
-        if expected_sha256:
-            sha256_match = current_sha256.lower() == expected_sha256.lower()
-            verification_results['verification_levels']['exact_hash'] = {
-                'method': 'SHA-256',
-                'match': sha256_match,
-                'confidence': 100 if sha256_match else 0,
-                'expected': expected_sha256,
-                'actual': current_sha256
-            }
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return upload_too_large_response()
+    except Overloaded as e:
+        return overloaded_response(e)
+    except ExceedsBudget as e:
+        return jsonify({'error': str(e)}), 413
+    except Exception as e:
+        print(f"Verification error: {e}")
+        return jsonify({'error': f'Verification failed: {str(e)}'}), 500
+
+@app.route('/jobs', methods=['POST'])
+def submit_job():
+    """
+    Queue an embed, extract or verify request and return its job ID at once
+    
+    Takes the same image and fields as the synchronous endpoint plus "type":
+    {
+        "type": "embed" | "extract" | "verify",
+        "image": "base64_encoded_image" or multipart file,
+        ... fields of /embed, /extract or /verify
+    }
+    
+    The raw image may also be the request body with the fields in the query
+    string. Responds 202 with the job ID, or 429 with Retry-After when the
+    queue is full. Poll GET /jobs/<job_id> for the result.
+    """
+    try:
+        if 'file' in request.files:
+            image_bytes, image_sha256 = read_image_hashed(request.files['file'])
+            params = request.form
+        elif is_raw_image_request():
+            image_bytes, image_sha256 = read_stream_hashed(request.stream)
+            params = request.args
+        else:
+            data = read_json_body()
+            if not data or 'image' not in data:
+                return jsonify({'error': 'No image provided'}), 400
             
-            if sha256_match:
-                verification_results['overall_result'] = 'verified'
-                verification_results['confidence'] = 100
-                return jsonify(verification_results)
+            image_bytes, image_sha256 = read_image_hashed(data.pop('image'))
+            params = data
         
-        # Level 2: Watermark extraction
-        try:
-            decoder = WatermarkDecoder('bytes', MAX_PAYLOAD_SIZE)
-            extracted_payload = decoder.decode(cv2_image, WATERMARK_METHOD)
-            parsed = WatermarkPayload.parse_payload(extracted_payload)
-            
-            watermark_confidence = 0
-            watermark_match = False
+        # Jobs outlive the request, and with it the upload buffer
+        image_bytes = bytes(image_bytes)
+        job_type = params.get('type', 'embed')
+        if job_type == 'embed':
+            token_id = params.get('token_id')
+            creator_address = params.get('creator_address')
+            if not token_id or not creator_address:
+                return jsonify({'error': 'token_id and creator_address are required'}), 400
+            WatermarkPayload.check_token_id(token_id)
             
-            if parsed and parsed['valid']:
-                watermark_confidence = 85  # High confidence for valid watermark
-                
-                # Check specific expectations
-                if expected_token_id and parsed['token_id'] == str(expected_token_id):
-                    watermark_confidence = 90
-                    watermark_match = True
-                
-                if expected_creator and expected_creator.lower().startswith(parsed['creator_address'].lower()):
-                    watermark_confidence = 95
-                    watermark_match = True
-                
-                verification_results['verification_levels']['watermark'] = {
-                    'method': 'DWT-DCT Watermark',
-                    'found': True,
-                    'valid': True,
-                    'match': watermark_match,
-                    'confidence': watermark_confidence,
-                    'extracted_data': parsed
-                }
-                
-                if watermark_confidence >= 85:
-                    verification_results['overall_result'] = 'verified'
-                    verification_results['confidence'] = watermark_confidence
-                    return jsonify(verification_results)
-            else:
-                verification_results['verification_levels']['watermark'] = {
-                    'method': 'DWT-DCT Watermark',
-                    'found': True,
-                    'valid': False,
-                    'match': False,
-                    'confidence': 0,
-                    'error': 'Invalid watermark payload'
-                }
-        
-        except Exception as watermark_error:
-            verification_results['verification_levels']['watermark'] = {
-                'method': 'DWT-DCT Watermark',
-                'found': False,
-                'valid': False,
-                'match': False,
-                'confidence': 0,
-                'error': str(watermark_error)
-            }
+            check_encode_options(params.get('output_format', 'JPEG'), params.get('preset'))
+            args = (embed_job, image_bytes, image_sha256, token_id, creator_address,
+                    params.get('custom_data', ''), params.get('output_format', 'JPEG'),
+                    int(params.get('quality', 95)), params.get('preset'), request_idempotency_key(params),
+                    requested_renditions(params.get('renditions'), RENDITION_SIZES))
+        elif job_type == 'extract':
+            expected_size = int(params.get('expected_payload_size') or 0) or None
+            args = (extract_job, image_bytes, image_sha256, expected_size, search_requested(params))
+        elif job_type == 'verify':
+            args = (verify_job, image_bytes, image_sha256, params.get('expected_sha256'),
+                    params.get('expected_token_id'), params.get('expected_creator'), search_requested(params))
+        else:
+            return jsonify({'error': f'Unknown job type: {job_type}'}), 400
         
-        # Level 3: Perceptual hash comparison (placeholder - would need reference pHash)
-        verification_results['verification_levels']['perceptual_hash'] = {
-            'method': 'pHash',
-            'available': False,
-            'note': 'Requires reference pHash for comparison'
-        }
+        try:
+            job = get_job_queue().submit(job_type, *args)
+        except QueueFull as e:
+            response = jsonify({'error': str(e)})
+            response.headers['Retry-After'] = str(JOB_RETRY_AFTER)
+            return response, 429
         
-        # Determine overall result
-        max_confidence = max([
-            level.get('confidence', 0) 
-            for level in verification_results['verification_levels'].values()
-            if isinstance(level, dict)
-        ])
+        response = jsonify(job.to_dict())
+        response.headers['Location'] = f"/jobs/{job.id}"
+        return response, 202
         
-        verification_results['confidence'] = max_confidence
-        if max_confidence >= 80:
-            verification_results['overall_result'] = 'verified'
-        elif max_confidence >= 50:
-            verification_results['overall_result'] = 'partial'
+    except (UploadTooLarge, RequestEntityTooLarge):
+        return upload_too_large_response()
+    except (EncodeOptionError, InvalidPayloadField) as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        print(f"Job submission error: {e}")
+        return jsonify({'error': f'Job submission failed: {str(e)}'}), 500
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def get_job(job_id):
+    """Status of a queued job, with its result once done"""
+    job = get_job_queue().get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found or expired'}), 404
+    return jsonify(job)
+
+@app.route('/renditions/<watermarked_sha256>', methods=['GET'])
+def rendition_manifest(watermarked_sha256):
+    """Renditions still cached for a watermarked master, by name"""
+    sha256 = normalize_sha256(watermarked_sha256)
+    manifest = get_rendition_cache().get_manifest(sha256)
+    if manifest is None:
+        return jsonify({'error': 'No renditions for this image'}), 404
+    return jsonify({name: dict(entry, url=f'/renditions/{sha256}/{name}') for name, entry in manifest.items()})
+
+@app.route('/renditions/<watermarked_sha256>/<name>', methods=['GET'])
+def rendition_file(watermarked_sha256, name):
+    """One rendition of a watermarked master (thumbnail, preview, full, ...)"""
+    cache = get_rendition_cache()
+    manifest = cache.get_manifest(normalize_sha256(watermarked_sha256))
+    entry = (manifest or {}).get(name)
+    path = cache.open(entry['file']) if entry else None
+    if path is None:
+        return jsonify({'error': 'Rendition not found or evicted'}), 404
+    # The file is named by its content hash, which makes a strong ETag
+    return send_file(path, mimetype=get_format(entry['format']).mimetype, etag=entry['sha256'], max_age=86400)
+
+@app.route('/registry', methods=['GET'])
+def registry_lookup():
+    """
+    Recorded embeds by token_id, sha256 (minted or original file) or creator
+    
+    GET /registry?token_id=123 | ?sha256=abc... | ?creator=0x...
+    """
+    try:
+        registry = get_registry()
+        limit = min(int(request.args.get('limit', 20)), 100)
+        if request.args.get('token_id'):
+            entries = registry.by_token(request.args['token_id'], limit)
+        elif request.args.get('sha256'):
+            entries = registry.by_sha256(request.args['sha256'], limit)
+        elif request.args.get('creator'):
+            entries = registry.by_creator(request.args['creator'], limit)
         else:
-            verification_results['overall_result'] = 'unverified'
-        
-        return jsonify(verification_results)
+            return jsonify({'error': 'token_id, sha256 or creator is required'}), 400
+        return jsonify({'entries': entries, 'count': len(entries)})
         
     except Exception as e:
-        print(f"Verification error: {e}")
-        return jsonify({'error': f'Verification failed: {str(e)}'}), 500
+        print(f"Registry lookup error: {e}")
+        return jsonify({'error': f'Registry lookup failed: {str(e)}'}), 500
 
 if __name__ == '__main__':
     print("🛡️ Starting PhotoMint Watermarking Service...")
-    print(f"📊 Method: {WATERMARK_METHOD}")
-    print(f"📦 Max Payload Size: {MAX_PAYLOAD_SIZE} bytes")
-    print(f"🔧 Version: {VERSION}")
+    print(f"📊 Method: {WATERMARK_METHOD} ({WATERMARK_ENGINE} engine)")
+    print(f"📦 Payload Size: {WatermarkPayload.payload_size()} bytes")
+    print(f"🔧 Payload Version: {PAYLOAD_VERSION}")
+    print(f"👷 Batch Workers: {BATCH_WORKERS}")
+    print(f"📥 Job Workers: {JOB_WORKERS} (queue depth {JOB_QUEUE_DEPTH})")
+    
+    print("ℹ️  Development server; for production run: gunicorn -c gunicorn.conf.py wsgi:app")
     
     # Run the server on port 5001 (avoid conflict with macOS AirPlay)
     app.run(host='0.0.0.0', port=5001, debug=True)
@@ -0,0 +1,14 @@
+#!/usr/bin/env python3
+"""
+Production entry point for the watermarking service
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+gunicorn.conf.py preloads this module in the master process, so
+cv2/numpy/imwatermark are imported and the engine is warmed up once before
+the workers are forked.
+"""
+
+from watermark_server import app, warmup
+
+warmup()